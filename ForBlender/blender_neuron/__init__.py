@@ -3,7 +3,6 @@ from blender_neuron.blender_neuron.server import NeuroServer
 
 import bpy, threading
 from bpy.app.handlers import persistent
-import cProfile
 
 
 bl_info = {
@@ -128,8 +127,9 @@ def register():
     bpy.utils.register_class(NEURONServerStopOperator)
     bpy.utils.register_class(NEURONClearModelOperator)
     
-    # This ensures the server starts on Blender load
-    bpy.app.handlers.scene_update_post.append(auto_start)
+    # This ensures the server starts on Blender load, except for batch scene builds (see batch.py)
+    if not bpy.app.background:
+        bpy.app.handlers.scene_update_post.append(auto_start)
 
 
 def unregister():
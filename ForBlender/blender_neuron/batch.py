@@ -0,0 +1,33 @@
+"""
+Builds a Blender scene from a scene package saved by the NEURON client's save_scene_package method. Does not
+need NEURON or a running BlenderNEURON server, which allows building .blend files in batch jobs.
+
+Usage:
+
+    blender --background --python <addons dir>/blender_neuron/batch.py -- model.bnpkg model.blend
+"""
+
+import os, sys, argparse
+
+
+def main(argv=None):
+    if argv is None:
+        # Blender ignores arguments after '--'
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(description="Builds a .blend file from a BlenderNEURON scene package")
+    parser.add_argument("package", help="The scene package file saved by the NEURON client")
+    parser.add_argument("output", help="The .blend file to save")
+    args = parser.parse_args(argv)
+
+    # The compiled server modules are next to this script, so the addon does not need to be installed
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_neuron"))
+    from server import NeuroServer
+
+    server = NeuroServer()
+    server.build_from_package(args.package)
+    server.save_scene(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,33 @@
-from mathutils import Color
+import numpy as np
+
+# Palettes are cached, see: get_distinct
+palettes = {}
 
 
 def get_distinct(count, hue_start=0.5, hue_end=0.17):
-    result = []
-    hue_step = (hue_end-hue_start)/(count-1)
-    for n in range(count):
-        c = Color()
-        c.hsv = (hue_start+n*hue_step, 1, 0.85)
-        result.append((c.r,c.g,c.b))
-    return result
+    # Returns a count x 3 array of RGB colors with evenly spaced hues
+    key = (count, hue_start, hue_end)
+
+    if key not in palettes:
+        palettes[key] = hsv_to_rgb(np.linspace(hue_start, hue_end, count), 1.0, 0.85)
+
+    return palettes[key]
+
+
+def hsv_to_rgb(hues, saturation, value):
+    # Vectorized colorsys.hsv_to_rgb for an array of hues
+    hues = np.asarray(hues, dtype=float) % 1.0
+    sector = np.floor(hues * 6.0)
+    f = hues * 6.0 - sector
+    sector = sector.astype(int) % 6
+
+    p = np.full(len(hues), value * (1.0 - saturation))
+    q = value * (1.0 - saturation * f)
+    t = value * (1.0 - saturation * (1.0 - f))
+    v = np.full(len(hues), value)
+
+    # RGB order of the (v, t, p, q) components in each of the 6 hue sectors
+    components = np.stack((v, t, p, q), axis=1)
+    order = np.array([[0, 1, 2], [3, 0, 2], [2, 0, 1], [2, 3, 0], [1, 2, 0], [0, 2, 3]])
+
+    return components[np.arange(len(hues))[:, None], order[sector]]
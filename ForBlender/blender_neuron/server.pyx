@@ -3,10 +3,14 @@
 
 import numpy as np
 
-import bmesh, operator, bpy, threading, queue, marshal, zlib, traceback, time, re, inspect, colors
+import bmesh, operator, bpy, threading, marshal, zlib, json, traceback, time, re, inspect, colors, os, collections
+import subprocess, tempfile, shutil, base64
 from math import sqrt, radians, atan, tan, degrees
 from statistics import mean
 
+# The activity values (e.g. mV) shown at rest and with the full emission, see: activity_to_intensity
+ACTIVITY_RANGE = (-50.0, 0.0)
+
 class NeuroServer:
 
     def __init__(self, global_name = "BN"):
@@ -81,7 +85,16 @@ class NeuroServer:
         self.segment_subdivisions = 2
         self.circular_subdivisions = 8
 
-        self.objects = {}
+        # Each client session has its own model state (objects, materials etc.), which is set on the server while
+        # the session's tasks run. Clients that don't open a session use the default "" session. See: open_session
+        self.sessions = {}
+        self.session_id = ""
+        self.session_count = 0
+
+        for name, value in self.new_session_state("").items():
+            setattr(self, name, value)
+
+        self.render_job = None
         self.has_linked = False
         self.link_lock = threading.Lock()
 
@@ -89,26 +102,121 @@ class NeuroServer:
         self.tasks = {}
         self.task_next_id = 0
 
-        self.queue = queue.Queue()
-        self.progress_start()
+        self.queue = SessionQueue()
+        self.current_task = None
+
+        # Limits of the request listener. At most max_request_threads requests are handled at once, others wait for a
+        # thread. Requests larger than small_request_bytes are answered with 503 (busy), which clients retry later,
+        # while the requests of received and not yet run tasks add up to more than max_pending_bytes, or while
+        # max_queue_length tasks are queued.
+        self.max_request_threads = 8
+        self.max_pending_bytes = 256 * 1024 * 1024
+        self.max_queue_length = 1000
+        self.small_request_bytes = 64 * 1024
+        self.pending_bytes = 0
+        self.request_local = threading.local()
+
+        # Session id -> progress of the session's last send, see: progress_start
+        self.progress = {}
+
+        # Task timings and counters, see: enable_metrics
+        self.metrics = None
+        self.keyframes_inserted = 0
+
+    def new_session_state(self, name_prefix):
+        return {
+            # Blender object and material names of the session start with this
+            "name_prefix": name_prefix,
+
+            "objects": {},
+            "pending_cells": {},
+
+            # Material name -> (material, class id), and class name -> class id, see: color_by_unique_materials
+            "material_classes": {},
+            "class_ids": {},
+
+            # Object-space [mins, maxes] of each object, see: get_model_bounds
+            "object_bounds": {},
+            "archive": None,
+
+            # Activity buffered for apply_activity_texture or bake_activity_colors, and what they create
+            "buffered_activity": {},
+            "activity_texture": None,
+            "baked_activity": None,
+        }
+
+    def open_session(self, name = ""):
+        # Returns the id of a new session, whose objects and materials are named "<id>:<name>"
+        with self.task_lock:
+            self.session_count += 1
+            session_id = "S" + str(self.session_count)
+
+        self.sessions[session_id] = self.new_session_state(session_id + ":")
+        print_safe("Opened session " + session_id + " " + name)
+
+        return session_id
+
+    def close_session(self, session_id):
+        # Waits for the session's queued tasks, and clears its objects
+        return self.run_lambda(lambda: self.remove_session(session_id), "close_session", session = session_id)
+
+    def remove_session(self, session_id):
+        self.clear()
+
+        if session_id != "":
+            self.use_session("")
+            self.sessions.pop(session_id, None)
+            self.progress.pop(session_id, None)
+
+    def use_session(self, session_id):
+        if session_id == self.session_id:
+            return
+
+        if session_id not in self.sessions:
+            raise Exception("Session " + session_id + " does not exist. It may have been closed.")
+
+        # Keep the current session's state, and set the other's
+        current = self.new_session_state("")
+
+        for name in current:
+            current[name] = getattr(self, name)
+
+        self.sessions[self.session_id] = current
+
+        for name, value in self.sessions.pop(session_id).items():
+            setattr(self, name, value)
+
+        self.session_id = session_id
 
     def run_command(self, command_string):
-        exec_lambda = self.get_command_lambda(command_string)
-        return self.run_lambda(exec_lambda)
+        return self.session_run_command("", command_string)
 
     def enqueue_command(self, command_string):
-        exec_lambda = self.get_command_lambda(command_string)
-        return self.enqueue_lambda(exec_lambda)
+        return self.session_enqueue_command("", command_string)
 
     def run_method(self, method, args, kwargs):
+        return self.session_run_method("", method, args, kwargs)
+
+    def enqueue_method(self, method, args, kwargs, timeout = None):
+        return self.session_enqueue_method("", method, args, kwargs, timeout)
+
+    def session_run_command(self, session_id, command_string):
+        exec_lambda = self.get_command_lambda(command_string)
+        return self.run_lambda(exec_lambda, "command", session = session_id)
+
+    def session_enqueue_command(self, session_id, command_string):
+        exec_lambda = self.get_command_lambda(command_string)
+        return self.enqueue_lambda(exec_lambda, "command", session = session_id)
+
+    def session_run_method(self, session_id, method, args, kwargs):
         task_lambda = lambda: getattr(self, method)(*args, **kwargs)
 
-        return self.run_lambda(task_lambda)
+        return self.run_lambda(task_lambda, method, args, session_id)
 
-    def enqueue_method(self, method, args, kwargs):
+    def session_enqueue_method(self, session_id, method, args, kwargs, timeout = None):
         task_lambda = lambda: getattr(self, method)(*args, **kwargs)
 
-        return self.enqueue_lambda(task_lambda)
+        return self.enqueue_lambda(task_lambda, method, args, session_id, timeout)
 
     def get_command_lambda(self, command_string):
         """
@@ -137,10 +245,10 @@ class NeuroServer:
         task_lambda = lambda: getattr(self, method)(*args, **kwargs)
         return task_lambda
 
-    def run_lambda(self, task_lambda):
-        id = self.enqueue_lambda(task_lambda)
+    def run_lambda(self, task_lambda, name = "lambda", args = (), session = ""):
+        id = self.enqueue_lambda(task_lambda, name, args, session)
 
-        while self.get_task_status(id) == 'QUEUED':
+        while self.get_task_status(id) in ['QUEUED', 'RUNNING']:
             time.sleep(0.1)
 
         status = self.get_task_status(id)
@@ -151,10 +259,22 @@ class NeuroServer:
         else:
             raise Exception(self.get_task_error(id))
 
-    def enqueue_lambda(self, task_lambda):
+    def enqueue_lambda(self, task_lambda, name = "lambda", args = (), session = "", timeout = None):
         task_id = self.get_new_task_id()
 
-        task = {"id": task_id, "status": "QUEUED", "lambda": task_lambda, "result": None, "error": None}
+        task = {"id": task_id, "name": name, "status": "QUEUED", "lambda": task_lambda, "result": None, "error": None,
+                "session": session, "cancel": None}
+
+        # Tasks not done within timeout seconds of being queued are cancelled, see: check_cancelled
+        task["deadline"] = time.time() + timeout if timeout is not None else None
+
+        if self.metrics is not None:
+            task["queued_at"] = time.time()
+            task["bytes"] = get_payload_size(args)
+
+        # The bytes reserved by the request that queued the task stay pending until the task is done
+        task["request_bytes"] = getattr(self.request_local, "size", 0)
+        self.request_local.size = 0
 
         self.tasks[task_id] = task
         self.queue.put(task)
@@ -180,6 +300,74 @@ class NeuroServer:
     def get_task_result(self, task_id):
         return self.tasks[task_id]["result"]
 
+    def get_queue_length(self):
+        return self.queue.qsize()
+
+    def reserve_request(self, size):
+        # Returns False if the server is too busy to accept a request of this many bytes
+        with self.task_lock:
+            busy = size > self.small_request_bytes and (
+                self.queue.qsize() >= self.max_queue_length or
+                (self.pending_bytes > 0 and self.pending_bytes + size > self.max_pending_bytes)
+            )
+
+            if not busy:
+                self.pending_bytes += size
+
+        if busy and self.metrics is not None:
+            self.metrics["busy_responses"] += 1
+
+        return not busy
+
+    def release_request(self, size):
+        with self.task_lock:
+            self.pending_bytes -= size
+
+    def cancel_task(self, task_id, reason = "Cancelled"):
+        # Queued tasks are skipped, running tasks stop at their next check_cancelled. The lock keeps the worker from
+        # starting the task between the status check and the change.
+        with self.task_lock:
+            task = self.tasks.get(task_id)
+
+            if task is None or task["status"] not in ["QUEUED", "RUNNING"]:
+                return False
+
+            if task["status"] == "QUEUED":
+                task["status"] = "CANCELLED"
+                task["error"] = reason
+
+            else:
+                task["cancel"] = reason
+
+        return True
+
+    def cancel_tasks(self, task_ids, reason = "Cancelled"):
+        # Cancels several tasks, e.g. those of a client's send, returns the number cancelled
+        return sum(self.cancel_task(task_id, reason) for task_id in task_ids)
+
+    def cancel_all(self, session_id = None, reason = "Cancelled"):
+        # Cancels the queued and running tasks of a session, or of all sessions if None
+        cancelled = 0
+
+        for task in list(self.tasks.values()):
+            if session_id is None or task["session"] == session_id:
+                cancelled += self.cancel_task(task["id"], reason)
+
+        return cancelled
+
+    def check_cancelled(self):
+        # Called by long running tasks, e.g. between cells, to stop if the task was cancelled or is past its deadline
+        task = self.current_task
+
+        if task is None:
+            return
+
+        if task["cancel"] is not None:
+            raise TaskCancelled(task["cancel"])
+
+        if task["deadline"] is not None and time.time() > task["deadline"]:
+            raise TaskCancelled("Deadline passed")
+
     def work_on_queue_tasks(self):
         q = self.queue
         
@@ -187,18 +375,37 @@ class NeuroServer:
             print_safe("Tasks in queue. Getting next task...")
             task = q.get()
 
+            # Tasks are started under the lock, so they can't be cancelled while they become RUNNING
+            with self.task_lock:
+                if task["status"] == "QUEUED" and task["deadline"] is not None and time.time() > task["deadline"]:
+                    task["status"] = "CANCELLED"
+                    task["error"] = "Deadline passed before the task started"
+
+                if task["status"] == "QUEUED":
+                    task["status"] = "RUNNING"
+
+            if task["status"] == "CANCELLED":
+                print_safe(task["error"] + ". SKIPPING.")
+                self.release_request(task["request_bytes"])
+                q.task_done()
+                continue
+
+            started = self.start_task_metrics(task) if self.metrics is not None else None
+
             try:
-                if not self.queue_error:
-                    print_safe("Running task...")
-                    result = task["lambda"]()
-                    task["result"] = result
-                    task["status"] = "SUCCESS"
-                else:
-                    print_safe("Previous task had an error. SKIPPING.")
-                    task["status"] = "ERROR"
+                print_safe("Running task...")
+                self.current_task = task
+                self.use_session(task["session"])
+                result = task["lambda"]()
+                task["result"] = result
+                task["status"] = "SUCCESS"
+
+            except TaskCancelled as e:
+                task["status"] = "CANCELLED"
+                task["error"] = str(e)
+                print_safe(task["error"] + ". STOPPED.")
 
             except:
-                self.queue_error = True
                 tb = traceback.format_exc()
 
                 task["status"] = "ERROR"
@@ -206,14 +413,89 @@ class NeuroServer:
 
                 print_safe(tb)
 
+                # Later tasks of the session (e.g. of the same send) likely depend on this one, other sessions continue
+                self.cancel_all(task["session"], "Previous task had an error")
+
+            self.current_task = None
+            self.release_request(task["request_bytes"])
+
+            # Metrics could have been disabled while the task was running
+            if started is not None and self.metrics is not None:
+                self.finish_task_metrics(task, started)
+
             q.task_done()
             print_safe("DONE")
 
+        # Direct calls (e.g. from the addon panel) use the default session
+        self.use_session("")
+
+    def enable_metrics(self, enabled = True):
+        # Timings and counters of each task type, and of received requests
+        if enabled and self.metrics is None:
+            self.reset_metrics(force = True)
+
+        elif not enabled:
+            self.metrics = None
+
+        return 0
+
+    def reset_metrics(self, force = False):
+        if self.metrics is not None or force:
+            self.metrics = {"tasks": {}, "requests": 0, "bytes_received": 0.0, "busy_responses": 0, "since": time.time()}
+
+        return 0
+
+    def get_metrics(self):
+        if self.metrics is None:
+            return {"enabled": False}
+
+        result = dict(self.metrics)
+        result["enabled"] = True
+        result["tasks"] = dict((name, dict(m)) for name, m in self.metrics["tasks"].items())
+        result["queue_length"] = self.queue.qsize()
+        result["pending_bytes"] = self.pending_bytes
+
+        return result
+
+    def count_request(self, byte_count):
+        metrics = self.metrics
+
+        if metrics is not None:
+            metrics["requests"] += 1
+            metrics["bytes_received"] += byte_count
+
+    def start_task_metrics(self, task):
+        return (time.time(), len(bpy.data.objects), len(bpy.data.materials), self.keyframes_inserted)
+
+    def finish_task_metrics(self, task, started):
+        start_time, object_count, material_count, keyframe_count = started
+        run_time = time.time() - start_time
+
+        tasks = self.metrics["tasks"]
+
+        if task["name"] not in tasks:
+            tasks[task["name"]] = {
+                "count": 0, "errors": 0, "queue_wait": 0.0, "run_time": 0.0, "max_run_time": 0.0,
+                "objects": 0, "materials": 0, "keyframes": 0, "bytes": 0.0
+            }
+
+        m = tasks[task["name"]]
+        m["count"] += 1
+        m["errors"] += 1 if task["status"] == "ERROR" else 0
+        m["queue_wait"] += start_time - task.get("queued_at", start_time)
+        m["run_time"] += run_time
+        m["max_run_time"] = max(m["max_run_time"], run_time)
+
+        # Net number of created items, tasks that remove them (e.g. clear) count as 0
+        m["objects"] += max(0, len(bpy.data.objects) - object_count)
+        m["materials"] += max(0, len(bpy.data.materials) - material_count)
+        m["keyframes"] += self.keyframes_inserted - keyframe_count
+        m["bytes"] += task.get("bytes", 0)
+
     def service_queue(self):
         q = self.queue
 
         if not q.empty():
-            self.queue_error = False
             self.queue_servicer = threading.Thread(target=self.work_on_queue_tasks)
             self.queue_servicer.daemon = True
             
@@ -221,79 +503,544 @@ class NeuroServer:
             self.queue_servicer.join()
             print_safe("Task queue DONE")
 
-    def progress_start(self):
-        self.tasks_total = 0
-        self.tasks_done = 0
-        return 0
+    def progress_start(self, session_id = "", totals = None):
+        # Starts counting the units (e.g. cells, activity parts) of a send, totals are the expected count of each
+        self.progress[session_id] = {
+            "since": time.time(),
+            "last": time.time(),
+            "total": dict(totals or {}),
+            "done": dict((unit, 0) for unit in (totals or {})),
+        }
 
-    def progress_add(self, task, count = 1):
-        self.tasks_total += count
-        self.queue.put(task)
         return 0
 
-    def progress_complete(self):
-        self.tasks_done += 1
+    def progress_complete(self, unit, count = 1):
+        # Called by tasks, for the session that is running them
+        progress = self.progress.get(self.session_id)
+
+        if progress is not None:
+            progress["done"][unit] = progress["done"].get(unit, 0) + count
+            progress["last"] = time.time()
+
         return 0
 
-    def progress_get_done(self):
-        return self.tasks_done
+    def get_progress(self, session_id = ""):
+        # The done and total units of the session's last send, with their rates (per second) and the estimated
+        # seconds until all are done. Tasks is the number of the session's queued and running tasks.
+        progress = self.progress.get(session_id)
+        current = self.current_task
+
+        result = {
+            "done": {}, "total": {}, "rates": {}, "eta": None, "elapsed": 0.0,
+            "tasks": self.queue.session_size(session_id) + (current is not None and current["session"] == session_id),
+        }
+
+        if progress is None:
+            return result
+
+        elapsed = time.time() - progress["since"]
+        result.update(done = dict(progress["done"]), total = dict(progress["total"]), elapsed = elapsed)
 
-    def progress_get_total(self):
-        return self.tasks_total
+        # Rates until the last completed unit, so that they don't drop once the send is done
+        active = progress["last"] - progress["since"]
+        remaining = []
+
+        for unit, done in progress["done"].items():
+            result["rates"][unit] = done / active if active > 0 else 0.0
+
+            total = progress["total"].get(unit)
+
+            if total is not None and done < total:
+                remaining.append((total - done) / result["rates"][unit] if done > 0 else None)
+
+        # Unknown until each unit has some progress
+        if None not in remaining:
+            result["eta"] = max(remaining or [0.0])
+
+        return result
 
     # Executed on first export from simulator
     def on_first_link(self):
         # Add a sun lamp
         bpy.ops.object.lamp_add(type="SUN", location=(10000, 10000, 10000))
+        self.all_select(select=False)
 
         # Set reasonable units
         bpy.context.scene.unit_settings.system = 'METRIC'
         bpy.context.scene.unit_settings.scale_length = 0.001
 
     def set_segment_activities(self, segments):
+        segments = unpack_payload(segments)
+
         for seg in segments:
+            self.check_cancelled()
             self.set_segment_activity(seg["name"], seg["times"], seg["activity"])
 
+    def append_segment_activities(self, segments):
+        segments = unpack_payload(segments)
+
+        self.set_segment_activities(segments)
+
+        # Extend the animation to include the streamed frames
+        scene = bpy.context.scene
+        last_frame = max([max(seg["times"]) for seg in segments if len(seg["times"]) > 0] or [0])
+
+        if last_frame > scene.frame_end:
+            scene.frame_end = int(last_frame) + 1
+
+    def clear_segment_activities(self):
+        for obj in self.objects.values():
+            if hasattr(obj["object"].data, "materials"):
+                for mat in obj["object"].data.materials:
+                    if mat is not None:
+                        mat.animation_data_clear()
+
     def set_segment_activity(self, name, times, activity):
-        if name not in bpy.data.materials:
-            return
+        seg_mat = bpy.data.materials.get(self.name_prefix + name)
+
+        if seg_mat is not None:
+            self.set_material_activity(seg_mat, times, activity)
 
-        seg_mat = bpy.data.materials[name]
+        self.progress_complete("activity")
 
+    def set_material_activity(self, seg_mat, times, activity):
         intensity = list(map(self.activity_to_intensity, activity))
 
         for t in range(len(times)):
             seg_mat.emit = intensity[t]
-            seg_mat.keyframe_insert(data_path="emit", frame=int(times[t]))
+            seg_mat.keyframe_insert(data_path="emit", frame=times[t])
+
+        self.keyframes_inserted += len(times)
+        self.progress_complete("keyframes", len(times))
+
+    def load_activity_archive(self, path, cached_chunks = 4):
+        self.unload_activity_archive()
+
+        with open(os.path.join(path, "index.json")) as f:
+            index = json.load(f)
+
+        groups = []
+
+        for group in index["groups"]:
+            material_names = []
+
+            # Archive drives the emit values directly, any keyframes would override it
+            for part in group["parts"]:
+                mat = bpy.data.materials.get(self.name_prefix + part)
+
+                if mat is not None:
+                    mat.animation_data_clear()
+
+                material_names.append(self.name_prefix + part)
+
+            group["material_names"] = material_names
+            group["material_positions"] = None
+            groups.append(group)
+
+        archive = {
+            "path": path,
+            "groups": groups,
+            "chunks": collections.OrderedDict(),
+            "cached_chunks": cached_chunks,
+        }
+
+        # The handler shows this archive, whichever session is current
+        archive["handler"] = lambda scene: self.show_archive_frame(scene.frame_current, archive)
+        self.archive = archive
+
+        bpy.app.handlers.frame_change_pre.append(archive["handler"])
+        self.show_archive_frame(bpy.context.scene.frame_current)
+
+    def unload_activity_archive(self):
+        if self.archive is None:
+            return
+
+        if self.archive["handler"] in bpy.app.handlers.frame_change_pre:
+            bpy.app.handlers.frame_change_pre.remove(self.archive["handler"])
+
+        self.archive = None
+
+    def get_archive_chunk(self, group, chunk_idx, archive = None):
+        if archive is None:
+            archive = self.archive
+
+        chunks = archive["chunks"]
+        key = (group["name"], chunk_idx)
+
+        if key in chunks:
+            chunks.move_to_end(key)
+
+        else:
+            # Memory-mapped, only the rows of the shown frames are read from disk
+            file_path = os.path.join(archive["path"], group["chunks"][chunk_idx])
+            chunks[key] = np.load(file_path, mmap_mode='r')
+
+            # Evict the least recently shown chunks
+            while len(chunks) > archive["cached_chunks"]:
+                chunks.popitem(last=False)
+
+        return chunks[key]
+
+    def show_archive_frame(self, frame, archive = None):
+        if archive is None:
+            archive = self.archive
+
+        for group in archive["groups"]:
+            group_frame = min(max(int(frame), 0), group["frame_count"] - 1)
+            chunk_idx = group_frame // group["chunk_frames"]
+            chunk = self.get_archive_chunk(group, chunk_idx, archive)
+            row = chunk[group_frame - chunk_idx * group["chunk_frames"]]
+
+            set_material_emits(group, activities_to_intensities(row))
+
+    def buffer_segment_activities(self, segments):
+        # Like set_segment_activities, but buffered until apply_activity_texture or bake_activity_colors
+        segments = unpack_payload(segments)
+
+        for seg in segments:
+            self.buffered_activity[self.name_prefix + seg["name"]] = (seg["times"], seg["activity"])
+
+        self.progress_complete("activity", len(segments))
+
+    def set_spike_activities(self, spikes):
+        for name, times, activity in get_spike_pulses(unpack_payload(spikes)):
+            self.check_cancelled()
+            self.set_segment_activity(name, times, activity)
+
+    def buffer_spike_activities(self, spikes):
+        # Like set_spike_activities, but buffered until apply_activity_texture or bake_activity_colors
+        pulses = get_spike_pulses(unpack_payload(spikes))
+
+        for name, times, activity in pulses:
+            if len(times) > 0:
+                self.buffered_activity[self.name_prefix + name] = (times, activity)
+
+        self.progress_complete("activity", len(pulses))
+
+    def get_buffered_activity_rows(self):
+        # Returns the meshes with buffered segment activity, with the activity row of each of their materials (the
+        # last, blank row for materials without activity), and the row x frame intensities. Activity of materials
+        # that are not on meshes (e.g. curves) gets keyframes instead.
+        parts = self.buffered_activity
+        self.buffered_activity = {}
+
+        rows = {}
+        meshes = []
+
+        for obj in self.objects.values():
+            ob = obj["object"]
+
+            if ob.type != 'MESH' or ob.data is None:
+                continue
+
+            mat_names = [mat.name if mat is not None else None for mat in ob.data.materials]
+
+            if any(name in parts for name in mat_names):
+                meshes.append((ob, [rows.setdefault(name, len(rows)) if name in parts else -1 for name in mat_names]))
+
+        for name, (times, activity) in parts.items():
+            if name not in rows and name in bpy.data.materials:
+                self.set_material_activity(bpy.data.materials[name], times, activity)
+
+        if len(rows) == 0:
+            return [], rows, None
+
+        # Parts without any activity points stay at rest
+        frame_count = int(max([max(times) for times, activity in parts.values() if len(times) > 0] or [0])) + 1
+        frames = np.arange(frame_count)
+        values = np.zeros((len(rows) + 1, frame_count), dtype=np.float32)
+
+        for name, row in rows.items():
+            times, activity = parts[name]
+
+            if len(times) > 0:
+                values[row] = np.interp(frames, times, activities_to_intensities(activity))
+
+        blank_row = len(rows)
+        meshes = [(ob, np.array([row if row != -1 else blank_row for row in mat_rows] or [blank_row]))
+                  for ob, mat_rows in meshes]
+
+        return meshes, rows, values
+
+    def apply_activity_texture(self, max_size = 16384):
+        # Packs the buffered activity of segment materials into float images of segment rows x frame columns.
+        # Meshes get a shared material that samples their row (polygon UVs) at the current frame (animated
+        # texture offset). Images fit within max_size: longer runs are split into time tiles, one texture slot
+        # each, and meshes with more rows than fit in one image are split among several materials.
+        from mathutils import Vector
+
+        meshes, rows, values = self.get_buffered_activity_rows()
+
+        if len(meshes) == 0:
+            return
+
+        self.remove_activity_texture()
+
+        frame_count = values.shape[1]
+        tile_frames = min(frame_count, max_size)
+        tile_count = (frame_count + tile_frames - 1) // tile_frames
+
+        # Each tile takes one of a material's 18 texture slots
+        if tile_count > 18:
+            raise Exception("The activity is too long for textures of " + str(max_size) + " pixels, use the " +
+                            "'keyframes' or 'baked' activity backend instead")
+
+        # Rows are wrapped into lines of the images, so that they fit within max_size
+        rows_per_line = max(1, max_size // tile_frames)
+        width = rows_per_line * tile_frames
+
+        self.activity_texture = { "images": [], "textures": [], "materials": [] }
+        name = self.name_prefix + "ActivityTexture"
+
+        for block_meshes, block_rows in get_row_blocks(meshes, rows_per_line * max_size):
+            row_count = len(block_rows)
+            height = (row_count + rows_per_line - 1) // rows_per_line
+
+            material = create_default_material(self.resting_color.tolist(), name)
+            self.activity_texture["materials"].append(material)
+
+            for tile_start in range(0, frame_count, tile_frames):
+                tile_end = min(tile_start + tile_frames, frame_count)
+
+                # Values are half the emit intensity, so they fit in 0-1
+                lines = np.zeros((height * rows_per_line, tile_frames), dtype=np.float32)
+                lines[:row_count, :tile_end - tile_start] = values[block_rows, tile_start:tile_end] / 2.0
+
+                pixels = np.ones((height, width, 4), dtype=np.float32)
+                pixels[:, :, :3] = lines.reshape(height, width)[:, :, None]
+
+                image = bpy.data.images.new(name, width, height, alpha=False, float_buffer=True)
+                image.pixels[:] = pixels.ravel()
+
+                texture = bpy.data.textures.new(name, type='IMAGE')
+                texture.image = image
+                texture.extension = 'CLIP'
+                texture.use_interpolation = False
+                texture.filter_type = 'BOX'
+
+                self.activity_texture["images"].append(image)
+                self.activity_texture["textures"].append(texture)
+
+                slot = material.texture_slots.add()
+                slot.texture = texture
+                slot.texture_coords = 'UV'
+                slot.uv_layer = "ActivityRows"
+                slot.use_map_color_diffuse = False
+                slot.use_map_emit = True
+                slot.emit_factor = 2.0
+
+                # Texture space spans 2 units across the image, the offset moves one column per frame
+                slot.offset = Vector((0, 0, 0))
+                slot.keyframe_insert("offset", index=0, frame=tile_start)
+                slot.offset = Vector((2.0 * (tile_end - 1 - tile_start) / width, 0, 0))
+                slot.keyframe_insert("offset", index=0, frame=tile_end - 1)
+                self.keyframes_inserted += 2
+
+                # Only the tile of the current frame adds to the emit
+                if tile_count > 1:
+                    for frame, factor in [(0, 0.0), (tile_start, 2.0), (tile_end, 0.0)]:
+                        slot.emit_factor = factor
+                        slot.keyframe_insert("emit_factor", frame=frame)
+
+                    self.keyframes_inserted += 3
+
+            if material.animation_data is not None:
+                for fcurve in material.animation_data.action.fcurves:
+                    interpolation = 'CONSTANT' if fcurve.data_path.endswith("emit_factor") else 'LINEAR'
+
+                    for point in fcurve.keyframe_points:
+                        point.interpolation = interpolation
+
+            for ob, mat_rows in block_meshes:
+                self.set_activity_uvs(ob.data, mat_rows, rows_per_line, tile_frames, width, height)
+
+                # Replace the segment materials with the shared one
+                for mat in ob.data.materials:
+                    if mat is not None and mat.name in rows:
+                        self.material_classes.pop(mat.name, None)
+                        bpy.data.materials.remove(mat, do_unlink=True)
+
+                ob.data.materials.clear()
+                ob.data.materials.append(material)
+
+    def set_activity_uvs(self, mesh, mat_rows, rows_per_line, frame_count, width, height):
+        # Each polygon samples the first column of the row of its material, all its loops have the same UV
+        poly_rows, loop_totals = get_polygon_rows(mesh, mat_rows)
+        poly_count = len(poly_rows)
+
+        poly_uvs = np.stack((
+            ((poly_rows % rows_per_line) * frame_count + 0.5) / width,
+            ((poly_rows // rows_per_line) + 0.5) / height
+        ), axis=1)
+
+        mesh.uv_textures.new("ActivityRows")
+        mesh.uv_layers["ActivityRows"].data.foreach_set("uv", np.repeat(poly_uvs, loop_totals, axis=0).astype(np.float32).ravel())
+
+        mesh.polygons.foreach_set("material_index", np.zeros(poly_count, dtype=np.int32))
+
+    def remove_activity_texture(self):
+        if self.activity_texture is None:
+            return
+
+        for material in self.activity_texture["materials"]:
+            if material.animation_data is not None and material.animation_data.action is not None:
+                bpy.data.actions.remove(material.animation_data.action, do_unlink=True)
+
+            bpy.data.materials.remove(material, do_unlink=True)
+
+        for texture in self.activity_texture["textures"]:
+            bpy.data.textures.remove(texture, do_unlink=True)
+
+        for image in self.activity_texture["images"]:
+            bpy.data.images.remove(image, do_unlink=True)
+
+        self.activity_texture = None
+
+    def bake_activity_colors(self, block_frames = 100, cached_blocks = 8):
+        # Precomputes the colors of each activity row at each frame, for the vertex colors of the meshes with
+        # buffered segment activity. Colors of blocks of frames are kept compressed, and a frame change handler shows
+        # them, decompressing the blocks as needed and keeping the cached_blocks most recently shown ones.
+        self.unload_baked_activity()
+
+        meshes, rows, values = self.get_buffered_activity_rows()
+
+        if len(meshes) == 0:
+            return
+
+        # The activity row of each loop of all meshes, one mesh after another
+        loop_rows = []
+        layers = []
+
+        for ob, mat_rows in meshes:
+            poly_rows, loop_totals = get_polygon_rows(ob.data, mat_rows)
+            loop_rows.append(np.repeat(poly_rows, loop_totals))
+
+            if "Activity" not in ob.data.vertex_colors:
+                ob.data.vertex_colors.new("Activity")
 
-        self.progress_complete()
+            layers.append((ob.data.vertex_colors["Activity"].data, len(loop_rows[-1])))
+
+            # Vertex colors replace the material colors
+            for mat in ob.data.materials:
+                if mat is not None:
+                    mat.use_vertex_color_paint = True
+
+        loop_rows = np.concatenate(loop_rows)
+        frame_count = values.shape[1]
+        blocks = []
+
+        # Colors are stored as bytes, like Blender's vertex colors. They are copied from rows to loops when shown.
+        for start in range(0, frame_count, block_frames):
+            self.check_cancelled()
+            intensities = values[:, start:start + block_frames].T / 2.0
+            row_colors = np.round((self.resting_color + intensities[:, :, None] * self.color_dist) * 255).astype(np.uint8)
+            blocks.append(zlib.compress(row_colors.tobytes()))
+
+        baked = {
+            "layers": layers,
+            "loop_rows": loop_rows,
+            "row_count": values.shape[0],
+            "frame_count": frame_count,
+            "block_frames": block_frames,
+            "blocks": blocks,
+            "cache": collections.OrderedDict(),
+            "cached_blocks": cached_blocks,
+        }
 
-    def activity_to_intensity(self, activity, min_range = -50.0, max_range =   0.0):
+        # The handler shows these colors, whichever session is current
+        baked["handler"] = lambda scene: self.show_baked_frame(scene.frame_current, baked)
+        self.baked_activity = baked
+
+        bpy.app.handlers.frame_change_pre.append(baked["handler"])
+        self.show_baked_frame(bpy.context.scene.frame_current)
+
+    def get_baked_block(self, block_idx, baked = None):
+        if baked is None:
+            baked = self.baked_activity
+
+        cache = baked["cache"]
+
+        if block_idx in cache:
+            cache.move_to_end(block_idx)
+
+        else:
+            colors = np.frombuffer(zlib.decompress(baked["blocks"][block_idx]), dtype=np.uint8)
+            cache[block_idx] = colors.reshape(-1, baked["row_count"], 3)
+
+            # Evict the least recently shown blocks
+            while len(cache) > baked["cached_blocks"]:
+                cache.popitem(last=False)
+
+        return cache[block_idx]
+
+    def show_baked_frame(self, frame, baked = None):
+        if baked is None:
+            baked = self.baked_activity
+
+        frame = min(max(int(frame), 0), baked["frame_count"] - 1)
+        block_idx = frame // baked["block_frames"]
+
+        row_colors = self.get_baked_block(block_idx, baked)[frame - block_idx * baked["block_frames"]]
+        colors = row_colors[baked["loop_rows"]] / 255.0
+        start = 0
+
+        for layer, loop_count in baked["layers"]:
+            layer.foreach_set("color", colors[start:start + loop_count].ravel())
+            start += loop_count
+
+    def unload_baked_activity(self):
+        if self.baked_activity is None:
+            return
+
+        if self.baked_activity["handler"] in bpy.app.handlers.frame_change_pre:
+            bpy.app.handlers.frame_change_pre.remove(self.baked_activity["handler"])
+
+        self.baked_activity = None
+
+    def activity_to_intensity(self, activity, min_range = ACTIVITY_RANGE[0], max_range = ACTIVITY_RANGE[1]):
 
         # Normalize and clamp min-max range to 0-2
         return max(min((activity - min_range) / (max_range - min_range), 1.0), 0.0)*2.0
 
     def create_cons(self, con_group):
+        con_group = unpack_payload(con_group)
+
+        starts = np.array(con_group["starts"], dtype=float).reshape(-1, 3)
+        ends = np.array(con_group["ends"], dtype=float).reshape(-1, 3)
 
-        # Make this shape from each connection:
+        if len(starts) == 0:
+            return
+
+        # Aggregated connections (bundles) have their own radii
+        if len(con_group.get("radii", [])) == len(starts):
+            radii = np.array(con_group["radii"], dtype=float)
+        else:
+            radii = np.ones(len(starts))
+
+        # All connections are one mesh object, with this shape for each connection:
         #
         #              /|
         #  pre  ======= | post
         #              \|
         #
-        for con_name in con_group["cells"].keys():
-            con = con_group["cells"][con_name][0]
-            start = np.array(con["coords"][0:3])
-            end = np.array(con["coords"][3:6])
-            lengths = end - start
-            syn_cap = start + lengths * 1.01
+        name = con_group["name"] + "Group"
+        vertices, polygons = get_con_glyphs(starts, ends, radii)
+
+        mesh = create_mesh(self.name_prefix + name, vertices, polygons)
+        mesh.materials.append(self.create_material(name, con_group, name))
 
-            con["coords"].extend(syn_cap.tolist())
-            con["radii"].append(2)
+        con_obj = bpy.data.objects.new(self.name_prefix + name, mesh)
+        self.objects[con_obj.name] = {'object': con_obj, 'linked': False}
+        self.add_object_bounds(con_obj.name, vertices)
 
-        self.visualize_group(con_group)
+    def add_group_cells(self, group_name, cells):
+        # Cell chunks are buffered until visualize_group is called without cells
+        self.pending_cells.setdefault(group_name, {}).update(unpack_payload(cells))
 
     def visualize_group(self, group):
+        if group["cells"] is None:
+            group["cells"] = self.pending_cells.pop(group["name"], {})
+
         group_name = group["name"] + "Group"
         interaction_level = group["interaction_level"]
         color_level = group["color_level"]
@@ -302,8 +1049,11 @@ class NeuroServer:
         res_bev = get_res_bev(group["circular_subdivisions"])
         res_u = get_res_u(group["segment_subdivisions"])
 
+        # Section class names, sections have the index of theirs
+        classes = group.get("section_classes")
+
         if color_level == 'Group':
-            material = self.create_material(group_name, group)
+            material = self.create_material(group_name, group, group_name)
 
         if interaction_level == 'Group':
             parent_curve_obj, object_part_mat_idxs = self.create_curve_obj(group_name, group)
@@ -312,9 +1062,11 @@ class NeuroServer:
                 self.assign_material(parent_curve_obj, material)
 
         for cell_name in group["cells"].keys():
+            self.check_cancelled()
+            cell = group["cells"][cell_name]
 
             if color_level == 'Cell':
-                material = self.create_material(cell_name, group)
+                material = self.create_material(cell_name, group, get_section_class(cell[0], classes))
 
             if interaction_level == 'Cell':
                 parent_curve_obj, object_part_mat_idxs = self.create_curve_obj(cell_name, group)
@@ -322,16 +1074,15 @@ class NeuroServer:
                 if self.level_is_greater_or_same(color_level, interaction_level):
                     self.assign_material(parent_curve_obj, material)
 
-            cell = group["cells"][cell_name]
-
             for section in cell:
                 section_name = section["name"]
                 coords = section["coords"]
                 radii = section["radii"]
                 spherical = section["spherical"] if "spherical" in section else False
+                section_class = get_section_class(section, classes)
 
                 if color_level == 'Section':
-                    material = self.create_material(section_name, group)
+                    material = self.create_material(section_name, group, section_class)
 
                 if interaction_level == 'Section':
                     parent_curve_obj, object_part_mat_idxs = self.create_curve_obj(section_name, group)
@@ -349,7 +1100,7 @@ class NeuroServer:
                         mat_count = 1
 
                     for m in range(mat_count):
-                        material = self.create_material(section_name+"["+str(m)+"]", group)
+                        material = self.create_material(section_name+"["+str(m)+"]", group, section_class)
                         mat_idx = self.assign_material(parent_curve_obj, material)
 
                         if spherical:
@@ -377,7 +1128,7 @@ class NeuroServer:
                 if color_level == 'Segment':
                     self.assign_mats_to_polys(parent_curve_obj, object_part_mat_idxs)
 
-            self.progress_complete()
+            self.progress_complete("cells")
 
         if interaction_level == 'Group':
             if color_level in ['Cell', 'Section']:
@@ -401,6 +1152,10 @@ class NeuroServer:
 
         self.objects[mesh_obj.name] = {'object': mesh_obj, 'linked': False}
 
+        # Same geometry as the curve
+        if parent_curve_obj.name in self.object_bounds:
+            self.add_object_bounds(mesh_obj.name, self.object_bounds[parent_curve_obj.name])
+
     def level_is_greater_or_same(self, color_level, interaction_level):
         return self.level_rank[color_level] >= self.level_rank[interaction_level]
 
@@ -409,8 +1164,17 @@ class NeuroServer:
         mats.append(material)
         return len(mats)-1 # Return material index
 
-    def create_material(self, mat_name, group):
-        return create_default_material(group["color"], mat_name)
+    def create_material(self, mat_name, group, class_name = None):
+        material = create_default_material(group["color"], self.name_prefix + mat_name)
+
+        # Without a class from the client, derive it from the name
+        if class_name is None:
+            class_name = get_name_class(mat_name)
+
+        class_id = self.class_ids.setdefault(class_name, len(self.class_ids))
+        self.material_classes[material.name] = (material, class_id)
+
+        return material
 
     def create_curve_obj(self, name, group_params):
 
@@ -428,9 +1192,9 @@ class NeuroServer:
             if res_u != curve.resolution_u:
                 curve.resolution_u = res_u
 
-        curve_obj = bpy.data.objects.new(name, curve)
+        curve_obj = bpy.data.objects.new(self.name_prefix + name, curve)
 
-        self.objects[name] = {'object': curve_obj, 'linked': False}
+        self.objects[curve_obj.name] = {'object': curve_obj, 'linked': False}
 
         object_poly_mat_idxs = []
 
@@ -503,6 +1267,8 @@ class NeuroServer:
         bezier_points.foreach_set('radius', radii)
         bezier_points.foreach_set('co', coords)
 
+        self.add_object_bounds(curve_obj.name, coords, radii)
+
         if not smooth:
             # Fast
             bezier_points.foreach_set('handle_right', coords)
@@ -577,37 +1343,43 @@ class NeuroServer:
         return range(int(start_index), int(end_index_excl))
 
     def link_objects(self):
-
-        new_links = False
+        from mathutils import Matrix
 
         # Ensure thread safety
         with self.link_lock:
 
             # Add any unlinked objects to the scene
-            for obj in self.objects.values():
+            for name, obj in self.objects.items():
                 if not obj["linked"]:
+                    self.check_cancelled()
+
                     # On first export
                     if not self.has_linked:
                         self.on_first_link()
                         self.has_linked = True
 
-                    bpy.context.scene.objects.link(obj['object'])
+                    ob = obj['object']
+                    bpy.context.scene.objects.link(ob)
                     obj["linked"] = True
 
-                    new_links = True
+                    if ob.type not in ['MESH','CURVE'] or ob.data is None:
+                        continue
 
+                    # Bounds of objects not indexed when created are read from their geometry. This avoids the
+                    # origin_set operator, which needs a window context that --background does not have.
+                    bounds = self.object_bounds.get(name)
 
-            if new_links:
-                # Select all meshes and curves
-                for ob in bpy.data.objects:
-                    if ob.type in ['MESH','CURVE']:
-                        ob.select = True
+                    if bounds is None:
+                        bounds = get_geometry_bounds(ob)
 
-                # Reset their origins to center
-                bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY')
+                    # Move the origin to the center of the geometry, the geometry stays in place
+                    if bounds is not None:
+                        center = bounds.mean(axis=0)
+                        ob.data.transform(Matrix.Translation((-center).tolist()))
+                        ob.location = center.tolist()
 
-        # Clear selection
-        self.all_select(select=False)
+                        # Bounds follow the geometry into object space, the object's transform places them
+                        self.object_bounds[name] = bounds - center
 
 
     def set_clip_distance(self, distance = 100000):
@@ -668,6 +1440,11 @@ class NeuroServer:
                         return space.region_3d.view_perspective
 
     def show_full_scene(self):
+        # View operators need a window
+        if bpy.app.background:
+            self.point_camera_at_model()
+            return
+
         # Clear selection
         self.all_select(select=False)
 
@@ -732,6 +1509,190 @@ class NeuroServer:
         # Run render
         bpy.ops.render.render(self.get_operator_context_override(), animation=True)
 
+    def render_animation_parallel(self, destination_path, workers = None, chunk_frames = None, max_attempts = 3):
+        # Renders the animation with several background Blender processes, each rendering a range of frames.
+        # Failed chunks are rendered again, up to max_attempts times, before the render is marked as failed.
+        scene = bpy.data.scenes["Scene"]
+
+        if self.render_job is not None and self.render_job["running"]:
+            raise Exception("A parallel render is already running")
+
+        destination_path = os.path.abspath(destination_path)
+
+        if not destination_path.endswith(os.sep):
+            destination_path += os.sep
+
+        scene.render.filepath = destination_path
+
+        if workers is None:
+            workers = os.cpu_count()
+
+        # Only frames without output files are rendered, this resumes any crashed or cancelled renders
+        frame_paths = dict((f, scene.render.frame_path(frame=f)) for f in range(scene.frame_start, scene.frame_end + 1))
+        missing = [f for f in sorted(frame_paths) if not os.path.exists(frame_paths[f])]
+
+        if chunk_frames is None:
+            # Several chunks per worker, so the workers finish at about the same time
+            chunk_frames = max(1, int(len(missing) / (workers * 4.0) + 0.5))
+
+        # Split missing frames into contiguous ranges of up to chunk_frames frames
+        chunks = []
+
+        for frame in missing:
+            if len(chunks) > 0 and chunks[-1]["end"] == frame - 1 and len(chunks[-1]["frames"]) < chunk_frames:
+                chunks[-1]["end"] = frame
+                chunks[-1]["frames"].append(frame)
+
+            else:
+                chunks.append({"start": frame, "end": frame, "frames": [frame], "status": "QUEUED", "process": None,
+                               "attempts": 0})
+
+        # The workers render from a saved copy of the current scene
+        temp_dir = tempfile.mkdtemp()
+        blend_path = os.path.join(temp_dir, "render_scene.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=blend_path, check_existing=False, copy=True)
+
+        self.render_job = {
+            "destination_path": destination_path,
+            "blend_path": blend_path,
+            "frame_paths": frame_paths,
+            "chunks": chunks,
+            "workers": workers,
+            "threads_per_worker": max(1, int(os.cpu_count() / workers)),
+            "max_attempts": max_attempts,
+            "running": True,
+            "cancelled": False,
+            "error": None,
+        }
+
+        dispatcher = threading.Thread(target=self.dispatch_render_chunks, args=(self.render_job, temp_dir))
+        dispatcher.daemon = True
+        dispatcher.start()
+
+        return len(missing)
+
+    def dispatch_render_chunks(self, job, temp_dir):
+        pending = list(job["chunks"])
+        running = []
+
+        try:
+            while (len(pending) > 0 or len(running) > 0) and not job["cancelled"]:
+                while len(pending) > 0 and len(running) < job["workers"]:
+                    chunk = pending.pop(0)
+
+                    # Retries start at the first frame the failed attempt did not save. The frames may also have
+                    # been saved since the render was planned, e.g. by another render to the same directory.
+                    start = next((f for f in chunk["frames"] if not os.path.exists(job["frame_paths"][f])), None)
+
+                    if start is None:
+                        chunk["status"] = "DONE"
+                        continue
+
+                    chunk["process"] = subprocess.Popen([
+                        bpy.app.binary_path, "--background", job["blend_path"],
+                        "--render-output", job["destination_path"],
+                        "--threads", str(job["threads_per_worker"]),
+                        "--frame-start", str(start),
+                        "--frame-end", str(chunk["end"]),
+                        "--render-anim"
+                    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    chunk["status"] = "RUNNING"
+                    chunk["attempts"] += 1
+                    running.append(chunk)
+
+                time.sleep(0.5)
+
+                for chunk in list(running):
+                    return_code = chunk["process"].poll()
+
+                    if return_code is None:
+                        continue
+
+                    running.remove(chunk)
+                    missing = [f for f in chunk["frames"] if not os.path.exists(job["frame_paths"][f])]
+
+                    if len(missing) == 0:
+                        chunk["status"] = "DONE"
+
+                    elif chunk["attempts"] < job["max_attempts"]:
+                        chunk["status"] = "QUEUED"
+                        pending.append(chunk)
+
+                    else:
+                        chunk["status"] = "FAILED"
+
+                        # The other chunks are still rendered, so a re-run only needs to render the failed frames
+                        if job["error"] is None:
+                            job["error"] = "Frames %s-%s failed to render after %s attempts (exit code %s)" % \
+                                           (chunk["start"], chunk["end"], chunk["attempts"], return_code)
+
+        except Exception as e:
+            job["error"] = "The parallel render stopped: %s" % e
+
+        finally:
+            # Cancelled or failed, the workers still rendering from the temporary scene copy are stopped before it
+            # is removed
+            for chunk in running:
+                chunk["process"].terminate()
+                chunk["process"].wait()
+                chunk["status"] = "CANCELLED"
+
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            job["running"] = False
+
+    def get_render_progress(self):
+        job = self.render_job
+
+        if job is None:
+            return None
+
+        workers = []
+
+        for chunk in job["chunks"]:
+            done = sum(1 for f in chunk["frames"] if os.path.exists(job["frame_paths"][f]))
+            workers.append({
+                "start": chunk["start"],
+                "end": chunk["end"],
+                "status": chunk["status"],
+                "done": done,
+                "total": len(chunk["frames"]),
+            })
+
+        return {
+            "running": job["running"],
+            "error": job["error"],
+            "done": sum(w["done"] for w in workers),
+            "total": sum(w["total"] for w in workers),
+            "chunks": workers,
+        }
+
+    def cancel_render(self):
+        if self.render_job is not None:
+            self.render_job["cancelled"] = True
+
+        return 0
+
+    def point_camera_at_model(self):
+        from mathutils import Vector
+
+        bounds = self.get_model_bounds()
+        center = (Vector(bounds["mins"]) + Vector(bounds["maxes"])) / 2.0
+
+        # Same direction as the starting camera position of show_full_scene
+        direction = Vector((1, 1, 1)).normalized()
+
+        self.camera.location = center + direction * self.get_whole_view_camera_distance()
+        self.camera.rotation_euler = (-direction).to_track_quat('-Z', 'Y').to_euler()
+
+    def build_from_package(self, package_path):
+        # Replays the requests recorded by the client's save_scene_package, without the task queue
+        with open(package_path, "rb") as f:
+            package = unpack_payload(f.read())
+
+        for method, args in package["tasks"]:
+            print_safe("Running " + method + "...")
+            getattr(self, method)(*args)
+
     def save_scene(self, destination_file_path):
         bpy.ops.wm.save_as_mainfile(filepath=destination_file_path,
                                     check_existing=False,
@@ -809,27 +1770,53 @@ class NeuroServer:
             ttc.up_axis = 'UP_Y'
             ttc.name = self.ttc_name
 
+    def add_object_bounds(self, name, coords, radii = None):
+        # Object bounds are recorded from the coordinates used to create them, instead of reading bound_box later.
+        # New objects have no transform, so these coordinates are also their object-space coordinates.
+        points = np.asarray(coords, dtype=float).reshape(-1, 3)
+
+        if len(points) == 0:
+            return
+
+        padding = 0 if radii is None else np.asarray(radii, dtype=float).reshape(-1, 1)
+        bounds = np.array((np.min(points - padding, axis=0), np.max(points + padding, axis=0)))
+
+        if name in self.object_bounds:
+            bounds = merge_bounds(self.object_bounds[name], bounds)
+
+        self.object_bounds[name] = bounds
+
+    def remove_object_bounds(self, name):
+        self.object_bounds.pop(name, None)
+
     def get_model_bounds(self):
-        from mathutils import Vector
-        corners = []
+        # The object-space bounds are placed with the current transform of each object, so moved, rotated, or
+        # scaled objects are framed where they are
+        local_bounds = []
+        matrices = []
+
+        for name, bounds in self.object_bounds.items():
+            ob = bpy.data.objects.get(name)
 
-        for bn_object in self.objects.values():
-            b_object = bn_object["object"]
+            if ob is not None:
+                local_bounds.append(bounds)
+                matrices.append(get_object_matrix(ob))
 
-            # Convert bound_box object-space coords to world-space coords
-            for corner in b_object.bound_box:
-                corners.append(b_object.matrix_world * Vector(corner))
+        if len(local_bounds) == 0:
+            mins = maxes = np.zeros(3)
+        else:
+            local_bounds = np.array(local_bounds)
+            matrices = np.array(matrices)
 
-        mins = []
-        maxes = []
-        ranges = []
+            # The 8 corners of each box, in world space
+            corners = np.array([[local_bounds[:, (i >> 2) & 1, 0], local_bounds[:, (i >> 1) & 1, 1],
+                                 local_bounds[:, i & 1, 2]] for i in range(8)]).transpose(2, 0, 1)
+            corners = np.einsum('nij,nkj->nki', matrices[:, :3, :3], corners) + matrices[:, None, :3, 3]
 
-        for d in range(3):
-            maxes.append(max(c[d] for c in corners))
-            mins.append(min(c[d] for c in corners))
-            ranges.append(maxes[-1] - mins[-1])
+            mins = corners.reshape(-1, 3).min(axis=0)
+            maxes = corners.reshape(-1, 3).max(axis=0)
 
-        return { "mins": mins, "maxes": maxes, "ranges": ranges }
+        return { "mins": mins.tolist(), "maxes": maxes.tolist(), "ranges": (maxes - mins).tolist() }
 
     def get_camera_hv_angles(self):
         camera_angle_rad = bpy.data.cameras[self.camera.name].angle
@@ -877,11 +1864,24 @@ class NeuroServer:
 
 
     def clear(self):
+        self.unload_activity_archive()
+        self.remove_activity_texture()
+        self.unload_baked_activity()
+        self.buffered_activity = {}
+
+        # Cell chunks of a send that was cancelled before its groups were visualized
+        self.pending_cells = {}
 
-        for object in self.objects.values():
-            self.clear_model_object(object, removeFromSelf=False) # Will remove below
+        self.remove_objects([object["object"] for object in self.objects.values()])
 
         self.objects = {}
+        self.object_bounds = {}
+        self.material_classes = {}
+        self.class_ids = {}
+
+        # The camera, its orbit, and the sun are shared by all sessions, only the default session clears them
+        if self.session_id != "":
+            return
 
         if self.ttc_name in self.camera.constraints:
             self.camera.constraints.remove(self.camera.constraints[self.ttc_name])
@@ -907,23 +1907,55 @@ class NeuroServer:
             bpy.data.lamps.remove(bpy.data.lamps["Sun"])
 
     def color_by_unique_materials(self):
-        mat_names = set()
-        regex = re.compile(r"(\d|_|]|\[|\.|#.*)")
+        # Materials of the same class get the same color
+        color_palette = colors.get_distinct(len(self.class_ids)).tolist()
+
+        for mat, class_id in self.material_classes.values():
+            mat.diffuse_color = color_palette[class_id]
+
+    def remove_objects(self, objects):
+        # The objects and their data, materials, and material actions are collected first, and removed together
+        owned = collections.OrderedDict((type, {}) for type in ["objects", "curves", "meshes", "materials", "actions"])
+
+        for ob in objects:
+            owned["objects"][ob.name] = ob
+
+            if ob.type not in ["CURVE", "MESH"] or ob.data is None:
+                continue
+
+            owned["curves" if ob.type == "CURVE" else "meshes"][ob.data.name] = ob.data
+
+            for mat in ob.data.materials:
+                if mat is None:
+                    continue
+
+                owned["materials"][mat.name] = mat
 
-        for mat in bpy.data.materials:
-            clean_name = regex.sub("", mat.name)
-            mat_names.add(clean_name)
+                if mat.animation_data is not None and mat.animation_data.action is not None:
+                    owned["actions"][mat.animation_data.action.name] = mat.animation_data.action
+
+        # Blender 2.8+
+        if hasattr(bpy.data, "batch_remove"):
+            bpy.data.batch_remove([block for blocks in owned.values() for block in blocks.values()])
+            return
 
-        color_palette = colors.get_distinct(len(mat_names))
+        # Blender 2.7x: removing with do_unlink searches all the data for users of each block. Instead, the objects
+        # are unlinked from their scenes, and the blocks are removed in order, from objects to actions, so that
+        # removing one frees its use of the next, and each is removed without a search.
+        for ob in owned["objects"].values():
+            for scene in ob.users_scene:
+                scene.objects.unlink(ob)
 
-        # Assign each clean name to a color
-        mat_colors = dict(zip(mat_names,color_palette))
+        for type, blocks in owned.items():
+            collection = getattr(bpy.data, type)
 
-        # Assign sections to a color
-        for mat in bpy.data.materials:
-            clean_name = regex.sub("", mat.name)
-            if clean_name in mat_colors:
-                mat.diffuse_color = mat_colors[clean_name]
+            for block in blocks.values():
+                try:
+                    collection.remove(block, do_unlink=False)
+
+                except RuntimeError:
+                    # Still used by a block that is not removed, e.g. a material shared with another object
+                    collection.remove(block, do_unlink=True)
 
     def clear_model_object(self, object, removeFromSelf = True):
         if object.__class__.__name__ == 'dict':
@@ -932,6 +1964,7 @@ class NeuroServer:
             ob = object
 
         obType = ob.type
+        name = ob.name
 
         try:
             bpy.context.scene.objects.unlink(ob)
@@ -949,6 +1982,7 @@ class NeuroServer:
                     bpy.data.actions.remove(bpy.data.actions[action_name])
 
                 mat.animation_data_clear()
+                self.material_classes.pop(mat.name, None)
                 bpy.data.materials.remove(mat)
 
         if obType == "CURVE":
@@ -960,7 +1994,8 @@ class NeuroServer:
         bpy.data.objects.remove(ob, True)
 
         if removeFromSelf:
-            self.objects.pop(ob.name)
+            self.objects.pop(name)
+            self.remove_object_bounds(name)
 
     def stop(self):
         if hasattr(self, "server") and self.server is not None:
@@ -976,10 +2011,64 @@ class NeuroServer:
         from xmlrpc.server import SimpleXMLRPCRequestHandler
         from socketserver import ThreadingMixIn
 
+        neuro_server = self
+
+        class RequestHandler(SimpleXMLRPCRequestHandler):
+            def decode_request_content(self, data):
+                neuro_server.count_request(len(data))
+                return SimpleXMLRPCRequestHandler.decode_request_content(self, data)
+
+            def do_POST(self):
+                size = int(self.headers.get("content-length", 0))
+
+                if not neuro_server.reserve_request(size):
+                    self.send_busy(size)
+                    return
+
+                # Any task queued by the request takes over the reserved bytes
+                neuro_server.request_local.size = size
+
+                try:
+                    SimpleXMLRPCRequestHandler.do_POST(self)
+
+                finally:
+                    neuro_server.release_request(neuro_server.request_local.size)
+                    neuro_server.request_local.size = 0
+
+            def send_busy(self, size):
+                # The body is read in small pieces and discarded, so the client gets the response
+                while size > 0:
+                    data = self.rfile.read(min(size, 65536))
+
+                    if not data:
+                        break
+
+                    size -= len(data)
+
+                self.send_response(503)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-length", "0")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
         class BlenderServer(ThreadingMixIn, SimpleXMLRPCServer):
             def __init__(self, param):
                 self.daemon_threads = True
-                super(BlenderServer, self).__init__(param, allow_none=True)
+                self.request_slots = threading.BoundedSemaphore(neuro_server.max_request_threads)
+                super(BlenderServer, self).__init__(param, requestHandler=RequestHandler, allow_none=True)
+
+            def process_request(self, request, client_address):
+                # Waits for one of the request threads to be free
+                self.request_slots.acquire()
+                ThreadingMixIn.process_request(self, request, client_address)
+
+            def process_request_thread(self, request, client_address):
+                try:
+                    ThreadingMixIn.process_request_thread(self, request, client_address)
+
+                finally:
+                    self.request_slots.release()
 
         self.server = BlenderServer((self.IP, self.Port))
         self.server.register_introspection_functions()
@@ -995,13 +2084,83 @@ class NeuroServer:
         # Asynchronous task execution queueing
         self.server.register_function(self.enqueue_method,  'enqueue_method')
         self.server.register_function(self.enqueue_command, 'enqueue_command')
+
+        # Client sessions, each with its own objects and materials
+        self.server.register_function(self.open_session, 'open_session')
+        self.server.register_function(self.close_session, 'close_session')
+        self.server.register_function(self.session_run_method, 'session_run_method')
+        self.server.register_function(self.session_run_command, 'session_run_command')
+        self.server.register_function(self.session_enqueue_method, 'session_enqueue_method')
+        self.server.register_function(self.session_enqueue_command, 'session_enqueue_command')
         self.server.register_function(self.get_task_status, 'get_task_status')
         self.server.register_function(self.get_task_error,  'get_task_error')
         self.server.register_function(self.get_task_result, 'get_task_result')
+        self.server.register_function(self.get_queue_length, 'get_queue_length')
+        self.server.register_function(self.cancel_task, 'cancel_task')
+        self.server.register_function(self.cancel_tasks, 'cancel_tasks')
+        self.server.register_function(self.cancel_all, 'cancel_all')
+
+        # Progress of sends
+        self.server.register_function(self.progress_start, 'progress_start')
+        self.server.register_function(self.get_progress, 'get_progress')
+
+        # Task timings and counters
+        self.server.register_function(self.enable_metrics, 'enable_metrics')
+        self.server.register_function(self.reset_metrics, 'reset_metrics')
+        self.server.register_function(self.get_metrics, 'get_metrics')
+
+        # Parallel rendering runs outside of the task queue
+        self.server.register_function(self.get_render_progress, 'get_render_progress')
+        self.server.register_function(self.cancel_render, 'cancel_render')
 
         self.server.serve_forever()
 
 
+class TaskCancelled(Exception):
+    # Raised by check_cancelled within a cancelled task
+    pass
+
+
+class SessionQueue:
+    # A task queue that takes the tasks of each session in turn, so that a client that enqueues many tasks does not
+    # hold up the others. Tasks of the same session keep their order.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = collections.OrderedDict()
+
+    def put(self, task):
+        with self.lock:
+            self.sessions.setdefault(task.get("session", ""), collections.deque()).append(task)
+
+    def get(self):
+        with self.lock:
+            session, tasks = next(iter(self.sessions.items()))
+            task = tasks.popleft()
+
+            # Next time, another session goes first
+            del self.sessions[session]
+
+            if len(tasks) > 0:
+                self.sessions[session] = tasks
+
+            return task
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def qsize(self):
+        with self.lock:
+            return sum(len(tasks) for tasks in self.sessions.values())
+
+    def session_size(self, session):
+        with self.lock:
+            return len(self.sessions.get(session, []))
+
+    def task_done(self):
+        pass
+
+
 cimport cython
 
 cdef inline hex_to_rgb(value):
@@ -1018,6 +2177,220 @@ cdef inline hex_to_rgb(value):
     fin.append(b)
     return tuple(fin)
 
+cdef inline unpack_payload(payload):
+    # Payloads packed by the client are zlib compressed JSON, received as xmlrpc Binary or read from a file
+    if hasattr(payload, "data"):
+        payload = payload.data
+
+    elif not isinstance(payload, bytes):
+        return payload
+
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+cdef inline get_spike_pulses(spikes):
+    # Spike times of cells (int32 microseconds since each cell's previous spike, see the client's
+    # prepare_spike_chunk) as activity with a short emission pulse at each spike: (cell name, frames, activity)
+    counts = np.frombuffer(base64.b64decode(spikes["counts"]), dtype='<i4')
+    deltas = np.frombuffer(base64.b64decode(spikes["deltas"]), dtype='<i4').astype(np.int64)
+    frames_per_us = spikes["frames_per_ms"] / 1000.0
+    pulse_frames = spikes["pulse_frames"]
+
+    # The ends of the activity_to_intensity range
+    rest, peak = ACTIVITY_RANGE
+
+    result = []
+
+    for name, cell_deltas in zip(spikes["names"], np.split(deltas, np.cumsum(counts)[:-1])):
+        times = []
+        activity = []
+
+        # Each pulse rises over the frame before the spike, and decays over pulse_frames
+        for frame in (np.cumsum(cell_deltas) * frames_per_us).tolist():
+            # Overlapping pulses stay at the peak
+            if len(times) > 0 and times[-1] >= frame - 1:
+                times.pop()
+                activity.pop()
+
+            else:
+                times.append(frame - 1)
+                activity.append(rest)
+
+            times.append(frame)
+            activity.append(peak)
+
+            times.append(frame + pulse_frames)
+            activity.append(rest)
+
+        result.append((name, times, activity))
+
+    return result
+
+cdef inline get_payload_size(args):
+    # Bytes of any packed payloads (xmlrpc Binary or bytes) in task arguments
+    size = 0
+
+    for arg in args:
+        if hasattr(arg, "data"):
+            size += len(arg.data)
+
+        elif isinstance(arg, bytes):
+            size += len(arg)
+
+    return size
+
+cdef inline get_con_glyphs(starts, ends, con_radii):
+    # Same profile as a 4-sided bevelled curve through: a 0-radius cap just before the start, the start and end
+    # (radius 1), the synapse cap 1% past the end (radius 2), and a 0-radius cap just after it. Profile radii are
+    # scaled by the radius of each connection.
+    lengths = np.linalg.norm(ends - starts, axis=1)
+    directions = (ends - starts) / np.where(lengths > 0, lengths, 1.0)[:, None]
+
+    along = np.stack((np.full(len(lengths), -0.01), np.zeros(len(lengths)), lengths, lengths * 1.01, lengths * 1.01 + 0.01), axis=1)
+    radii = np.array([0.0, 1.0, 1.0, 2.0, 0.0])
+
+    # Ring axes perpendicular to each connection, aligned with the world axes where possible
+    helpers = np.eye(3)[np.argmin(np.abs(directions), axis=1)]
+    side = np.cross(directions, helpers)
+    side /= np.linalg.norm(side, axis=1)[:, None]
+    up = np.cross(directions, side)
+    ring = np.stack((side, up, -side, -up), axis=1) # connections x 4 x 3
+
+    centers = starts[:, None, :] + directions[:, None, :] * along[:, :, None] # connections x 5 x 3
+    radii = radii[None, :] * con_radii[:, None] # connections x 5
+    vertices = centers[:, :, None, :] + radii[:, :, None, None] * ring[:, None, :, :] # connections x 5 x 4 x 3
+
+    # Quads between consecutive rings
+    rings, sides = 5, 4
+    r, s = np.meshgrid(np.arange(rings - 1), np.arange(sides), indexing='ij')
+    r, s = r.ravel(), s.ravel()
+    glyph_quads = np.stack((r * sides + s, r * sides + (s + 1) % sides, (r + 1) * sides + (s + 1) % sides, (r + 1) * sides + s), axis=1)
+
+    polygons = glyph_quads[None, :, :] + (np.arange(len(starts)) * rings * sides)[:, None, None]
+
+    return vertices.reshape(-1, 3), polygons.reshape(-1, 4)
+
+cdef inline create_mesh(name, vertices, polygons):
+    # Builds a mesh of same-sized polygons (vertex index rows) with one foreach_set per attribute
+    mesh = bpy.data.meshes.new(name)
+    poly_count, poly_size = polygons.shape
+
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.astype(np.float32).ravel())
+
+    mesh.loops.add(poly_count * poly_size)
+    mesh.loops.foreach_set("vertex_index", polygons.astype(np.int32).ravel())
+
+    mesh.polygons.add(poly_count)
+    mesh.polygons.foreach_set("loop_start", np.arange(0, poly_count * poly_size, poly_size, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_total", np.full(poly_count, poly_size, dtype=np.int32))
+
+    mesh.update(calc_edges=True)
+
+    return mesh
+
+cdef inline get_polygon_rows(mesh, mat_rows):
+    # Returns the activity row of each polygon of a mesh, from the rows of its materials, and the polygon loop counts
+    poly_count = len(mesh.polygons)
+
+    mat_idxs = np.zeros(poly_count, dtype=np.int32)
+    mesh.polygons.foreach_get("material_index", mat_idxs)
+
+    loop_totals = np.zeros(poly_count, dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+
+    return mat_rows[np.minimum(mat_idxs, len(mat_rows) - 1)], loop_totals
+
+cdef inline get_row_blocks(meshes, max_rows):
+    # Splits the meshes into blocks whose materials use at most max_rows activity rows, as a list of the block's
+    # meshes with their materials' rows within the block, and the activity rows of the block
+    blocks = []
+    block_rows = collections.OrderedDict()
+    block_meshes = []
+
+    for ob, mat_rows in meshes:
+        new_rows = set(mat_rows.tolist()).difference(block_rows)
+
+        if len(new_rows) > max_rows - len(block_rows):
+            if len(set(mat_rows.tolist())) > max_rows:
+                raise Exception("Mesh " + ob.name + " has more activity rows than fit in a texture (" + str(max_rows) +
+                                "), use the 'keyframes' or 'baked' activity backend instead")
+
+            blocks.append((block_meshes, np.array(list(block_rows))))
+            block_rows = collections.OrderedDict()
+            block_meshes = []
+
+        for row in mat_rows.tolist():
+            block_rows.setdefault(row, len(block_rows))
+
+        block_meshes.append((ob, np.array([block_rows[row] for row in mat_rows.tolist()])))
+
+    if len(block_meshes) > 0:
+        blocks.append((block_meshes, np.array(list(block_rows))))
+
+    return blocks
+
+cdef inline get_section_class(section, classes):
+    if classes is None or "class" not in section:
+        return None
+
+    return classes[section["class"]]
+
+cdef inline get_name_class(name):
+    # Removes indices and punctuation e.g. TestCell[0].soma[0][1] -> TestCellsoma
+    return re.sub(r"(\d|_|]|\[|\.|#.*)", "", name)
+
+cdef inline merge_bounds(a, b):
+    return np.array((np.minimum(a[0], b[0]), np.maximum(a[1], b[1])))
+
+cdef inline get_geometry_bounds(ob):
+    # Bounds of the mesh vertices or curve control points of an object, None if it has no geometry
+    if ob.type == 'MESH':
+        coords = np.empty(len(ob.data.vertices) * 3)
+        ob.data.vertices.foreach_get("co", coords)
+
+    else:
+        coords = [np.empty(len(spline.bezier_points) * 3) for spline in ob.data.splines]
+
+        for spline, spline_coords in zip(ob.data.splines, coords):
+            spline.bezier_points.foreach_get("co", spline_coords)
+
+        coords = np.concatenate(coords) if len(coords) > 0 else np.empty(0)
+
+    if len(coords) == 0:
+        return None
+
+    points = coords.reshape(-1, 3)
+    return np.array((points.min(axis=0), points.max(axis=0)))
+
+cdef inline get_object_matrix(ob):
+    # matrix_world is only updated with the scene, while matrix_basis follows location, rotation, and scale at once
+    if ob.parent is None:
+        return np.array(ob.matrix_basis)
+
+    return np.array(ob.matrix_world)
+
+cdef inline activities_to_intensities(activities, min_range = ACTIVITY_RANGE[0], max_range = ACTIVITY_RANGE[1]):
+    # Vectorized version of NeuroServer.activity_to_intensity
+    return np.clip((np.asarray(activities) - min_range) / (max_range - min_range), 0.0, 1.0) * 2.0
+
+cdef inline set_material_emits(group, intensities):
+    # Sets the emit of the materials of an archive group (at the rows of their parts) with one foreach_set of all
+    # materials. Their positions in bpy.data.materials are found again when materials are added or removed.
+    materials = bpy.data.materials
+
+    if group["material_positions"] is None or group["material_count"] != len(materials):
+        positions = dict((name, i) for i, name in enumerate(materials.keys()))
+        rows = [row for row, name in enumerate(group["material_names"]) if name in positions]
+
+        group["material_rows"] = np.array(rows, dtype=int)
+        group["material_positions"] = np.array([positions[group["material_names"][row]] for row in rows], dtype=int)
+        group["material_count"] = len(materials)
+
+    emits = np.empty(len(materials), dtype=np.float32)
+    materials.foreach_get("emit", emits)
+    emits[group["material_positions"]] = intensities[group["material_rows"]]
+    materials.foreach_set("emit", emits)
+
 cdef inline print_safe(value):
     try:
         print(value)
@@ -1 +1 @@
-zip -R blender_neuron_addon_v$1.zip '__init__.py' '*.pyd' '*.so'
+zip -R blender_neuron_addon_v$1.zip '__init__.py' 'batch.py' '*.pyd' '*.so'
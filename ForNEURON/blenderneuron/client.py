@@ -5,13 +5,775 @@ try:
 except:
     import xmlrpc.client as xmlrpclib
 
-import threading, time, hashlib
-from math import sqrt
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    TimeoutError
+except NameError:
+    TimeoutError = OSError # Python 2
+
+import threading, time, hashlib, zlib, json, os, random, base64, sys
+from array import array
+from math import sqrt, floor
+from multiprocessing import cpu_count
 import collections
 from time import sleep
 
 """NEURON-based client library for BlenderNEURON"""
 
+
+def pack_payload(payload):
+    """
+    Serializes and compresses a payload (e.g. cell coordinates or segment activity) for transfer to the
+    BlenderNEURON addon. JSON is used instead of marshal because NEURON and Blender may run different Python versions.
+
+    :param payload: A JSON-serializable list or dictionary
+    :return: zlib compressed, UTF-8 encoded JSON bytes
+    """
+    return zlib.compress(json.dumps(payload).encode('utf-8'))
+
+
+def prepare_activity_chunk(parts, times, frames_per_ms, tolerance):
+    """
+    Simplifies, scales, and packs the activity of a chunk of group parts (cells/sections/segments). Runs in a
+    worker of the send pool, so it must not use NEURON.
+
+    :param parts: A list of (part name, activity values) tuples, or (part name, activity values, times) tuples for
+        parts with their own times (see :any:`ActivityEvents`)
+    :param times: The collection times shared by the parts without their own times
+    :param frames_per_ms: The number of Blender frames per ms of simulation
+    :param tolerance: The activity simplification tolerance, see :any:`BlenderNEURON.rdp`
+    :return: A packed payload for the addon's set_segment_activities method
+    """
+    payload = []
+
+    for part in parts:
+        name, activity = part[0], part[1]
+        part_times = part[2] if len(part) > 2 else times
+
+        # Remove extra co-linear points
+        reduced = BlenderNEURON.rdp(list(zip(part_times, activity)), tolerance)
+        reduced_times, reduced_values = zip(*reduced)
+
+        # Scale the times
+        reduced_times = [t*frames_per_ms for t in reduced_times]
+
+        payload.append({'name': name, 'times': reduced_times, 'activity': list(reduced_values)})
+
+    return pack_payload(payload)
+
+
+def prepare_spike_chunk(names, spike_times, frames_per_ms, pulse_ms):
+    """
+    Packs the spike times of a chunk of cells. Each cell's times are rounded to microseconds and stored as
+    differences from its previous spike, in a little-endian int32 array, which compresses to a few bytes per spike.
+
+    :param names: The names of the cells
+    :param spike_times: A list with the spike times (ms) of each cell
+    :param frames_per_ms: The number of Blender frames per ms of simulation
+    :param pulse_ms: The length of the emission pulse of each spike (ms)
+    :return: A packed payload for the addon's set_spike_activities method
+    """
+    counts = array('i', [len(times) for times in spike_times])
+    deltas = array('i')
+
+    for times in spike_times:
+        previous = 0
+
+        for time_us in (int(round(t * 1000)) for t in times):
+            deltas.append(time_us - previous)
+            previous = time_us
+
+    def encode(values):
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        return base64.b64encode(values.tostring() if sys.version_info[0] < 3 else values.tobytes()).decode('ascii')
+
+    return pack_payload({
+        'names': list(names),
+        'counts': encode(counts),
+        'deltas': encode(deltas),
+        'frames_per_ms': frames_per_ms,
+        'pulse_frames': pulse_ms * frames_per_ms,
+    })
+
+
+class SharedExecutor(object):
+    """
+    A concurrent.futures executor that is reused by all sends with the same pool type and size. Like :any:`SerialExecutor`, it can be used in a
+    'with' block, which does not shut it down. See :any:`BlenderNEURON.get_send_executor`.
+    """
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+
+    def submit(self, fn, *args):
+        return self.pool.submit(fn, *args)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class SerialExecutor(object):
+    """
+    A stand-in for concurrent.futures executors that runs the submitted calls immediately, on the calling thread.
+    Used when there is only one send worker or concurrent.futures is not available (Python 2 without 'futures').
+    """
+
+    class Call(object):
+        def __init__(self, result):
+            self._result = result
+
+        def result(self):
+            return self._result
+
+    def submit(self, fn, *args):
+        return SerialExecutor.Call(fn(*args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class SendCancelled(Exception):
+    """Raised within the sender thread when a send is cancelled with :any:`SendHandle.cancel`"""
+    pass
+
+
+class SendHandle(object):
+    """
+    Tracks the progress of a send to Blender. Returned by :any:`BlenderNEURON.to_blender_async`. The progress
+    counters are updated by the thread doing the sending, and can be read from any thread.
+    """
+
+    def __init__(self, snapshot=None):
+        """
+        :param snapshot: The model snapshot being sent, see :any:`BlenderNEURON.gather_snapshot`. Used to
+         compute the total number of cells to send.
+        """
+        self.cells_total = 0
+        self.cells_sent = 0
+        self.bytes_sent = 0
+        self.tasks_sent = 0
+        self.error = None
+
+        # The ids of the Blender tasks of the send, see: BlenderNEURON.cancel_send_tasks
+        self.task_ids = []
+
+        if snapshot is not None:
+            self.cells_total = sum(len(data['cells']) for data in snapshot['groups'])
+
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    def track(self, tasks=1, cells=0, byte_count=0, task_ids=()):
+        """
+        Records a sent task. Called by the sender after each request to Blender.
+
+        :param task_ids: The ids of the queued Blender tasks, if any
+        :raise: SendCancelled if the send was cancelled
+        """
+        self.task_ids.extend(task_ids)
+        self.tasks_sent += tasks
+        self.cells_sent += cells
+        self.bytes_sent += byte_count
+
+        if self._cancel.is_set():
+            raise SendCancelled()
+
+    def run(self, send, *args):
+        """
+        Calls the send function, recording any error, and marks the handle as done when it returns
+        """
+        try:
+            send(*args)
+
+        except SendCancelled:
+            pass
+
+        except Exception as e:
+            self.error = e
+
+        finally:
+            self._done.set()
+
+    def cancel(self):
+        """
+        Stops the send after the request that is currently being sent. Tasks already received by Blender are not
+        affected.
+        """
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the send is finished, cancelled, or failed, or until the timeout (in seconds) expires
+
+        :return: True if the send is done
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Blocks until the send is done, and re-raises any error that occurred while sending
+
+        :raise: TimeoutError if the send is not done before the timeout (in seconds) expires
+        """
+        if not self.wait(timeout):
+            raise TimeoutError("The send to Blender did not finish within %s seconds" % timeout)
+
+        if self.error is not None:
+            raise self.error
+
+    def get_status(self):
+        """
+        :return: A short, human readable progress string, suitable for the GUI panel
+        """
+        if self.error is not None:
+            return 'Error: ' + str(self.error)
+
+        if self.cancelled():
+            status = 'Cancelled'
+
+        elif self.done():
+            status = 'Done'
+
+        else:
+            status = 'Sending'
+
+        return "%s: %s/%s cells, %s tasks, %.1f MB" % (
+            status, self.cells_sent, self.cells_total, self.tasks_sent, self.bytes_sent / 1048576.0
+        )
+
+
+class BusyRetryTransport(xmlrpclib.Transport):
+    """
+    An XMLRPC transport that retries requests which the BlenderNEURON addon rejects with HTTP 503 because it is busy
+    (too many queued tasks or too much unprocessed data). The wait between retries doubles, up to max_delay seconds,
+    which slows down the sending until Blender catches up.
+    """
+
+    def __init__(self, max_wait=300, max_delay=2.0, on_busy=None):
+        """
+        :param max_wait: Seconds to keep retrying a request, after which the 503 error is raised
+        :param max_delay: The longest wait between retries, in seconds
+        :param on_busy: An optional function called before each retry
+        """
+        xmlrpclib.Transport.__init__(self)
+        self.max_wait = max_wait
+        self.max_delay = max_delay
+        self.on_busy = on_busy
+
+    def request(self, host, handler, request_body, verbose=False):
+        delay = 0.1
+        waited = 0.0
+
+        while True:
+            try:
+                return xmlrpclib.Transport.request(self, host, handler, request_body, verbose)
+
+            except xmlrpclib.ProtocolError as e:
+                if e.errcode != 503 or waited >= self.max_wait:
+                    raise
+
+            if self.on_busy is not None:
+                self.on_busy()
+
+            sleep(delay)
+            waited += delay
+            delay = min(delay * 2, self.max_delay)
+
+
+class PackageRecorder(object):
+    """
+    Stands in for the XMLRPC proxy, and records the requests that would be sent to the BlenderNEURON addon so they
+    can be saved as a scene package. See :any:`BlenderNEURON.save_scene_package`.
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def enqueue_method(self, name, args, kwargs, timeout=None):
+        # Packed payloads are stored unpacked, the whole package is compressed
+        args = [json.loads(zlib.decompress(arg.data).decode('utf-8')) if isinstance(arg, xmlrpclib.Binary) else arg
+                for arg in args]
+
+        self.tasks.append([name, args])
+
+    def run_method(self, name, args, kwargs):
+        self.enqueue_method(name, args, kwargs)
+
+    # Packages are built in their own Blender instance, without sessions
+    def session_enqueue_method(self, session, name, args, kwargs, timeout=None):
+        self.enqueue_method(name, args, kwargs)
+
+    def session_run_method(self, session, name, args, kwargs):
+        self.enqueue_method(name, args, kwargs)
+
+    def get_queue_length(self):
+        return 0
+
+    def cancel_all(self, session_id=None):
+        return 0
+
+    def cancel_tasks(self, task_ids):
+        return 0
+
+    def progress_start(self, session_id, totals):
+        return 0
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(pack_payload({'version': 1, 'tasks': self.tasks}))
+
+
+class StageMetrics(object):
+    """
+    Accumulates the number of calls and the time spent in each client stage (e.g. gather, collect, transport), and
+    counters such as the number of bytes sent. See :any:`BlenderNEURON.enable_metrics`.
+    """
+
+    class Timer(object):
+        def __init__(self, metrics, stage):
+            self.metrics = metrics
+            self.stage = stage
+
+        def __enter__(self):
+            self.start = time.time()
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            self.metrics.add(self.stage, time.time() - self.start)
+            return False
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.since = time.time()
+        self.lock = threading.Lock()
+
+    def measure(self, stage):
+        """
+        :param stage: The name of the stage
+        :return: A context manager that adds the time spent within it to the stage
+        """
+        return StageMetrics.Timer(self, stage)
+
+    def add(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+
+            s = self.stages[stage]
+            s['calls'] += 1
+            s['seconds'] += seconds
+            s['max_seconds'] = max(s['max_seconds'], seconds)
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def get_report(self):
+        with self.lock:
+            return {
+                'stages': dict((stage, dict(s)) for stage, s in self.stages.items()),
+                'counters': dict(self.counters),
+                'since': self.since,
+            }
+
+
+class NullTimer(object):
+    """The context manager returned by :any:`BlenderNEURON.measure` when metrics are disabled. Does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+null_timer = NullTimer()
+
+
+def as_completed(calls):
+    """
+    Iterates over the calls submitted to an executor returned by :any:`BlenderNEURON.get_send_executor`, in the
+    order they finish.
+    """
+    if futures is None or all(isinstance(call, SerialExecutor.Call) for call in calls):
+        return iter(calls)
+
+    return futures.as_completed(calls)
+
+
+class GroupOptions(object):
+    """
+    Base of the cell group model classes. Options are __slots__ attributes, so that groups don't each carry
+    dictionaries, but they can be read and set like the dictionaries they replace, e.g.
+    group['3d_data']['color_level']. Keys that are not options (e.g. added by users) are kept in self.extra.
+    """
+
+    __slots__ = ('extra',)
+
+    # The attribute names of the options, and the dictionary keys that are not valid attribute names
+    fields = frozenset()
+    key_attributes = {}
+
+    def __init__(self, options=None):
+        self.extra = {}
+
+        for key, value in (options or {}).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        name = self.key_attributes.get(key, key)
+
+        if name in self.fields:
+            if hasattr(self, name):
+                return getattr(self, name)
+
+        elif key in self.extra:
+            return self.extra[key]
+
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        name = self.key_attributes.get(key, key)
+
+        if name in self.fields:
+            setattr(self, name, value)
+
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        name = self.key_attributes.get(key, key)
+
+        if name in self.fields and hasattr(self, name):
+            delattr(self, name)
+
+        elif key in self.extra:
+            del self.extra[key]
+
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        if key not in self and len(default) > 0:
+            return default[0]
+
+        value = self[key]
+        del self[key]
+
+        return value
+
+    def keys(self):
+        attribute_keys = dict((name, key) for key, name in self.key_attributes.items())
+
+        return [attribute_keys.get(name, name) for name in self.__slots__ if hasattr(self, name)] + list(self.extra)
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def update(self, options):
+        for key, value in options.items():
+            self[key] = value
+
+
+class GroupData(GroupOptions):
+    """
+    The options and 3D data of a cell group that are sent to Blender, i.e. group['3d_data']. See
+    :any:`BlenderNEURON.create_cell_group`. Cells are kept in a :any:`CellCoords` object.
+    """
+
+    __slots__ = ('name', 'color', 'interaction_level', 'color_level', 'as_lines', 'segment_subdivisions',
+                 'circular_subdivisions', 'smooth_sections', 'cells', 'section_classes')
+
+    fields = frozenset(__slots__)
+
+    def __setitem__(self, key, value):
+        # Cell dictionaries (e.g. {} to clear the cells) are stored as arrays
+        if key == 'cells' and isinstance(value, dict):
+            value = CellCoords(value)
+
+        GroupOptions.__setitem__(self, key, value)
+
+
+class CellGroup(GroupOptions):
+    """
+    A group of cells, its options and collected activity. See :any:`BlenderNEURON.create_cell_group`.
+    """
+
+    __slots__ = ('cells', 'collect_activity', 'collect_variable', 'collection_period_ms', 'frames_per_ms',
+                 'frame_samples', 'frame_aggregation', 'spherize_soma_if_DeqL', 'sparse_threshold',
+                 'sparse_keyframe_ms', 'record_spikes', 'spike_threshold', 'spike_pulse_ms', 'data', 'collection_times',
+                 'collected_activity', 'activity_events', 'collection_plan', 'collector_stim', 'collector_con',
+                 'spike_recorders', 'frame_window')
+
+    fields = frozenset(__slots__)
+    key_attributes = {'3d_data': 'data'}
+
+
+class CellCoords(object):
+    """
+    The 3D points of the sections of a group's cells, in contiguous arrays: the coordinates and radii of all
+    sections, one after another, with tables of section names, cells, classes, and point offsets.
+
+    It can be used like the dictionary of cell names and section lists it replaces, e.g.
+    cells['TestCell[0]'][0]['coords'] (see :any:`BlenderNEURON.get_cell_coords`). The section dictionaries are
+    created when read.
+    """
+
+    __slots__ = ('cell_names', 'cell_index', 'section_names', 'section_cells', 'section_classes', 'spherical',
+                 'point_offsets', 'coords', 'radii')
+
+    def __init__(self, cells=None):
+        """
+        :param cells: An optional dictionary of cell names and their section lists to add
+        """
+        self.cell_names = []
+        self.cell_index = {}
+
+        # For each section. Classes are -1 if not known.
+        self.section_names = []
+        self.section_cells = array('l')
+        self.section_classes = array('l')
+        self.spherical = array('b')
+
+        # Points of section i are from point_offsets[i] to point_offsets[i+1], with 3 coords and 1 radius each
+        self.point_offsets = array('l', [0])
+        self.coords = array('d')
+        self.radii = array('d')
+
+        for cell_name, sections in (cells or {}).items():
+            self.add(cell_name, sections)
+
+    def add(self, cell_name, sections):
+        """
+        Adds sections to a cell. Sections of cells with several roots can be added in several calls.
+
+        :param cell_name: The name of the cell
+        :param sections: A list of section dictionaries, see :any:`BlenderNEURON.get_cell_coords`
+        """
+        if cell_name not in self.cell_index:
+            self.cell_index[cell_name] = len(self.cell_names)
+            self.cell_names.append(cell_name)
+
+        cell = self.cell_index[cell_name]
+
+        for section in sections:
+            self.section_names.append(section["name"])
+            self.section_cells.append(cell)
+            self.section_classes.append(section.get("class", -1))
+            self.spherical.append(1 if section.get("spherical", False) else 0)
+
+            self.coords.extend(section["coords"])
+            self.radii.extend(section["radii"])
+            self.point_offsets.append(len(self.radii))
+
+    def get_section(self, index):
+        """
+        :param index: The index of the section, in the order they were added
+        :return: The section dictionary
+        """
+        start, end = self.point_offsets[index], self.point_offsets[index + 1]
+
+        section = {
+            "name": self.section_names[index],
+            "coords": self.coords[start * 3:end * 3].tolist(),
+            "radii": self.radii[start:end].tolist(),
+        }
+
+        if self.section_classes[index] != -1:
+            section["class"] = self.section_classes[index]
+
+        if self.spherical[index]:
+            section["spherical"] = True
+
+        return section
+
+    def get_cell_sections(self):
+        # The section indices of each cell
+        result = [[] for _ in self.cell_names]
+
+        for index, cell in enumerate(self.section_cells):
+            result[cell].append(index)
+
+        return result
+
+    def __getitem__(self, cell_name):
+        cell = self.cell_index[cell_name]
+
+        return [self.get_section(index) for index, c in enumerate(self.section_cells) if c == cell]
+
+    def __contains__(self, cell_name):
+        return cell_name in self.cell_index
+
+    def __iter__(self):
+        return iter(self.cell_names)
+
+    def __len__(self):
+        return len(self.cell_names)
+
+    def keys(self):
+        return list(self.cell_names)
+
+    def items(self):
+        """
+        Yields the name and section list of each cell. The section dictionaries of a cell are created as it is
+        reached, so that iterating over a large group does not copy all of it.
+        """
+        for cell_name, indices in zip(self.cell_names, self.get_cell_sections()):
+            yield cell_name, [self.get_section(index) for index in indices]
+
+    def values(self):
+        for cell_name, sections in self.items():
+            yield sections
+
+
+class ActivityEvents(object):
+    """
+    The sparse activity of a group's parts (cells/sections/segments): a log of (part index, time, value) events
+    in contiguous arrays. A part's value is logged only when it moves more than the threshold away from its last
+    logged value, or when it was last logged keyframe_ms ago, so parts at rest take almost no memory. See the
+    'sparse_threshold' option of :any:`BlenderNEURON.create_cell_group`.
+    """
+
+    __slots__ = ('names', 'threshold', 'keyframe_ms', 'indices', 'times', 'values', 'logged_times',
+                 'logged_values', 'last_time', 'last_values')
+
+    def __init__(self, names, threshold, keyframe_ms=None):
+        """
+        :param names: The part names, in the order of the values passed to :any:`add`
+        :param threshold: The change of a part's value that is logged
+        :param keyframe_ms: The longest time between logged values of a part, or None to log only changes
+        """
+        self.names = names
+        self.threshold = threshold
+        self.keyframe_ms = keyframe_ms
+
+        self.indices = array('l')
+        self.times = array('d')
+        self.values = array('d')
+
+        # The last logged value of each part, and the values of the last collection
+        self.logged_times = array('d', [0.0] * len(names))
+        self.logged_values = array('d', [0.0] * len(names))
+        self.last_time = None
+        self.last_values = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def log(self, index, time, value):
+        self.indices.append(index)
+        self.times.append(time)
+        self.values.append(value)
+
+        self.logged_times[index] = time
+        self.logged_values[index] = value
+
+    def add(self, time, values):
+        """
+        Logs the parts whose values changed by more than the threshold, or that reached their keyframe time
+
+        :param time: The collection time
+        :param values: The values of all parts, in the order of names
+        """
+        if self.last_time is None:
+            for index, value in enumerate(values):
+                self.log(index, time, value)
+
+        else:
+            threshold = self.threshold
+            keyframe_ms = self.keyframe_ms if self.keyframe_ms is not None else float('inf')
+            last_time = self.last_time
+
+            for index, value in enumerate(values):
+                if abs(value - self.logged_values[index]) > threshold:
+                    # The value before the change is logged too, otherwise it would be interpolated from the
+                    # last logged value and the change would start too early
+                    if self.logged_times[index] < last_time:
+                        self.log(index, last_time, self.last_values[index])
+
+                    self.log(index, time, value)
+
+                elif time - self.logged_times[index] >= keyframe_ms:
+                    self.log(index, time, value)
+
+        self.last_time = time
+        self.last_values = array('d', values)
+
+    def get_parts(self):
+        """
+        :return: A list of (part name, activity values, times) tuples, which end with the last collected values
+        """
+        times = [[] for _ in self.names]
+        values = [[] for _ in self.names]
+
+        for index, time, value in zip(self.indices, self.times, self.values):
+            times[index].append(time)
+            values[index].append(value)
+
+        if self.last_time is not None:
+            for index, logged_time in enumerate(self.logged_times):
+                if logged_time < self.last_time:
+                    times[index].append(self.last_time)
+                    values[index].append(self.last_values[index])
+
+        return [(name, values[index], times[index]) for index, name in enumerate(self.names)]
+
+
 class BlenderNEURON(object):
     """The BlenderNEURON client class, which sends commands to the server created by the BlenderNEURON Blender add-on"""
 
@@ -38,11 +800,54 @@ class BlenderNEURON(object):
 
         self.IP = ip
         self.Port = str(port)
-        self.client = xmlrpclib.ServerProxy('http://'+ip+':'+port, allow_none=True)
+        # XMLRPC proxies are not thread safe, each thread gets its own, see: client
+        self.thread_clients = threading.local()
         self.progress_client = xmlrpclib.ServerProxy('http://' + ip + ':' + port)
 
         self.activity_simplification_tolerance = 0.32 # mV
 
+        # Packing and compression of morphology/activity chunks is done by a pool of workers, which is reused by
+        # all sends. 'thread' pools avoid forking the NEURON process (zlib compression runs outside of the GIL).
+        # 'process' pools also run the JSON encoding in parallel, but they fork NEURON, and the chunks are pickled
+        # to the workers. Spawned workers are not used, as they would re-run the model script.
+        self.send_pool_type = 'thread'
+        self.send_workers = None # None = one per CPU core
+        self.send_chunk_size = 1000 # sections or activity parts per chunk
+        self.send_executors = {} # (pool type, workers): SharedExecutor
+        self.send_executor_lock = threading.Lock()
+
+        # Activity streaming during simulation, see: start_live_stream
+        self.live_stream = None
+
+        # If set, activity is written to an archive in this directory instead of being sent as keyframes. Spikes
+        # of groups that record them are still sent as keyframes. See: save_activity_archive
+        self.activity_archive_path = None
+
+        # How Blender animates activity: 'keyframes' inserts keyframes on each segment material, 'texture' packs the
+        # activity of segment meshes into one image that a shared material samples at the current frame, and 'baked'
+        # precomputes the vertex colors of each frame, which are shown on frame change
+        self.activity_backend = 'keyframes'
+
+        # Whether to release the gathered 3D points of groups once they are sent. They are gathered again before each
+        # send, see: gather_group_coords
+        self.free_sent_coords = False
+
+        # Baked colors are kept compressed in blocks of frames, of which this many are kept decompressed
+        self.baked_block_frames = 100
+        self.baked_cached_blocks = 8
+
+        # Stage timings and counters, see: enable_metrics
+        self.stage_metrics = None
+
+        # The addon session of this client, see: open_session
+        self.session = None
+
+        # Seconds after which Blender skips or stops an enqueued task, None for no deadline. See: enqueue_method
+        self.task_timeout = None
+
+        # Seconds to keep retrying requests while Blender is too busy to accept them, see: BusyRetryTransport
+        self.busy_max_wait = 300
+
         # Example groups:
         # blender.groups = {
         # 	"earth": {     cells: [h.Cell[0].soma],    color_level = 'Segment', interaction_level = 'Segment', collection_period_ms = 0.1, res_u, res_v, as_lines, color, smooth_sections},
@@ -52,83 +857,336 @@ class BlenderNEURON(object):
         # }
         self.groups = {}
 
-        # Example connections:
-        # blender.conenctions = [h.NetCon[0], h.NetCon[1]]
-        self.connections = []
-        self.connection_data = {}
+        # Example connections:
+        # blender.conenctions = [h.NetCon[0], h.NetCon[1]]
+        self.connections = []
+        self.connection_data = {}
+
+        # The (section count, segment count) of the model when last initialized, see build_collection_plan
+        self.model_structure = None
+
+        self.clear_activity()
+
+        # Clear previously recorded activity on h.run()
+        self.fih = self.h.FInitializeHandler(self.clear_activity)
+
+        self.connectionStatus = self.h.ref('---')
+        self.progressStatus = self.h.ref('Idle')
+        self.blenderStatus = self.h.ref('---')
+
+        # The last background send and the GUI timer that displays its progress
+        self.send_handle = None
+        self.progress_timer = None
+
+        # The handle of the last send_snapshot, which the next send stops, and whose Blender tasks it cancels
+        self.last_send_handle = None
+        self.last_send_lock = threading.Lock()
+
+        self.include_morphology = True
+        self.include_connections = True
+        self.include_activity = True
+
+        if show_panel:
+            self.show_panel()
+
+        if show_tutorial:
+            print("")
+            print("-== NEURON python module of BlenderNEURON is ready ==-")
+            print("  It will send commands to Blender at the following address:" + self.IP + ":" + self.Port)
+            print("  If you haven't already, start Blender with BlenderNEURON addon installed")
+            print("  The address on the addon's tab in Blender should match the above IP and Port.")
+            print("")
+            print("  In python console, type: bn.is_blender_ready() to check if connection to Blender can be established.")
+            print("")
+            print("  To visualize a model in Blender: ")
+            print("  1) Load it in NEURON. Graph > Shape plot should show active cell morphology.")
+            print("  2) Click 'Send to Blender' in the GUI panel or type 'bn.to_blender()' in python console.")
+            print("  3) Switch to Blender window to see the model.")
+            print("")
+            print("  To visualize activity: ")
+            print("  1) Load model in NEURON")
+            print("  2) Click 'Prepare for Simulation'. During simulation, this will save compartment activity to be sent to Blender.")
+            print("  3) Run simulation (e.g. 'h.run()')")
+            print("  4) Click 'Send to Blender' ")
+            print("  5) Switch to Blender window to see the model.")
+            print("")
+            print("  If you add cells or make changes to morphology, click 'Re-Gather Sections before 'Send'ing or 'Prepare'ing.")
+            print("")
+            print(" Blender basics:")
+            print("   HOME key to zoom out and view the full scene")
+            print("   Mouse wheel - zoom in/out")
+            print("   Hold down and drag mouse middle button - rotate")
+            print("   SHIFT + hold down and drag mouse middle button - pan view")
+            print("   Right click on an object - select the object and see its name")
+            print("   Numpad '.' key - to zoom in on a selected object")
+            print("")
+            print("   There are many great Blender tutorials online. ")
+            print("   These are a good start: https://cloud.blender.org/p/blender-inside-out/560414b7044a2a00c4a6da98")
+
+    def to_blender(self, color_unique_names=True):
+        """
+        A convenience method to send all groups of cells defined by self.groups property to Blender.
+        The method first clears the Blender scene, sends the morphology, any activity, and NetConns, links them to the scene (shows),
+        zooms out the camera to include all cells/sections, colors the sections based on their names, and sets the animation length based on h.tstop
+
+        If called without creating any groups, it will create a default "all" group which contains all sections instantiated in NEURON
+
+        :param color_unique_names: Whether to color the cell sections based on their names, gray otherwise
+        :return: None
+        """
+        self.wait_till_blender_is_ready()
+        self.send_snapshot(self.gather_snapshot(color_unique_names))
+
+    def to_blender_async(self, color_unique_names=True):
+        """
+        Non-blocking version of :any:`to_blender`. The model data is read from NEURON before this method returns,
+        but it is packed and sent to Blender by a background thread. NEURON can be used (e.g. to start the next
+        simulation) while the send is in progress.
+
+        :param color_unique_names: Whether to color the cell sections based on their names, gray otherwise
+        :return: A :any:`SendHandle` which can be used to monitor the progress, wait for, or cancel the send
+        """
+        self.wait_till_blender_is_ready()
+
+        snapshot = self.gather_snapshot(color_unique_names)
+        handle = SendHandle(snapshot)
+
+        # A process pool would be forked from the sender thread, while NEURON keeps running
+        executor = self.get_send_executor(pool_type='thread')
+
+        sender = threading.Thread(target=handle.run, args=(self.send_snapshot, snapshot, handle, executor))
+        sender.daemon = True
+        sender.start()
+
+        self.send_handle = handle
+        self.start_progress_timer()
+
+        return handle
+
+    def render_animation_parallel(self, destination_path, workers=None, chunk_frames=None, max_attempts=3,
+                                  wait=True, progress_callback=None, poll_interval=1.0):
+        """
+        Renders the Blender animation to image files using several background Blender processes, each rendering
+        a range of frames. Frames that already have an image file in destination_path are skipped, so calling this
+        method again after a crash or cancellation renders only the missing frames.
+
+        :param destination_path: The directory where Blender will save the frame images
+        :param workers: The number of Blender processes to run at a time. One per Blender CPU core if None.
+        :param chunk_frames: The number of frames rendered by each process. If None, a value is chosen to give
+         each worker several chunks.
+        :param max_attempts: The number of times a range of frames is rendered before the render fails
+        :param wait: Whether to block until the render is finished. If False, use :any:`get_render_progress` to
+         follow the render.
+        :param progress_callback: If waiting, a function called with the :any:`get_render_progress` dict every
+         poll_interval seconds
+        :param poll_interval: The number of seconds between progress checks while waiting
+        :return: The number of frames to render
+        :raise: Exception if waiting and some frames failed to render after max_attempts attempts, or the render
+         stopped because of an error
+        """
+        frame_count = self.run_method('render_animation_parallel', destination_path, workers, chunk_frames,
+                                      max_attempts)
+
+        while wait:
+            progress = self.get_render_progress()
+
+            if progress_callback is not None:
+                progress_callback(progress)
+
+            if not progress["running"]:
+                if progress["error"] is not None:
+                    raise Exception(progress["error"])
+
+                break
+
+            sleep(poll_interval)
+
+        return frame_count
+
+    def get_render_progress(self):
+        """
+        Gets the progress of the last :any:`render_animation_parallel` render
+
+        :return: None if no render was started. Otherwise, a dict with 'running', 'error' (None unless some
+         frames failed to render, or the render stopped because of an error), 'done' and 'total' frame counts, and 'chunks', with the 'start', 'end', 'status',
+         'done' and 'total' of each range of frames.
+        """
+        return self.client.get_render_progress()
+
+    def save_scene_package(self, path, color_unique_names=True):
+        """
+        Saves everything :any:`to_blender` would send to Blender into a self-contained scene package file. Blender
+        does not need to be running. The package can be turned into a .blend file by a headless Blender, e.g. in
+        a cluster batch job, with::
+
+            blender --background --python <addons dir>/blender_neuron/batch.py -- model.bnpkg model.blend
+
+        If self.activity_archive_path is set, the package refers to the archive instead of including the activity.
+
+        :param path: The scene package file path, e.g. 'model.bnpkg'
+        :param color_unique_names: Whether to color the cell sections based on their names, gray otherwise
+        :return: None
+        """
+        recorder = PackageRecorder()
+        local = self.thread_clients
+        previous_proxy = getattr(local, 'proxy', None)
+
+        # Record the requests instead of sending them
+        local.proxy = recorder
+
+        try:
+            self.send_snapshot(self.gather_snapshot(color_unique_names))
+
+        finally:
+            local.proxy = previous_proxy
+
+            if previous_proxy is None:
+                del local.proxy
+
+        recorder.save(path)
+
+    def cancel_send(self):
+        """
+        Cancels the last send started with :any:`to_blender_async`, if it is still in progress, and the tasks
+        Blender has received but not finished
+        """
+        if self.send_handle is not None:
+            self.send_handle.cancel()
+            self.cancel_send_tasks(self.send_handle)
+
+    def gather_snapshot(self, color_unique_names=True):
+        """
+        Reads all the data to be sent by :any:`to_blender` from NEURON. The snapshot does not reference NEURON
+        objects, and it is not modified by subsequent simulations, so it can be sent from any thread.
+
+        :param color_unique_names: Whether to color the cell sections based on their names
+        :return: A snapshot dictionary for :any:`send_snapshot`
+        """
+        self.setup_defaults_if_needed()
+
+        snapshot = {
+            'groups': [],
+            'connections': None,
+            'activity': [],
+            'spikes': [],
+            'activity_archive': None,
+            'num_frames': self.get_num_frames(),
+            'color_unique_names': color_unique_names,
+        }
+
+        if self.include_morphology:
+            with self.measure('gather_morphology'):
+                for group in self.groups.values():
+                    self.gather_group_coords(group)
+                    snapshot['groups'].append(dict(group['3d_data']))
+
+        if self.include_connections:
+            with self.measure('gather_connections'):
+                snapshot['connections'] = dict(self.gather_cons())
+
+        if self.include_activity:
+            self.flush_frame_windows()
+
+            if self.activity_archive_path is not None:
+                with self.measure('save_activity_archive'):
+                    self.save_activity_archive(self.activity_archive_path)
+
+                snapshot['activity_archive'] = os.path.abspath(self.activity_archive_path)
+
+                # Spikes are not archived, they are sent as the short pulses of their cells
+                with self.measure('gather_activity'):
+                    snapshot['spikes'] = self.get_spike_snapshot()
+
+            else:
+                with self.measure('gather_activity'):
+                    snapshot['activity'] = self.get_activity_snapshot()
+                    snapshot['spikes'] = self.get_spike_snapshot()
+
+        return snapshot
+
+    def send_snapshot(self, snapshot, handle=None, executor=None):
+        """
+        Sends a snapshot created with :any:`gather_snapshot` to Blender: clears the scene, sends the morphology,
+        connections, and activity, links and frames the objects, and sets the animation length. An earlier send that
+        is still in progress is stopped first, and the Blender tasks it queued are cancelled.
+
+        :param snapshot: The snapshot dictionary
+        :param handle: An optional :any:`SendHandle` to report progress to and check for cancellation
+        :param executor: The executor to use for packing. The one of :any:`get_send_executor` if None.
+        """
+        if handle is None:
+            # Blocking sends are run with a handle too, so that a later send can wait for them to stop
+            handle = SendHandle(snapshot)
+            handle.run(self.send_snapshot, snapshot, handle, executor)
+            handle.result()
+            return
+
+        if executor is None:
+            executor = self.get_send_executor()
+
+        with self.measure('send'):
+            # Any earlier send, still sending or still being built by Blender, is replaced by this one. Scene
+            # packages are recorded without affecting the sends to Blender.
+            if not isinstance(self.client, PackageRecorder):
+                with self.last_send_lock:
+                    previous, self.last_send_handle = self.last_send_handle, handle
+
+                if previous is not None and previous is not handle:
+                    # Its queued tasks are cancelled first, as its sender may be waiting for them to finish (see:
+                    # set_render_params), then again once it has stopped queuing tasks
+                    previous.cancel()
+                    self.cancel_send_tasks(previous)
+                    previous.wait()
+                    self.cancel_send_tasks(previous)
+
+            self.client.progress_start(self.session if self.session is not None else "", {
+                'cells': sum(len(data['cells']) for data in snapshot['groups']),
+                'activity': sum(len(parts) for times, parts, frames_per_ms in snapshot['activity']) +
+                            sum(len(names) for names, spike_times, frames_per_ms, pulse_ms in snapshot['spikes']),
+            })
+
+            handle.track(task_ids=[self.enqueue_method("clear")])
 
-        self.clear_activity()
+            with executor:
+                # All groups are packed at once, and sent in order as they finish
+                submitted = [self.submit_group_data(data, executor) for data in snapshot['groups']]
 
-        # Clear previously recorded activity on h.run()
-        self.fih = self.h.FInitializeHandler(self.clear_activity)
+                for data, group in zip(snapshot['groups'], submitted):
+                    self.finish_group_data(group, handle)
 
-        # self.progressNEURON = self.h.ref('0.0')
-        # self.progressBlender = self.h.ref('0.0')
-        # self.progressPercent = self.h.ref('0.0')
-        self.connectionStatus = self.h.ref('---')
+                    if self.free_sent_coords:
+                        self.free_group_coords(data)
 
-        self.include_morphology = True
-        self.include_connections = True
-        self.include_activity = True
+                if snapshot['connections'] is not None:
+                    packed = pack_payload(snapshot['connections'])
+                    handle.track(byte_count=len(packed), task_ids=[self.enqueue_packed_method("create_cons", packed)])
 
-        if show_panel:
-            self.show_panel()
+                self.send_activity_snapshot(snapshot['activity'], executor, handle, snapshot['spikes'])
 
-        if show_tutorial:
-            print("")
-            print("-== NEURON python module of BlenderNEURON is ready ==-")
-            print("  It will send commands to Blender at the following address:" + self.IP + ":" + self.Port)
-            print("  If you haven't already, start Blender with BlenderNEURON addon installed")
-            print("  The address on the addon's tab in Blender should match the above IP and Port.")
-            print("")
-            print("  In python console, type: bn.is_blender_ready() to check if connection to Blender can be established.")
-            print("")
-            print("  To visualize a model in Blender: ")
-            print("  1) Load it in NEURON. Graph > Shape plot should show active cell morphology.")
-            print("  2) Click 'Send to Blender' in the GUI panel or type 'bn.to_blender()' in python console.")
-            print("  3) Switch to Blender window to see the model.")
-            print("")
-            print("  To visualize activity: ")
-            print("  1) Load model in NEURON")
-            print("  2) Click 'Prepare for Simulation'. During simulation, this will save compartment activity to be sent to Blender.")
-            print("  3) Run simulation (e.g. 'h.run()')")
-            print("  4) Click 'Send to Blender' ")
-            print("  5) Switch to Blender window to see the model.")
-            print("")
-            print("  If you add cells or make changes to morphology, click 'Re-Gather Sections before 'Send'ing or 'Prepare'ing.")
-            print("")
-            print(" Blender basics:")
-            print("   HOME key to zoom out and view the full scene")
-            print("   Mouse wheel - zoom in/out")
-            print("   Hold down and drag mouse middle button - rotate")
-            print("   SHIFT + hold down and drag mouse middle button - pan view")
-            print("   Right click on an object - select the object and see its name")
-            print("   Numpad '.' key - to zoom in on a selected object")
-            print("")
-            print("   There are many great Blender tutorials online. ")
-            print("   These are a good start: https://cloud.blender.org/p/blender-inside-out/560414b7044a2a00c4a6da98")
+            if snapshot['activity_archive'] is not None:
+                handle.track(task_ids=[self.enqueue_method('load_activity_archive', snapshot['activity_archive'])])
 
-    def to_blender(self, color_unique_names=True):
-        """
-        A convenience method to send all groups of cells defined by self.groups property to Blender.
-        The method first clears the Blender scene, sends the morphology, any activity, and NetConns, links them to the scene (shows),
-        zooms out the camera to include all cells/sections, colors the sections based on their names, and sets the animation length based on h.tstop
+            task_ids = [self.enqueue_method('link_objects'), self.enqueue_method('show_full_scene')]
+            handle.track(tasks=2, task_ids=task_ids)
 
-        If called without creating any groups, it will create a default "all" group which contains all sections instantiated in NEURON
+            if snapshot['color_unique_names']:
+                handle.track(task_ids=[self.enqueue_method('color_by_unique_materials')])
 
-        :param color_unique_names: Whether to color the cell sections based on their names, gray otherwise
-        :return: None
+            self.run_method('set_render_params', (0, snapshot['num_frames']))
+            handle.track()
+
+    def free_group_coords(self, data):
         """
-        self.wait_till_blender_is_ready()
-        self.enqueue_method("clear")
-        self.send_model()
-        self.enqueue_method('link_objects')
-        self.enqueue_method('show_full_scene')
+        Releases the 3D points of a sent group snapshot, and of the group, if they have not been gathered again since
+
+        :param data: The group's '3d_data' in the snapshot, see :any:`gather_snapshot`
+        """
+        group = self.groups.get(data['name'])
 
-        if color_unique_names:
-            self.enqueue_method('color_by_unique_materials')
+        if group is not None and group['3d_data']['cells'] is data['cells']:
+            group['3d_data']['cells'] = CellCoords()
 
-        self.run_method('set_render_params', (0, self.get_num_frames()))
+        data['cells'] = None
 
     def refresh(self):
         """
@@ -167,21 +1225,96 @@ class BlenderNEURON(object):
         self.h.xcheckbox('Include Activity', (self, 'include_activity'))
         self.h.xlabel(" ")
         self.h.xbutton('Prepare For Simulation', self.prepare_for_collection)
-        self.h.xbutton('Send To Blender', self.to_blender)
+        self.h.xbutton('Send To Blender', self.to_blender_async)
         self.h.xlabel(" ")
         self.h.xbutton('Re-Gather Sections', self.refresh)
         self.h.xlabel(" ")
         self.h.xlabel("Connection status:")
         self.h.xvarlabel(self.connectionStatus)
         self.h.xbutton('Test Connection', self.is_blender_ready)
-
-        # self.h.xlabel('Progress:')
-        # self.h.xvarlabel(self.progressNEURON)
-        # self.h.xvarlabel(self.progressBlender)
-        # self.h.xvarlabel(self.progressPercent)
+        self.h.xlabel(" ")
+        self.h.xlabel('Progress:')
+        self.h.xvarlabel(self.progressStatus)
+        self.h.xvarlabel(self.blenderStatus)
+        self.h.xbutton('Cancel Send', self.cancel_send)
 
         self.h.xpanel(500, 10)
 
+    def start_progress_timer(self):
+        """
+        Starts a NEURON GUI timer that periodically shows the progress of the current send in the GUI panel. The
+        labels are updated from NEURON's thread because the NEURON GUI is not thread safe.
+        """
+        if self.progress_timer is None:
+            try:
+                self.progress_timer = self.h.Timer(self.update_progress_status)
+                self.progress_timer.seconds(0.5)
+
+            # Timer is not available when NEURON is running without the GUI
+            except Exception:
+                return
+
+        self.progress_timer.start()
+
+    def update_progress_status(self):
+        """
+        Shows the status of the last send, and Blender's progress building it, in the GUI panel. Stops the progress
+        timer once the send is done, and Blender has no more tasks from it.
+        """
+        if self.send_handle is None:
+            return
+
+        self.progressStatus[0] = self.send_handle.get_status()
+
+        try:
+            progress = self.get_blender_progress()
+            self.blenderStatus[0] = self.format_progress(progress)
+
+        except Exception:
+            progress = None
+            self.blenderStatus[0] = 'Blender: not responding'
+
+        if self.send_handle.done() and (progress is None or progress['tasks'] == 0) and self.progress_timer is not None:
+            self.progress_timer.end()
+
+    def get_blender_progress(self):
+        """
+        Gets Blender's progress on the last send of this client (see :any:`to_blender_async`)
+
+        :return: A dictionary with the 'done' and 'total' number of 'cells' and 'activity' parts, the 'rates' (per
+         second) of cells, activity parts, and 'keyframes', the 'elapsed' seconds since the send started, the 'eta'
+         seconds until Blender is done (None if not known yet), and the number of Blender 'tasks' still to run
+        """
+        return self.client.get_progress(self.session if self.session is not None else "")
+
+    @staticmethod
+    def format_progress(progress):
+        """
+        :param progress: The progress dictionary returned by :any:`get_blender_progress`
+        :return: A short, human readable progress string, suitable for the GUI panel
+        """
+        parts = []
+
+        for unit in ['cells', 'activity']:
+            if progress['total'].get(unit):
+                parts.append("%s/%s %s (%.0f/s)" % (
+                    progress['done'].get(unit, 0), progress['total'][unit], unit, progress['rates'].get(unit, 0)
+                ))
+
+        if progress['rates'].get('keyframes'):
+            parts.append("%.0f keyframes/s" % progress['rates']['keyframes'])
+
+        if progress['tasks'] == 0:
+            status = 'Done'
+
+        elif progress['eta'] is not None:
+            status = 'ETA %.0f s' % progress['eta']
+
+        else:
+            status = 'Building'
+
+        return "Blender %s: %s" % (status, ", ".join(parts))
+
     def setup_defaults_if_needed(self):
         """
         Checks if there are any cell groups or connections setup for export to Blender, creates defaults if not.
@@ -199,23 +1332,40 @@ class BlenderNEURON(object):
 
     def setup_default_connections(self):
         """
-        Sets up all NEURON NetCon's to be exported as synapses to Blender
+        Sets up all NEURON NetCon's to be exported as synapses to Blender. The connection group has the following
+        options:
+
+        **group['aggregation_level']**: None, "Cell", or "Voxel". If None, each NetCon is drawn. Otherwise, NetCons are
+        binned into bundles, and one segment is drawn for each bundle, from the mean source to the mean target location
+        of its NetCons. "Cell" bins NetCons by their source and target cells (sections that are not part of a cell
+        template are binned by section), and "Voxel" by the cubes of space that their sources and targets are in.
+
+        **group['voxel_size']**: float, e.g. 100, the size in um of the "Voxel" aggregation cubes.
+
+        **group['max_connections']**: int or None. If set, at most this many NetCons (or bundles) are sent to Blender.
+
+        **group['selection']**: "Weight" or "Random". Whether to keep the NetCons (or bundles) with the largest total
+        absolute weight[0], or a random sample of them, when there are more than group['max_connections'].
+
+        **group['max_radius']**: float, e.g. 5. Bundles are drawn thicker the larger their total weight, up to this
+        radius. Single NetCons have a radius of 1.
         """
 
         # Include all NetCon connections by default
         self.connections = self.h.NetCon
 
-        # Connections will be rendered as segments connecting cells
+        # Connections will be rendered as one Blender object, with a segment connecting the cells of each NetCon
         group =  {
             'name': "Synapses",
             'color': [1, 1, 0],
-            'interaction_level': "Group",
-            'color_level': "Group",
-            'as_lines': False,
-            'circular_subdivisions': 4,
-            'segment_subdivisions': 1,
-            'smooth_sections': False,
-            'cells': {}
+            'aggregation_level': None,
+            'voxel_size': 100.0,
+            'max_connections': None,
+            'selection': 'Weight',
+            'max_radius': 5.0,
+            'starts': [],
+            'ends': [],
+            'radii': [],
         }
 
         self.connection_data["Synapses"] = group
@@ -239,6 +1389,9 @@ class BlenderNEURON(object):
             group["3d_data"]["cells"] = {}
             group['collection_times'] = []
             group['collected_activity'] = {}
+            group['activity_events'] = None
+            group['spike_recorders'] = None
+            group.pop('collection_plan', None)
 
         else:
             self.create_cell_group("all", root_sections)
@@ -257,9 +1410,38 @@ class BlenderNEURON(object):
         **group['collect_variable']**: string e.g. 'v', the name of the section variable to collect.
 
         **group['collection_period_ms']**: int, e.g. 1, how often per simulator ms to collect activity 1=one datapoint per ms.
+        Or 'auto' to collect at the time of each Blender frame (every 1/frames_per_ms ms), so that there is one value
+        for each frame, and none that would not be shown.
 
         **group['frames_per_ms']**: float, e.g. 2.0, how many Blender frames to use for each simulator ms.
 
+        **group['frame_samples']**: int, e.g. 1, with 'auto' collection_period_ms, the number of times to collect
+        during each frame. Values above 1 anti-alias the activity: the samples of a frame are combined into its one
+        value with 'frame_aggregation', so that changes shorter than a frame (e.g. spikes) are not missed. The samples
+        of a frame are those from its time up to the time of the next frame. The last frame, which the simulation
+        ends in, is combined from the samples it has.
+
+        **group['frame_aggregation']**: one of 'mean', 'min', or 'max', how the samples of a frame are combined.
+
+        **group['sparse_threshold']**: None, or float e.g. 1.0, to record a part's value only when it changes by more
+        than this amount (e.g. mV) from its last recorded value. Parts at rest are then not stored at every
+        collection, so memory and the amount of activity sent grow with the activity of the model rather than with
+        its size and simulation length. None records every value.
+
+        **group['sparse_keyframe_ms']**: None, or float e.g. 50, the longest time between recorded values of a part
+        when 'sparse_threshold' is set, so that slow drifts below the threshold still show.
+
+        **group['record_spikes']**: True/False, whether to record only the spike times of each cell, instead of
+        collecting collect_variable at every collection period. Spikes are recorded by NEURON with a NetCon on the
+        root section of each cell, so there is no cost per simulation step, and only the spike times are sent.
+        Blender shows each spike as a short emission pulse of the cell. The group is colored at the 'Cell' level.
+        See :any:`create_spike_recorders`.
+
+        **group['spike_threshold']**: float, e.g. 0, the voltage (mV) at the middle of the root section that
+        counts as a spike when 'record_spikes' is True.
+
+        **group['spike_pulse_ms']**: float, e.g. 2, the length (ms) of the emission pulse of each spike.
+
         **group['spherize_soma_if_DeqL']**: True/False, whether to render sections that include "soma" in their names as spheres if
         their lengths and diameters are approximately equal.
 
@@ -306,21 +1488,28 @@ class BlenderNEURON(object):
         of straight lines. True results in more visually appealing morphology, but requires more polygons depending on
         the 'segment_subdivisions' value (above).
 
-        :return: The created group dictionary
+        :return: The created group, a :any:`CellGroup`, which can be used like a dictionary
         """
 
         # Adjust level of detail based on cell count
         level = self.get_detail_level(len(cells))
 
         # Create group based on default settings
-        group = {
+        group = CellGroup({
             'cells': cells,
             'collect_activity': True,
             'collect_variable': 'v',
             'collection_period_ms': 1,
             'frames_per_ms': 2.0,
+            'frame_samples': 1,
+            'frame_aggregation': 'mean',
             'spherize_soma_if_DeqL': True,
-            '3d_data': {
+            'sparse_threshold': None,
+            'sparse_keyframe_ms': 50,
+            'record_spikes': False,
+            'spike_threshold': 0,
+            'spike_pulse_ms': 2,
+            '3d_data': GroupData({
                 'name': name,
                 'color': [1, 1, 1],
                 'interaction_level': level,
@@ -330,10 +1519,11 @@ class BlenderNEURON(object):
                 'circular_subdivisions': 12,
                 'smooth_sections': True,
                 'cells': {}
-            },
+            }),
             'collection_times': [],
             'collected_activity': {},
-        }
+            'activity_events': None,
+        })
 
         # Set any custom options for the group
         BlenderNEURON.update_group(group, options)
@@ -380,7 +1570,7 @@ class BlenderNEURON(object):
         if group['collect_activity']:
             collector_stim = self.h.NetStim(0.5)
             collector_stim.start = 0
-            collector_stim.interval = group['collection_period_ms']
+            collector_stim.interval = self.get_collection_period(group)
             collector_stim.number = 1e9
             collector_stim.noise = 0
             collector_con = self.h.NetCon(collector_stim, None)
@@ -390,46 +1580,462 @@ class BlenderNEURON(object):
             group["collector_con"] = collector_con
 
 
-    def prepare_for_collection(self):
-        """
-        Checks and creates a default group and its activity collectors
+    def prepare_for_collection(self):
+        """
+        Checks and creates a default group and its activity collectors, and builds the collection plans of the
+        groups. See :any:`build_collection_plan`.
+        """
+
+        self.setup_defaults_if_needed()
+        self.model_structure = self.get_model_structure()
+
+        for group in self.groups.values():
+            if not group['collect_activity']:
+                continue
+
+            if group['record_spikes']:
+                self.create_spike_recorders(group)
+
+            else:
+                group['spike_recorders'] = None
+                self.build_collection_plan(group)
+
+            # Spike recording needs no collection steps
+            if 'collector_stim' in group:
+                group['collector_stim'].number = 0 if group['record_spikes'] else 1e9
+                group['collector_stim'].interval = self.get_collection_period(group)
+
+    def get_collection_period(self, group):
+        """
+        :param group: The group dictionary
+        :return: The time (ms) between collections of the group: its collection_period_ms, or if that is 'auto', the
+            time between Blender frames divided by the group's frame_samples
+        """
+        if group['collection_period_ms'] == 'auto':
+            return 1.0 / group['frames_per_ms'] / group['frame_samples']
+
+        return group['collection_period_ms']
+
+    def create_spike_recorders(self, group):
+        """
+        Creates a NetCon on the root section of each group cell that records the cell's spike times into a Vector.
+        NEURON records the spikes as they happen, so unlike collection, recording has no cost at each step.
+
+        Spikes are shown per cell, so the group is set to be colored at the 'Cell' level (and interacted with at
+        the 'Cell' or 'Group' level).
+
+        :param group: The group dictionary
+        """
+        data = group['3d_data']
+        data['color_level'] = 'Cell'
+
+        if data['interaction_level'] not in ['Group', 'Cell']:
+            data['interaction_level'] = 'Cell'
+
+        recorders = []
+
+        for root in group['cells']:
+            cell_name = root.cell().hname() if root.cell() is not None else root.name()
+
+            spike_times = self.h.Vector()
+            spike_con = self.h.NetCon(root(0.5)._ref_v, None, sec=root)
+            spike_con.threshold = group['spike_threshold']
+            spike_con.record(spike_times)
+
+            recorders.append((cell_name, spike_con, spike_times))
+
+        group['spike_recorders'] = recorders
+
+    def build_collection_plan(self, group):
+        """
+        Finds the segments to be recorded from, and the names of the parts (cells/sections/segments) they color,
+        based on the group's color level. The plan is built once, so that each collection step only reads the
+        segment values. If NEURON has PtrVector, the values are read with a single gather() call.
+
+        The plan is rebuilt by :any:`collect_group` if the group's color_level or collect_variable changes, or if
+        sections or segments were added or removed since the plan was built. The model structure is checked when
+        the simulation is initialized, because changing it moves the segment values the plan points to.
+
+        :param group: The group dictionary
+        :return: The plan dictionary, which is also stored in group['collection_plan']
+        """
+        level = group['3d_data']["color_level"]
+        variable = group["collect_variable"]
+
+        plan = {
+            'key': (level, variable, self.model_structure),
+            'names': [],
+            'segments': [],
+            'mean': False,
+            'activity': None,
+            'lists': [],
+        }
+
+        # Every segment of each section of each cell
+        if level == 'Segment':
+            for root in group["cells"]:
+                self.add_segments_to_plan(root, plan)
+
+        # The middle of each section of each cell
+        elif level == 'Section':
+            for root in group["cells"]:
+                self.add_sections_to_plan(root, plan, recursive = True)
+
+        # The middle of somas of each cell
+        elif level == 'Cell':
+            for root in group["cells"]:
+                self.add_sections_to_plan(root, plan, recursive = False)
+
+        # The mean of the somas of each cell
+        else:
+            plan['names'].append(group['3d_data']['name'] + "Group")
+            plan['segments'] = [soma(0.5) for soma in group["cells"]]
+            plan['mean'] = True
+
+        plan['pointers'], plan['values'] = self.get_pointer_vector(plan['segments'], variable)
+
+        group['collection_plan'] = plan
+
+        return plan
+
+    def get_model_structure(self):
+        """
+        :return: The number of sections and segments of the model. A change means the collection plans are stale.
+        """
+        section_count = segment_count = 0
+
+        for sec in self.h.allsec():
+            section_count += 1
+            segment_count += sec.nseg
+
+        return section_count, segment_count
+
+    def get_pointer_vector(self, segments, variable):
+        """
+        Creates a NEURON PtrVector that points to the variable of each segment, and a Vector to gather the values
+        into
+
+        :return: A (PtrVector, Vector) tuple, or (None, None) if PtrVector is not available
+        """
+        if len(segments) == 0:
+            return None, None
+
+        try:
+            pointers = self.h.PtrVector(len(segments))
+            values = self.h.Vector(len(segments))
+
+        except (AttributeError, LookupError):
+            return None, None
+
+        ref = '_ref_' + variable
+
+        for i, seg in enumerate(segments):
+            pointers.pset(i, getattr(seg, ref))
+
+        return pointers, values
+
+    def bind_collection_plan(self, plan, activity):
+        """
+        Points a collection plan to the activity buffers of a group. The buffers are replaced at the start of each
+        simulation and live stream window.
+
+        :param plan: The plan returned by :any:`build_collection_plan`
+        :param activity: The group's 'collected_activity' dictionary
+        """
+        for name in plan['names']:
+            if name not in activity:
+                activity[name] = []
+
+        plan['lists'] = [activity[name] for name in plan['names']]
+        plan['activity'] = activity
+
+    @property
+    def client(self):
+        """
+        The XMLRPC proxy of the calling thread, which is used to communicate with the BlenderNEURON addon
+        """
+        local = self.thread_clients
+
+        if not hasattr(local, 'proxy'):
+            transport = BusyRetryTransport(self.busy_max_wait, on_busy=self.count_busy_retry)
+            local.proxy = xmlrpclib.ServerProxy('http://' + self.IP + ':' + self.Port, transport, allow_none=True)
+
+        return local.proxy
+
+    def count_busy_retry(self):
+        if self.stage_metrics is not None:
+            self.stage_metrics.count('busy_retries')
+
+    def run_method(self, name, *args, **kwargs):
+        """
+        Synchronously requests and blocks while a BlenderNEURON addon method is executed in Blender
+
+        :param name: The name of the BlenderNEURON addon method to call
+        :param args: method parameters
+        :param kwargs: This should be blank, as named parameters are not supported over XMLRPC
+        :return: The value returned by the BlenderNEURON addon method
+        """
+        with self.measure('transport'):
+            if self.session is not None:
+                return self.client.session_run_method(self.session, name, args, kwargs)
+
+            return self.client.run_method(name, args, kwargs)
+
+    def enqueue_method(self, name, *args, **kwargs):
+        """
+        Asynchronous version of run_method
+
+        :param timeout: An optional keyword argument, the number of seconds after which Blender skips or stops the
+         task if it is not done. self.task_timeout by default.
+        :return: The id of the task, which can be used to cancel it, see: :any:`cancel_task`
+        """
+        # Only sent if set, so that addon methods that take no deadline can be called without one
+        timeout = kwargs.pop('timeout', self.task_timeout)
+        deadline_args = (timeout,) if timeout is not None else ()
+
+        with self.measure('transport'):
+            if self.session is not None:
+                return self.client.session_enqueue_method(self.session, name, args, kwargs, *deadline_args)
+
+            return self.client.enqueue_method(name, args, kwargs, *deadline_args)
+
+    def cancel_task(self, task_id):
+        """
+        Cancels a task enqueued with :any:`enqueue_method`. Queued tasks are skipped, and a running task stops at its
+        next cancellation check (e.g. between cells).
+
+        :param task_id: The id returned by :any:`enqueue_method`
+        :return: False if the task was already done, True otherwise
+        """
+        return self.client.cancel_task(task_id)
+
+    def cancel_send_tasks(self, handle):
+        """
+        Cancels the queued and running Blender tasks of a send, e.g. when a newer send replaces it. Other tasks,
+        e.g. those enqueued by the user, are not affected.
+
+        :param handle: The :any:`SendHandle` of the send
+        :return: The number of cancelled tasks
+        """
+        task_ids = [task_id for task_id in list(handle.task_ids) if task_id is not None]
+
+        if len(task_ids) == 0:
+            return 0
+
+        return self.client.cancel_tasks(task_ids)
+
+    def cancel_all(self):
+        """
+        Cancels all queued and running Blender tasks of this client's session (see :any:`open_session`), or of the
+        default session if the client has not opened one.
+
+        :return: The number of cancelled tasks
+        """
+        return self.client.cancel_all(self.session if self.session is not None else "")
+
+    def run_command(self, command_string):
+        """
+        Synchronously runs a Python command within Blender's Python instance. This allows controlling/using Blender from
+        NEURON/python.
+
+        :param command_string: A python command. To include a return value, set a special variable 'return_value'.
+        :return: None, but if return_value is set within the command, will return its value.
+        """
+        if self.session is not None:
+            return self.client.session_run_command(self.session, command_string)
+
+        return self.client.run_command(command_string)
+
+
+    def enqueue_command(self, command_string):
+        """
+        Asynchronous version of :any:`run_command`
+        """
+        if self.session is not None:
+            self.client.session_enqueue_command(self.session, command_string)
+
+        else:
+            self.client.enqueue_command(command_string)
+
+    def open_session(self, name=''):
+        """
+        Opens a session with the BlenderNEURON addon, so that several clients (e.g. NEURON instances of a parameter
+        sweep) can send models to the same Blender. The objects and materials a client creates are named with its
+        session id, e.g. 'S1:TestCell[0].soma', and clearing the scene only removes the client's own objects.
+        The addon runs the tasks of the sessions in turn.
+
+        :param name: An optional name of the session, shown in the addon's console
+        :return: The session id
+        """
+        self.session = self.client.open_session(name)
+
+        return self.session
+
+    def close_session(self):
+        """
+        Waits for the queued tasks of the client's session, removes its objects from Blender, and stops using the
+        session. See :any:`open_session`.
+
+        :return: None
+        """
+        if self.session is None:
+            return
+
+        self.client.close_session(self.session)
+        self.session = None
+
+    def enqueue_packed_method(self, name, *args):
+        """
+        Version of :any:`enqueue_method` where the last parameter is a payload packed with :any:`pack_payload`. The
+        payload is sent as XML-RPC binary data, which avoids the cost of marshalling large nested lists as XML.
+        """
+        if self.stage_metrics is not None:
+            self.stage_metrics.count('bytes_sent', len(args[-1]))
+
+        args = args[:-1] + (xmlrpclib.Binary(args[-1]),)
+        return self.enqueue_method(name, *args)
+
+    def measure(self, stage):
+        """
+        Times a client stage, if metrics are enabled (see :any:`enable_metrics`). Used as::
+
+            with self.measure('gather_morphology'):
+                ...
+
+        :param stage: The name of the stage
+        :return: A context manager
         """
+        if self.stage_metrics is None:
+            return null_timer
 
-        self.setup_defaults_if_needed()
+        return self.stage_metrics.measure(stage)
 
-    def run_method(self, name, *args, **kwargs):
+    def enable_metrics(self, enabled=True):
         """
-        Synchronously requests and blocks while a BlenderNEURON addon method is executed in Blender
+        Turns on (or off) the timing of client stages and Blender tasks. Metrics are off by default, and cost almost
+        nothing while off. See :any:`metrics`.
 
-        :param name: The name of the BlenderNEURON addon method to call
-        :param args: method parameters
-        :param kwargs: This should be blank, as named parameters are not supported over XMLRPC
-        :return: The value returned by the BlenderNEURON addon method
+        :param enabled: Whether to collect the metrics
         """
-        return self.client.run_method(name, args, kwargs)
+        if not enabled:
+            self.stage_metrics = None
 
-    def enqueue_method(self, name, *args, **kwargs):
+        elif self.stage_metrics is None:
+            self.stage_metrics = StageMetrics()
+
+        if self.is_blender_ready():
+            self.client.enable_metrics(enabled)
+
+    def reset_metrics(self):
         """
-        Asynchronous version of run_method
+        Clears the client and Blender metrics collected so far
         """
-        self.client.enqueue_method(name, args, kwargs)
+        if self.stage_metrics is not None:
+            self.stage_metrics = StageMetrics()
 
-    def run_command(self, command_string):
+        if self.is_blender_ready():
+            self.client.reset_metrics()
+
+    def metrics(self, show=True):
         """
-        Synchronously runs a Python command within Blender's Python instance. This allows controlling/using Blender from
-        NEURON/python.
+        Reports where time was spent since metrics were enabled (see :any:`enable_metrics`) or reset.
 
-        :param command_string: A python command. To include a return value, set a special variable 'return_value'.
-        :return: None, but if return_value is set within the command, will return its value.
+        Client stages include gathering model data from NEURON, collecting activity during simulation, packing and
+        sending (transport) data to Blender. Stages can be nested, e.g. 'transport' time is also part of
+        'send_morphology' and 'send'. Blender metrics are reported for each addon task type (e.g.
+        visualize_group): the time tasks waited in the queue and ran, and the numbers of objects, materials, and
+        keyframes they created, and payload bytes they received.
+
+        :param show: Whether to print the report
+        :return: A dictionary with 'client' and 'blender' metrics. Either is None if not enabled or, for Blender,
+         if Blender could not be reached.
         """
-        return self.client.run_command(command_string)
+        result = {
+            'client': self.stage_metrics.get_report() if self.stage_metrics is not None else None,
+            'blender': None,
+        }
 
+        if self.is_blender_ready():
+            blender = self.client.get_metrics()
 
-    def enqueue_command(self, command_string):
+            if blender['enabled']:
+                result['blender'] = blender
+
+        if show:
+            BlenderNEURON.print_metrics(result)
+
+        return result
+
+    @staticmethod
+    def print_metrics(metrics):
         """
-        Asynchronous version of :any:`run_command`
+        Prints a metrics dictionary returned by :any:`metrics` as a table
         """
-        self.client.enqueue_command(command_string)
+        client = metrics['client']
+        blender = metrics['blender']
+
+        if client is None:
+            print("Client metrics are not enabled")
+
+        else:
+            print("%-26s %8s %10s %10s" % ("Client stage", "Calls", "Total s", "Max s"))
+
+            for stage, s in sorted(client['stages'].items()):
+                print("%-26s %8d %10.3f %10.3f" % (stage, s['calls'], s['seconds'], s['max_seconds']))
+
+            for counter, value in sorted(client['counters'].items()):
+                print("%-26s %8d" % (counter, value))
+
+        print("")
+
+        if blender is None:
+            print("Blender metrics are not enabled or Blender is not reachable")
+            return
+
+        print("%-26s %6s %6s %9s %9s %9s %8s %9s %10s %10s" % (
+            "Blender task", "Count", "Errors", "Wait s", "Run s", "Max s", "Objects", "Materials", "Keyframes", "KB"
+        ))
+
+        for name, m in sorted(blender['tasks'].items()):
+            print("%-26s %6d %6d %9.3f %9.3f %9.3f %8d %9d %10d %10.1f" % (
+                name, m['count'], m['errors'], m['queue_wait'], m['run_time'], m['max_run_time'],
+                m['objects'], m['materials'], m['keyframes'], m['bytes'] / 1024.0
+            ))
+
+        print("%s requests, %.1f KB received, %s tasks queued" % (
+            blender['requests'], blender['bytes_received'] / 1024.0, blender['queue_length']
+        ))
+
+    def get_send_executor(self, pool_type=None):
+        """
+        Returns the pool of workers that pack and compress morphology and activity chunks. The pool type and size
+        are set with self.send_pool_type ('process' or 'thread') and self.send_workers (None for one per CPU core).
+        A pool is created on first use and reused by later sends with the same type and size. Pools are not shut
+        down when the type or size changes, as a send in progress may still be using them.
+
+        :param pool_type: The pool type to use instead of self.send_pool_type, e.g. 'thread'
+        :return: A :any:`SharedExecutor`, or a :any:`SerialExecutor` if only one worker is used
+        """
+        workers = self.send_workers or cpu_count()
+        pool_type = pool_type or self.send_pool_type
+
+        if futures is None or workers <= 1:
+            return SerialExecutor()
+
+        key = (pool_type, workers)
+
+        with self.send_executor_lock:
+            executor = self.send_executors.get(key)
+
+            if executor is None:
+                if pool_type == 'process':
+                    pool = futures.ProcessPoolExecutor(max_workers=workers)
+                else:
+                    pool = futures.ThreadPoolExecutor(max_workers=workers)
+
+                executor = self.send_executors[key] = SharedExecutor(pool, key)
+
+        return executor
 
     def send_model(self):
         """
@@ -498,12 +2104,28 @@ class BlenderNEURON(object):
 
     def send_morphology(self):
         """
-        Sends the cell morphology data of all defined self.groups to Blender
+        Sends the cell morphology data of all defined self.groups to Blender. Coordinates are gathered from NEURON
+        on the calling thread, while the packing and compression of cell chunks is done by the send pool.
         """
 
-        for group in self.groups.values():
-            self.gather_group_coords(group)
-            self.send_group(group)
+        with self.get_send_executor() as executor:
+            submitted = None
+
+            # Each group is gathered while the previous one is packed
+            for group in self.groups.values():
+                with self.measure('gather_morphology'):
+                    self.gather_group_coords(group)
+
+                if submitted is not None:
+                    self.finish_group_data(submitted)
+
+                submitted = self.submit_group_data(group['3d_data'], executor)
+
+                if self.free_sent_coords:
+                    group['3d_data']['cells'] = CellCoords()
+
+            if submitted is not None:
+                self.finish_group_data(submitted)
 
     def gather_group_coords(self, group):
         """
@@ -513,19 +2135,19 @@ class BlenderNEURON(object):
         :return: None
         """
 
-        cell_data = group['3d_data']['cells'] = {}
+        cell_data = group['3d_data']['cells'] = CellCoords()
         spherize = group["spherize_soma_if_DeqL"]
 
+        # Section class name -> id, used by Blender to color sections by class, see: get_section_class
+        classes = {}
+
         for root in group["cells"]:
             cell_name = root.cell().hname() if root.cell() is not None else root.name()
-            cell_coords = self.get_cell_coords(root, spherize_if_DeqL=spherize)
 
-            # Account for a cell having multiple roots
-            if cell_name in cell_data:
-                cell_data[cell_name].extend(cell_coords)
-            else:
-                cell_data[cell_name] = cell_coords
+            # A cell with multiple roots gets the sections of each
+            cell_data.add(cell_name, self.get_cell_coords(root, spherize_if_DeqL=spherize, classes=classes))
 
+        group['3d_data']['section_classes'] = sorted(classes, key=classes.get)
 
     def get_coord_count(self, section):
         """
@@ -560,276 +2182,817 @@ class BlenderNEURON(object):
 
         result = name
 
+        # Blender names of a session's objects start with the session id and a ':', see: open_session
+        if self.session is not None:
+            max_length -= len(self.session) + 1
+
         # 63 max, with two for []s and 5 for segment id = 56
         if len(result) > max_length:
             return result[:max_length-17] + "#" + hashlib.md5(result.encode('utf-8')).hexdigest()[:16]
 
-        return result
+        return result
+
+    @staticmethod
+    def get_section_class(name):
+        """
+        Gets the class of a section from its name, by removing the cell and section indices. Sections of the same class
+        get the same color in Blender when sent with color_unique_names, see: :any:`to_blender`
+
+        :param name: The name of a NEURON section e.g. 'TestCell[0].dend[12]'
+        :return: The section class name e.g. 'TestCell.dend'
+        """
+        return ".".join(part.split("[")[0] for part in name.split("."))
+
+    def get_cell_coords(self, section, result=None, spherize_if_DeqL=True, classes=None):
+        """
+        Recursively gathers the list of coordinates of a cell (root section)
+
+        :param section: A reference to NEURON root section
+        :param result: None, used internally
+        :param spherize_if_DeqL: Whether to create a sphere instead of a cylinder for sections with "soma" in their names
+         and which have equal lengths and diameters (within 0.1 um)
+        :param classes: An optional dictionary of section class names and their ids. If given, each section gets the
+         id of its class (added to the dictionary if new). See: :any:`get_section_class`
+        :return: A list of dictionaries with section names, coordinates, and coordinate radii. Coords has the form
+         of [x1,y1,z1,x2,y2,z2...], and radii [r1,r2,...]
+        """
+
+        # Determine how many 3d points the section has
+        coord_count = self.get_coord_count(section)
+
+        # Collect the coordinates
+        coords = [None]*coord_count*3
+        radii =  [None]*coord_count
+
+        for c in range(coord_count):
+            ci = c*3
+            coords[ci] = self.h.x3d(c, sec=section)
+            coords[ci+1] = self.h.y3d(c, sec=section)
+            coords[ci+2] = self.h.z3d(c, sec=section)
+
+            radii[c] = self.h.diam3d(c, sec=section) / 2.0
+
+
+        if result is None:
+            result = []
+
+        sec_coords = {
+            "name": self.shorten_name_if_needed(section.name()),
+            "coords": coords,
+            "radii": radii,
+        }
+
+        if classes is not None:
+            sec_coords["class"] = classes.setdefault(self.get_section_class(section.name()), len(classes))
+
+        # Create spherical intermediate points if spherizing
+        if spherize_if_DeqL and \
+            "soma" in section.name().lower() and \
+                 abs(section.diam - section.L) < 0.1:
+                    self.spherize_coords(sec_coords, length=section.L)
+
+        result.append(sec_coords)
+
+        children = section.children()
+
+        for child in children:
+            self.get_cell_coords(child, result, spherize_if_DeqL, classes)
+
+        return result
+
+    def spherize_coords(self, sec_coords, length, steps=7):
+        """
+        Turns a cylindrical section 3D points into a 3D points of a sphere spanning the section length. This method assumes the
+        section length and diameter are equal.
+
+        :param sec_coords: A dictionary of section 3d coordinates. Same format as elements of array returned by
+         :any:`get_cell_coords()`
+        :param length: The length of the section
+        :param steps: The number of intermediate subdivisions to use to approximate the sphere. More steps uses more
+         polygons but results in more smooth sphere.
+        :return:
+        """
+
+        # Remove intermediate, co-linear points
+        if len(sec_coords["radii"]) > 2:
+            sec_coords["radii"] = [sec_coords["radii"][0], sec_coords["radii"][-1]]
+            sec_coords["coords"] = sec_coords["coords"][0:3] + sec_coords["coords"][-3:]
+
+        x1 = sec_coords["coords"][0]
+        y1 = sec_coords["coords"][1]
+        z1 = sec_coords["coords"][2]
+
+        x2 = sec_coords["coords"][-3]
+        y2 = sec_coords["coords"][-2]
+        z2 = sec_coords["coords"][-1]
+
+        range_x = x2 - x1
+        range_y = y2 - y1
+        range_z = z2 - z1
+
+        radius = sec_coords["radii"][0]
+
+        # Length and diameter are same, so spherize the cylinder
+        # by adding intermediate, spherical diameter points
+        step_size = length / (steps + 1.0)
+
+        for step in range(steps):
+            dist_from_start = step_size + step*step_size
+            dist_to_center = abs(radius-dist_from_start)
+            step_radius = sqrt(radius**2-dist_to_center**2)
+
+            fraction_along = dist_from_start / length
+            step_x = x1 + range_x * fraction_along
+            step_y = y1 + range_y * fraction_along
+            step_z = z1 + range_z * fraction_along
+
+            pt_idx = step+1
+            sec_coords["coords"][pt_idx*3:pt_idx*3] = [step_x, step_y, step_z]
+            sec_coords["radii"].insert(pt_idx, step_radius)
+
+        # Set the first and last points to 0 diam
+        sec_coords["radii"][0] = 0
+        sec_coords["radii"][-1] = 0
+
+        sec_coords["spherical"] = True
+
+    def send_group(self, group, executor=None, handle=None):
+        """
+        Sends the 3d morphology data of a group to Blender. See :any:`send_group_data`.
+
+        :param group: Reference to the group's dictionary
+        :param executor: The executor to use for packing, see :any:`get_send_executor`. Serial if None.
+        :param handle: An optional :any:`SendHandle` to report progress to
+        """
+        self.send_group_data(group['3d_data'], executor, handle)
+
+        if self.free_sent_coords:
+            group['3d_data']['cells'] = CellCoords()
+
+    def send_group_data(self, data, executor=None, handle=None):
+        """
+        Sends the gathered 3d data of a group to Blender. The cells are split into chunks of about
+        self.send_chunk_size sections, which are packed by the executor and sent as they finish. The group is
+        built in Blender once all its chunks have been received.
+
+        :param data: The group's '3d_data' dictionary
+        :param executor: The executor to use for packing, see :any:`get_send_executor`. Serial if None.
+        :param handle: An optional :any:`SendHandle` to report progress to
+        """
+        self.finish_group_data(self.submit_group_data(data, executor), handle)
+
+    def submit_group_data(self, data, executor=None):
+        """
+        Splits the cells of a group into chunks and submits them to be packed by the executor. The packing runs
+        while the caller continues (e.g. gathers the next group), until :any:`finish_group_data` sends the chunks.
+
+        :param data: The group's '3d_data' dictionary
+        :param executor: The executor to use for packing, see :any:`get_send_executor`. Serial if None.
+        :return: The submitted group, for :any:`finish_group_data`
+        """
+        if executor is None:
+            executor = SerialExecutor()
+
+        with self.measure('send_morphology'):
+            chunks = self.get_cell_chunks(data['cells'])
+            calls = [executor.submit(pack_payload, chunk) for chunk in chunks]
+
+            # Cells are sent separately
+            header = dict(data)
+            header['cells'] = None
+
+            return header, calls, [len(chunk) for chunk in chunks]
+
+    def finish_group_data(self, submitted, handle=None):
+        """
+        Sends the chunks of a group submitted with :any:`submit_group_data` as they finish packing, and then has
+        Blender build the group
+
+        :param submitted: The value returned by :any:`submit_group_data`
+        :param handle: An optional :any:`SendHandle` to report progress to
+        """
+        if handle is None:
+            handle = SendHandle()
+
+        header, calls, chunk_cell_counts = submitted
+        chunk_cell_counts = dict(zip(calls, chunk_cell_counts))
+
+        with self.measure('send_morphology'):
+            for call in as_completed(calls):
+                packed = call.result()
+                task_id = self.enqueue_packed_method("add_group_cells", header['name'], packed)
+                handle.track(cells=chunk_cell_counts[call], byte_count=len(packed), task_ids=[task_id])
+
+            handle.track(task_ids=[self.enqueue_method("visualize_group", header)])
+
+    def get_cell_chunks(self, cells):
+        """
+        Splits a dictionary of cell coordinates into smaller dictionaries with about self.send_chunk_size sections each
+
+        :param cells: A dictionary of cell names and their section coordinates. See :any:`gather_group_coords`
+        :return: A list of dictionaries
+        """
+        chunks = []
+        chunk = {}
+        section_count = 0
+
+        for cell_name, sections in cells.items():
+            chunk[cell_name] = sections
+            section_count += len(sections)
+
+            if section_count >= self.send_chunk_size:
+                chunks.append(chunk)
+                chunk = {}
+                section_count = 0
+
+        if len(chunk) > 0:
+            chunks.append(chunk)
+
+        return chunks
+
+
+    def collect_group(self, group_name):
+        """
+        Based on the group's color level, gathers the values of the group's collect_variable. This method is called
+        at regular times during the simulation. See :any:`create_cell_group()` for details.
+
+        :param group_name: The name of the group whose section values to measure and store
+
+        :return: None
+        """
+
+        with self.measure('collect'):
+            group = self.groups[group_name]
+            plan = group.get('collection_plan')
+
+            if plan is None or \
+                    plan['key'] != (group['3d_data']["color_level"], group["collect_variable"], self.model_structure):
+                plan = self.build_collection_plan(group)
+
+            if plan['pointers'] is not None:
+                plan['pointers'].gather(plan['values'])
+                values = plan['values'].to_python()
+
+            else:
+                variable = group["collect_variable"]
+                values = [getattr(seg, variable) for seg in plan['segments']]
+
+            if plan['mean']:
+                values = [sum(values) / len(values)]
+
+            collection_time = self.h.t
+
+            if group['collection_period_ms'] == 'auto':
+                # Fixed step simulations run the collector up to dt away from the frame times
+                collection_time = round(collection_time * group['frames_per_ms']) / group['frames_per_ms']
+
+                if group['frame_samples'] > 1:
+                    collection_time, values = self.add_frame_sample(group, collection_time, values)
+
+                    # The simulation ends before the last frame has all of its samples
+                    if values is None and self.h.t + self.get_collection_period(group) > self.h.tstop:
+                        collection_time, values = self.combine_frame_window(group)
+
+            # Frames with several samples have a value once all of them are collected
+            if values is not None:
+                self.store_collection(group, plan, collection_time, values)
+
+        if self.live_stream is not None:
+            # Send at the end of each window, and with the last collection before tstop
+            if self.h.t >= group.get('live_window_end', 0) or \
+                    self.h.t + self.get_collection_period(group) > self.h.tstop:
+                self.flush_live_window(group)
+
+    def store_collection(self, group, plan, collection_time, values):
+        """
+        Adds the values of a collection to the activity of a group
+
+        :param group: The group dictionary
+        :param plan: The collection plan of the group, see :any:`build_collection_plan`
+        :param collection_time: The time of the values
+        :param values: The values of the group parts
+        """
+        group["collection_times"].append(collection_time)
+
+        if group['sparse_threshold'] is not None:
+            events = group['activity_events']
+
+            if events is None or events.names is not plan['names']:
+                events = group['activity_events'] = ActivityEvents(plan['names'], group['sparse_threshold'])
+
+            events.threshold = group['sparse_threshold']
+            events.keyframe_ms = group['sparse_keyframe_ms']
+            events.add(collection_time, values)
+
+        else:
+            if plan['activity'] is not group["collected_activity"]:
+                self.bind_collection_plan(plan, group["collected_activity"])
+
+            for part_values, value in zip(plan['lists'], values):
+                part_values.append(value)
+
+    def add_frame_sample(self, group, frame_time, values):
+        """
+        Adds the values of a collection to the samples of the current frame (see the 'frame_samples' option of
+        :any:`create_cell_group`). Once the frame has all of its samples, they are combined with the group's
+        frame_aggregation into one value for each part.
+
+        :param group: The group dictionary
+        :param frame_time: The time of the frame nearest to the collection
+        :param values: The collected values of the group parts
+        :return: (frame time, combined values) when the frame is complete, otherwise (None, None)
+        """
+        window = group.get('frame_window')
+
+        # The first sample of a frame is at the frame time
+        if window is None:
+            window = group['frame_window'] = {'time': frame_time, 'samples': []}
+
+        window['samples'].append(values)
+
+        if len(window['samples']) < group['frame_samples']:
+            return None, None
+
+        return self.combine_frame_window(group)
+
+    def combine_frame_window(self, group):
+        """
+        Combines the samples of the current frame of a group with its frame_aggregation, and starts a new frame
+
+        :param group: The group dictionary
+        :return: (frame time, combined values)
+        """
+        window = group['frame_window']
+        group['frame_window'] = None
+
+        aggregation = group['frame_aggregation']
+
+        if aggregation == 'min':
+            combine = min
+        elif aggregation == 'max':
+            combine = max
+        else:
+            combine = lambda samples: sum(samples) / len(samples)
+
+        return window['time'], [combine(samples) for samples in zip(*window['samples'])]
 
-    def get_cell_coords(self, section, result=None, spherize_if_DeqL=True):
+    def flush_frame_windows(self):
         """
-        Recursively gathers the list of coordinates of a cell (root section)
+        Stores the frames that have only some of their samples, e.g. when the simulation was stopped before tstop
 
-        :param section: A reference to NEURON root section
-        :param result: None, used internally
-        :param spherize_if_DeqL: Whether to create a sphere instead of a cylinder for sections with "soma" in their names
-         and which have equal lengths and diameters (within 0.1 um)
-        :return: A list of dictionaries with section names, coordinates, and coordinate radii. Coords has the form
-         of [x1,y1,z1,x2,y2,z2...], and radii [r1,r2,...]
+        :return: None
         """
+        for group in self.groups.values():
+            if group.get('frame_window') is not None:
+                collection_time, values = self.combine_frame_window(group)
+                self.store_collection(group, group['collection_plan'], collection_time, values)
 
-        # Determine how many 3d points the section has
-        coord_count = self.get_coord_count(section)
+    def start_live_stream(self, window_ms=10, max_pending_windows=4, when_behind='block', max_blender_tasks=20):
+        """
+        Sends the model to Blender and starts streaming group activity while the simulation is running. After every
+        window_ms of simulation time, the activity collected during the window is sent to Blender and removed from
+        memory. Call this method after :any:`prepare_for_collection` and before running the simulation.
 
-        # Collect the coordinates
-        coords = [None]*coord_count*3
-        radii =  [None]*coord_count
+        If Blender falls behind, windows wait in a queue of up to max_pending_windows. When the queue is full, the
+        simulation is paused until there is space (when_behind='block'), or the new window is discarded
+        (when_behind='drop'). Windows are not sent while Blender has more than max_blender_tasks queued.
 
-        for c in range(coord_count):
-            ci = c*3
-            coords[ci] = self.h.x3d(c, sec=section)
-            coords[ci+1] = self.h.y3d(c, sec=section)
-            coords[ci+2] = self.h.z3d(c, sec=section)
+        If sending fails (e.g. the connection to Blender is lost), the error is raised by the next window flush
+        during the simulation, and by :any:`stop_live_stream`.
 
-            radii[c] = self.h.diam3d(c, sec=section) / 2.0
+        :param window_ms: Simulation time (ms) of each window
+        :param max_pending_windows: The maximum number of windows waiting to be sent
+        :param when_behind: 'block' to slow down the simulation, or 'drop' to skip windows, when Blender falls behind
+        :param max_blender_tasks: The Blender task queue length above which sending is paused
+        :return: None
+        :raise: Exception if a group records spikes, whose activity is not collected in windows
+        """
+        spike_groups = [name for name, group in self.groups.items()
+                        if group['collect_activity'] and group['record_spikes']]
 
+        if len(spike_groups) > 0:
+            raise Exception("Groups that record spikes can't be live streamed: " + ", ".join(spike_groups) +
+                            ". Send their spikes after the simulation, with to_blender.")
 
-        if result is None:
-            result = []
+        self.stop_live_stream()
+        self.wait_till_blender_is_ready()
 
-        sec_coords = {
-            "name": self.shorten_name_if_needed(section.name()),
-            "coords": coords,
-            "radii": radii,
+        # Send the morphology, activity will follow during simulation
+        snapshot = self.gather_snapshot()
+        snapshot['activity'] = []
+        self.send_snapshot(snapshot)
+
+        stream = {
+            'window_ms': window_ms,
+            'when_behind': when_behind,
+            'max_blender_tasks': max_blender_tasks,
+            'queue': queue.Queue(maxsize=max_pending_windows),
+            'dropped_windows': 0,
+            'error': None,
         }
 
-        # Create spherical intermediate points if spherizing
-        if spherize_if_DeqL and \
-            "soma" in section.name().lower() and \
-                 abs(section.diam - section.L) < 0.1:
-                    self.spherize_coords(sec_coords, length=section.L)
-
-        result.append(sec_coords)
-
-        children = section.children()
-
-        for child in children:
-            self.get_cell_coords(child, result, spherize_if_DeqL)
+        stream['sender'] = threading.Thread(target=self.send_live_windows, args=(stream,))
+        stream['sender'].daemon = True
+        stream['sender'].start()
 
-        return result
+        self.live_stream = stream
+        self.clear_activity()
 
-    def spherize_coords(self, sec_coords, length, steps=7):
+    def stop_live_stream(self):
         """
-        Turns a cylindrical section 3D points into a 3D points of a sphere spanning the section length. This method assumes the
-        section length and diameter are equal.
+        Sends any remaining activity, waits for all queued windows to be sent, and stops live streaming
 
-        :param sec_coords: A dictionary of section 3d coordinates. Same format as elements of array returned by
-         :any:`get_cell_coords()`
-        :param length: The length of the section
-        :param steps: The number of intermediate subdivisions to use to approximate the sphere. More steps uses more
-         polygons but results in more smooth sphere.
-        :return:
+        :return: The number of windows that were dropped because Blender was behind
         """
+        stream = self.live_stream
 
-        # Remove intermediate, co-linear points
-        if len(sec_coords["radii"]) > 2:
-            sec_coords["radii"] = [sec_coords["radii"][0], sec_coords["radii"][-1]]
-            sec_coords["coords"] = sec_coords["coords"][0:3] + sec_coords["coords"][-3:]
+        if stream is None:
+            return 0
 
-        x1 = sec_coords["coords"][0]
-        y1 = sec_coords["coords"][1]
-        z1 = sec_coords["coords"][2]
+        try:
+            self.flush_frame_windows()
 
-        x2 = sec_coords["coords"][-3]
-        y2 = sec_coords["coords"][-2]
-        z2 = sec_coords["coords"][-1]
+            for group in self.groups.values():
+                if len(group['collection_times']) > 0:
+                    self.flush_live_window(group)
 
-        range_x = x2 - x1
-        range_y = y2 - y1
-        range_z = z2 - z1
+            self.put_live_window(stream, None)
+            stream['sender'].join()
 
-        radius = sec_coords["radii"][0]
+        finally:
+            self.live_stream = None
 
-        # Length and diameter are same, so spherize the cylinder
-        # by adding intermediate, spherical diameter points
-        step_size = length / (steps + 1.0)
+        self.raise_live_stream_error(stream)
 
-        for step in range(steps):
-            dist_from_start = step_size + step*step_size
-            dist_to_center = abs(radius-dist_from_start)
-            step_radius = sqrt(radius**2-dist_to_center**2)
+        return stream['dropped_windows']
 
-            fraction_along = dist_from_start / length
-            step_x = x1 + range_x * fraction_along
-            step_y = y1 + range_y * fraction_along
-            step_z = z1 + range_z * fraction_along
+    def put_live_window(self, stream, window):
+        """
+        Queues a window for the live stream sender thread, waiting while the queue is full
 
-            pt_idx = step+1
-            sec_coords["coords"][pt_idx*3:pt_idx*3] = [step_x, step_y, step_z]
-            sec_coords["radii"].insert(pt_idx, step_radius)
+        :param stream: The live stream dictionary, see :any:`start_live_stream`
+        :param window: The window tuple, 'clear', or None to stop the sender
+        :raise: The error of the sender, if it stopped because sending failed
+        """
+        while True:
+            self.raise_live_stream_error(stream)
 
-        # Set the first and last points to 0 diam
-        sec_coords["radii"][0] = 0
-        sec_coords["radii"][-1] = 0
+            if not stream['sender'].is_alive():
+                raise Exception("The live stream sender has stopped")
 
-        sec_coords["spherical"] = True
+            try:
+                stream['queue'].put(window, timeout=0.5)
+                return
 
-    def send_group(self, group):
+            except queue.Full:
+                pass
+
+    def raise_live_stream_error(self, stream):
+        """
+        Re-raises the error that stopped the live stream sender thread, if any
         """
-        Sends the 3d morphology data of a group to Blender
+        if stream['error'] is not None:
+            raise stream['error']
 
-        :param group: Reference to the group's dictionary
+    def flush_live_window(self, group):
         """
-        data = group['3d_data']
+        Queues the activity that a group collected during the current live stream window, and frees the group's
+        activity buffers
 
-        self.enqueue_method("visualize_group", data)
+        :param group: The group dictionary
+        """
+        stream = self.live_stream
+        window = (
+            group['collection_times'],
+            self.get_collected_parts(group),
+            group['frames_per_ms']
+        )
 
+        group['collection_times'] = []
+        group['collected_activity'] = {}
+        group['activity_events'] = None
+        group['live_window_end'] = self.h.t + stream['window_ms']
 
-    def collect_group(self, group_name):
-        """
-        Based on the group's color level, gathers the values of the group's collect_variable. This method is called
-        at regular times during the simulation. See :any:`create_cell_group()` for details.
+        if stream['when_behind'] == 'drop':
+            self.raise_live_stream_error(stream)
 
-        :param group_name: The name of the group whose section values to measure and store
+            try:
+                stream['queue'].put_nowait(window)
+            except queue.Full:
+                stream['dropped_windows'] += 1
 
-        :return: None
+        else:
+            # Time the simulation is paused, waiting for Blender
+            with self.measure('live_window_wait'):
+                self.put_live_window(stream, window)
+
+    def send_live_windows(self, stream):
         """
+        Sends queued live stream windows to Blender. Runs in the live stream sender thread until a None window is
+        queued.
 
-        group = self.groups[group_name]
-        group["collection_times"].append(self.h.t)
-        level = group['3d_data']["color_level"]
+        :param stream: The live stream dictionary, see :any:`start_live_stream`
+        """
+        try:
+            self.send_queued_live_windows(stream)
 
-        #level = "Cell"
+        except Exception as e:
+            # Raised on the simulation thread by the next flush, see: raise_live_stream_error
+            stream['error'] = e
 
-        # Recursively record from every segment of each section of each cell
-        if level == 'Segment':
-            for root in group["cells"]:
-                self.collect_segments_recursive(root, group)
+    def send_queued_live_windows(self, stream):
+        while True:
+            window = stream['queue'].get()
 
-        # Recursively record from the middle of each section of each cell
-        elif level == 'Section':
-            for root in group["cells"]:
-                self.collect_section(root, group, recursive = True)
+            if window is None:
+                break
 
-        # Record from the middle of somas of each cell
-        elif level == 'Cell':
-            for root in group["cells"]:
-                self.collect_section(root, group, recursive = False)
+            # Blender starts a new simulation
+            if window == 'clear':
+                self.enqueue_method("clear_segment_activities")
+                continue
 
-        # Record from the somas of each cell and compute their mean
-        else:
-            variable = group["collect_variable"]
+            times, parts, frames_per_ms = window
 
-            # Compute the mean of group cell somas
-            value = 0.0
-            for soma in group["cells"]:
-                value += getattr(soma(0.5), variable)
-            value = value / len(group["cells"])
+            if len(times) == 0:
+                continue
 
-            activity = group["collected_activity"]
-            name = group_name + "Group"
+            # Wait while Blender is busy
+            while self.client.get_queue_length() > stream['max_blender_tasks']:
+                sleep(0.1)
 
-            if name not in activity:
-                activity[name] = []
+            for start in range(0, len(parts), self.send_chunk_size):
+                with self.measure('pack_activity'):
+                    packed = prepare_activity_chunk(
+                        parts[start:start + self.send_chunk_size],
+                        times,
+                        frames_per_ms,
+                        self.activity_simplification_tolerance
+                    )
 
-            activity[name].append(value)
+                self.enqueue_packed_method("append_segment_activities", packed)
 
-    def collect_segments_recursive(self, section, group):
+    def add_segments_to_plan(self, section, plan):
         """
-        Recursively collects the values of segments of a group cell (root section). Segments are given sequential 0-based
-        names similar to NEURON cells and sections. For example, TestCell[0].dend[3][4] refers to first TestCell, 4th
-        dendrite, 5th segment. Segment order is determined by the order in which they appear in NEURON's xyz3d() function.
+        Recursively adds the segments of a group cell (root section) to a collection plan. Segments are given sequential
+        0-based names similar to NEURON cells and sections. For example, TestCell[0].dend[3][4] refers to first TestCell,
+        4th dendrite, 5th segment. Segment order is determined by the order in which they appear in NEURON's xyz3d()
+        function.
 
         :param section: A reference to a group root section
-        :param group: reference to a group dictionary
+        :param plan: The plan dictionary, see :any:`build_collection_plan`
         :return: None
         """
 
         coordCount = self.get_coord_count(section)
-
-        activity = group["collected_activity"]
-        variable = group["collect_variable"]
+        section_name = self.shorten_name_if_needed(section.name())
 
         for i in range(1, coordCount):
-            name = self.shorten_name_if_needed(section.name()) + "[" + str(i - 1) + "]"
-
             startL = self.h.arc3d(i - 1, sec=section)
             endL = self.h.arc3d(i, sec=section)
             vectorPos = (endL + startL) / 2.0 / section.L
 
-            value = getattr(section(vectorPos), variable)
-
-            if name not in activity:
-                activity[name] = []
-
-            activity[name].append(value)
+            plan['names'].append(section_name + "[" + str(i - 1) + "]")
+            plan['segments'].append(section(vectorPos))
 
         for child in section.children():
-            self.collect_segments_recursive(child, group)
+            self.add_segments_to_plan(child, plan)
 
-    def collect_section(self, section, group, recursive = True):
+    def add_sections_to_plan(self, section, plan, recursive = True):
         """
-        Recursively collects the section midpoint values of a group's collect_variable (e.g. 'v')
+        Recursively adds the section midpoints of a group cell to a collection plan
 
         :param section: A root section of a group
-        :param group: The group's dictionary
-        :param recursive: Whether to collect child section values (otherwise stop at root/soma)
+        :param plan: The plan dictionary, see :any:`build_collection_plan`
+        :param recursive: Whether to add child sections (otherwise stop at root/soma, which is named after the cell)
         :return: None
         """
 
-        activity = group["collected_activity"]
-        variable = group["collect_variable"]
-
         if recursive:
             name = self.shorten_name_if_needed(section.name())
         else:
             name = str(section.cell())
 
-        value = getattr(section(0.5), variable)
-
-        if name not in activity:
-            activity[name] = []
-
-        activity[name].append(value)
+        plan['names'].append(name)
+        plan['segments'].append(section(0.5))
 
         if recursive:
             for child in section.children():
-                self.collect_section(child, group, recursive)
+                self.add_sections_to_plan(child, plan, recursive)
 
     def send_activity(self):
         """
         Sends the collected group section/segment activity to Blender. The recorded activity values are compressed
-        to remove co-linear points and are sent in batches to maximize performance.
+        to remove co-linear points and are sent in batches to maximize performance. Simplification and packing of
+        the batches is done in parallel by the send pool, and each batch is sent as soon as it is ready.
 
         :return:
         """
 
+        with self.measure('gather_activity'):
+            activity = self.get_activity_snapshot()
+            spikes = self.get_spike_snapshot()
+
+        with self.get_send_executor() as executor:
+            self.send_activity_snapshot(activity, executor, spikes=spikes)
+
+    def get_spike_snapshot(self):
+        """
+        Copies the spike times recorded by groups with 'record_spikes', see :any:`create_spike_recorders`
+
+        :return: A list of ([cell names], [spike times of each cell], frames per ms, pulse ms) tuples
+        """
+        result = []
+
+        for group in self.groups.values():
+            recorders = group.get('spike_recorders')
+
+            if not recorders:
+                continue
+
+            names = [cell_name for cell_name, spike_con, spike_times in recorders]
+            times = [spike_times.to_python() for cell_name, spike_con, spike_times in recorders]
+
+            result.append((names, times, group['frames_per_ms'], group['spike_pulse_ms']))
+
+        return result
+
+    def get_activity_snapshot(self):
+        """
+        Copies the activity collected by each group, so that it can be sent while another simulation is running
+
+        :return: A list of (collection times, [(part name, activity values), ...], frames per ms) tuples. Parts of
+            sparse groups have their own times, see :any:`get_collected_parts`.
+        """
+        result = []
+
         for group in self.groups.values():
             if "collected_activity" not in group:
-                return
+                continue
+
+            parts = [(part[0], list(part[1])) + part[2:] for part in self.get_collected_parts(group)]
+
+            result.append((list(group["collection_times"]), parts, group["frames_per_ms"]))
+
+        return result
+
+    def get_collected_parts(self, group):
+        """
+        :param group: The group dictionary
+        :return: A list of (part name, activity values) tuples of the activity collected by the group. If the group
+            records sparse activity (see 'sparse_threshold' of :any:`create_cell_group`), the tuples are
+            (part name, activity values, times), as each part is recorded at different times.
+        """
+        events = group.get('activity_events')
+
+        if events is not None:
+            return events.get_parts()
+
+        return list(group['collected_activity'].items())
+
+    def send_activity_snapshot(self, activity, executor=None, handle=None, spikes=()):
+        """
+        Simplifies, packs, and sends a copy of collected activity in chunks of self.send_chunk_size parts
+
+        :param activity: The activity copy returned by :any:`get_activity_snapshot`
+        :param executor: The executor to use for packing, see :any:`get_send_executor`. Serial if None.
+        :param handle: An optional :any:`SendHandle` to report progress to
+        :param spikes: The spike times copy returned by :any:`get_spike_snapshot`, sent in chunks of cells
+        """
+        if executor is None:
+            executor = SerialExecutor()
+
+        if handle is None:
+            handle = SendHandle()
+
+        # Textures and baked colors are built once all the activity is in Blender
+        if self.activity_backend in ['texture', 'baked']:
+            method = "buffer_segment_activities"
+            spike_method = "buffer_spike_activities"
+        else:
+            method = "set_segment_activities"
+            spike_method = "set_spike_activities"
+
+        with self.measure('send_activity'):
+            calls = []
+
+            for times, parts, frames_per_ms in activity:
+                for start in range(0, len(parts), self.send_chunk_size):
+                    calls.append(executor.submit(
+                        prepare_activity_chunk,
+                        parts[start:start+self.send_chunk_size],
+                        times,
+                        frames_per_ms,
+                        self.activity_simplification_tolerance
+                    ))
+
+            spike_calls = []
+
+            for names, spike_times, frames_per_ms, pulse_ms in spikes:
+                for start in range(0, len(names), self.send_chunk_size):
+                    spike_calls.append(executor.submit(
+                        prepare_spike_chunk,
+                        names[start:start+self.send_chunk_size],
+                        spike_times[start:start+self.send_chunk_size],
+                        frames_per_ms,
+                        pulse_ms
+                    ))
+
+            for call in as_completed(calls):
+                packed = call.result()
+                handle.track(byte_count=len(packed), task_ids=[self.enqueue_packed_method(method, packed)])
+
+            for call in as_completed(spike_calls):
+                packed = call.result()
+                handle.track(byte_count=len(packed), task_ids=[self.enqueue_packed_method(spike_method, packed)])
+
+            calls.extend(spike_calls)
+
+            if self.activity_backend == 'texture' and len(calls) > 0:
+                handle.track(task_ids=[self.enqueue_method("apply_activity_texture")])
+
+            if self.activity_backend == 'baked' and len(calls) > 0:
+                handle.track(task_ids=[
+                    self.enqueue_method("bake_activity_colors", self.baked_block_frames, self.baked_cached_blocks)
+                ])
+
+    def save_activity_archive(self, path, chunk_frames=1000, block_bytes=64 * 1024 * 1024):
+        """
+        Writes the collected activity of all groups to an on-disk archive. The BlenderNEURON addon plays the archive
+        back by loading only the chunks around the current frame, so long recordings do not need to fit into Blender
+        as keyframes. The archive directory must be readable by Blender (e.g. same machine or a shared drive).
+
+        The archive directory contains an 'index.json' file with the part (cell/section/segment) names of each group,
+        and for each group, a sequence of .npy files. Each file is a chunk_frames x part count float32 array of
+        activity values resampled to whole Blender frames, which can be memory-mapped.
+
+        Requires numpy.
+
+        :param path: The archive directory. It is created if it does not exist.
+        :param chunk_frames: The number of frames in each chunk file
+        :param block_bytes: The memory used to resample the activity of a block of parts before it is written
+        :return: None
+        """
+        import numpy as np
+        from numpy.lib.format import open_memmap
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        index = {'groups': []}
 
+        for group_name, group in self.groups.items():
+            if len(group.get("collection_times", [])) == 0:
+                continue
+
+            times = np.array(group["collection_times"])
+            activity = self.get_collected_parts(group)
+            parts = [part[0] for part in activity]
             frames_per_ms = group["frames_per_ms"]
-            part_activities = group["collected_activity"]
-            parts = part_activities.keys()
-            times = group["collection_times"]
+            frame_count = int(times[-1] * frames_per_ms) + 1
+            frame_times = np.arange(frame_count) / float(frames_per_ms)
+
+            chunk_files = []
+            chunks = []
+
+            for start in range(0, frame_count, chunk_frames):
+                file_name = "%s.%04d.npy" % (group_name, len(chunk_files))
+                chunk_len = min(chunk_frames, frame_count - start)
 
-            payload = []
+                chunk_files.append(file_name)
+                chunks.append(open_memmap(os.path.join(path, file_name), mode='w+',
+                                          dtype=np.float32, shape=(chunk_len, len(parts))))
 
-            for part in parts:
-                # Remove extra co-linear points
-                reduced_times, reduced_values = self.simplify_activity(times, part_activities[part])
+            # Parts are resampled a block at a time, and each row of a block is written to the chunks as one
+            # contiguous run. Writing a part at a time would touch every page of every chunk for each part.
+            block_size = max(1, int(block_bytes // (frame_count * 4)))
 
-                # Scale the times
-                reduced_times = [t*frames_per_ms for t in reduced_times]
+            for block_start in range(0, len(activity), block_size):
+                block_parts = activity[block_start:block_start + block_size]
+                block = np.empty((frame_count, len(block_parts)), dtype=np.float32)
 
-                payload.append({'name':part, 'times':reduced_times, 'activity':reduced_values})
+                for b, part in enumerate(block_parts):
+                    block[:, b] = np.interp(frame_times, part[2] if len(part) > 2 else times, part[1])
 
-                # Buffered send
-                if len(payload) > 1000:
-                    self.enqueue_method("set_segment_activities", payload)
-                    payload = []
+                for c, chunk in enumerate(chunks):
+                    start = c * chunk_frames
+                    chunk[:, block_start:block_start + len(block_parts)] = block[start:start + chunk.shape[0]]
 
-            self.enqueue_method("set_segment_activities", payload)
+            for chunk in chunks:
+                chunk.flush()
+
+            del chunks
+
+            index['groups'].append({
+                'name': group_name,
+                'parts': parts,
+                'frame_count': frame_count,
+                'chunk_frames': chunk_frames,
+                'chunks': chunk_files,
+            })
+
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump(index, f)
 
     # TODO: this could benefit from cython
     def simplify_activity(self, times, activity):
@@ -851,9 +3014,21 @@ class BlenderNEURON(object):
 
         :return: None
         """
+        # Collection plans are rebuilt on the next collection if the model structure changed
+        self.model_structure = self.get_model_structure()
+
         for group in self.groups.values():
             group['collection_times'] = []
             group['collected_activity'] = {}
+            group['activity_events'] = None
+            group['frame_window'] = None
+
+        # Activity from any previous live streamed simulation is removed in Blender
+        if self.live_stream is not None:
+            for group in self.groups.values():
+                group['live_window_end'] = self.live_stream['window_ms']
+
+            self.put_live_window(self.live_stream, 'clear')
 
     def send_cons(self):
         """
@@ -862,52 +3037,261 @@ class BlenderNEURON(object):
         :return: None
         """
 
-        cons = {}
+        with self.measure('gather_connections'):
+            cons = self.gather_cons()
 
-        for i, con in enumerate(self.connections):
-            pre = con.pre()
-            post = con.syn()
+        self.enqueue_packed_method("create_cons", pack_payload(cons))
 
-            # If source is PointProcess
-            if pre is not None:
-                # A PointProcess with a segment
-                if hasattr(pre, "get_segment"):
-                    pre_seg = pre.get_segment()
+    def gather_cons(self):
+        """
+        Gathers the start and end coordinates of all NetCon objects whose source and target are on sections. The
+        segments of all NetCons are found first, and their coordinates are then computed in bulk, reading the 3D
+        points of each section only once. See :any:`get_segment_coords`.
 
-                # Skip if the PP doesn't have a segment
-                else:
-                    continue
+        If the group has an 'aggregation_level', the NetCons are then binned into bundles, and if it has
+        'max_connections', the NetCons or bundles are reduced to that number. See :any:`setup_default_connections`.
+
+        :return: The connection group dictionary, with 'starts' and 'ends' lists of [x,y,z] coordinates, and the
+         'radii' of the drawn segments (empty if all are 1)
+        """
+
+        group = self.connection_data["Synapses"]
+        level = group.get('aggregation_level')
+        max_connections = group.get('max_connections')
+        read_weights = level is not None or (max_connections is not None and group.get('selection') == 'Weight')
+
+        pre_segs = []
+        post_segs = []
+        weights = []
+
+        for con in self.connections:
+            segs = self.get_con_segments(con)
+
+            if segs is not None:
+                pre_segs.append(segs[0])
+                post_segs.append(segs[1])
+
+                if read_weights:
+                    weights.append(abs(con.weight[0]))
+
+        # Sections shared by sources and targets are read once
+        coords = self.get_segment_coords(pre_segs + post_segs)
+        starts = coords[:len(pre_segs)]
+        ends = coords[len(pre_segs):]
+        radii = []
+
+        if level is not None:
+            if level == 'Cell':
+                cell_names = {}
+                keys = [(self.get_segment_cell_name(pre, cell_names), self.get_segment_cell_name(post, cell_names))
+                        for pre, post in zip(pre_segs, post_segs)]
+
+            elif level == 'Voxel':
+                size = float(group['voxel_size'])
+                keys = [tuple(int(floor(c / size)) for c in start + end) for start, end in zip(starts, ends)]
 
             else:
-                pre_loc = con.preloc()
+                raise Exception("Unknown connection aggregation level: " + str(level))
 
-                # If source is a segment
-                if pre_loc != -1.0:
-                    pre_seg = self.h.cas()(pre_loc)
-                    self.h.pop_section()
+            starts, ends, weights = self.aggregate_cons(keys, starts, ends, weights)
 
-                # Skip if it's neither a PP nor a segment
-                else:
-                    continue
+            max_weight = max(weights) if len(weights) > 0 else 0
 
-            # Check if post is a PointProcess on a Section
-            if post is None or hasattr(post, "get_segment") == False:
-                continue
+            if max_weight > 0:
+                radii = [max(1.0, group['max_radius'] * sqrt(weight / max_weight)) for weight in weights]
 
-            pre_pos = self.get_coords_along_sec(pre_seg.sec, pre_seg.x)
+        if max_connections is not None and len(starts) > max_connections:
+            if group.get('selection') == 'Weight':
+                kept = sorted(range(len(starts)), key=lambda i: weights[i], reverse=True)[:max_connections]
 
-            post_seg = post.get_segment()
-            post_pos = self.get_coords_along_sec(post_seg.sec, post_seg.x)
+            else:
+                kept = random.Random(0).sample(range(len(starts)), max_connections)
+
+            kept.sort()
+            starts = [starts[i] for i in kept]
+            ends = [ends[i] for i in kept]
+
+            if len(radii) > 0:
+                radii = [radii[i] for i in kept]
+
+        group["starts"] = starts
+        group["ends"] = ends
+        group["radii"] = radii
+
+        return group
+
+    def get_segment_cell_name(self, segment, cache):
+        """
+        Gets the name of the cell of a segment, or of its section if it's not part of a cell template
+
+        :param segment: A NEURON segment
+        :param cache: A dictionary of section cell names, to look up each section only once
+        :return: The cell (or section) name
+        """
+        section = segment.sec
+        name = cache.get(section)
+
+        if name is None:
+            cell = section.cell()
+            name = cell.hname() if cell is not None else section.name()
+            cache[section] = name
+
+        return name
+
+    @staticmethod
+    def aggregate_cons(keys, starts, ends, weights):
+        """
+        Bins connections into bundles, one per distinct key
+
+        :param keys: A hashable bin key of each connection e.g. (source cell name, target cell name)
+        :param starts: The [x,y,z] start coordinates of each connection
+        :param ends: The [x,y,z] end coordinates of each connection
+        :param weights: The weight of each connection
+        :return: The mean starts and ends, and the total weights, of the bundles
+        """
+        bundles = collections.OrderedDict()
+
+        for key, start, end, weight in zip(keys, starts, ends, weights):
+            bundle = bundles.get(key)
+
+            if bundle is None:
+                bundle = bundles[key] = [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0], 0, 0.0]
+
+            bundle_start, bundle_end = bundle[0], bundle[1]
+
+            for dim in range(3):
+                bundle_start[dim] += start[dim]
+                bundle_end[dim] += end[dim]
+
+            bundle[2] += 1
+            bundle[3] += weight
+
+        bundles = list(bundles.values())
+
+        return [[c / count for c in start] for start, end, count, weight in bundles], \
+               [[c / count for c in end] for start, end, count, weight in bundles], \
+               [weight for start, end, count, weight in bundles]
+
+    def get_con_segments(self, con):
+        """
+        Finds the source and target segments of a NetCon
+
+        :param con: A NEURON NetCon
+        :return: A (source segment, target segment) tuple, or None if either is not on a section
+        """
+        pre = con.pre()
+        post = con.syn()
+
+        # Check if post is a PointProcess on a Section
+        if post is None or hasattr(post, "get_segment") == False:
+            return None
+
+        # If source is PointProcess
+        if pre is not None:
+            # A PointProcess with a segment
+            if hasattr(pre, "get_segment"):
+                pre_seg = pre.get_segment()
+
+            # Skip if the PP doesn't have a segment
+            else:
+                return None
 
-            cons["NetCon["+str(i)+"]"] = [{
-                "name": "NetCon["+str(i)+"]",
-                "coords": pre_pos + post_pos,
-                "radii": [1,1]
-            }]
+        else:
+            pre_seg = self.get_con_source_segment(con)
+
+            # Skip if it's neither a PP nor a segment
+            if pre_seg is None:
+                return None
+
+        return pre_seg, post.get_segment()
+
+    def get_con_source_segment(self, con):
+        """
+        Finds the segment whose variable (e.g. v) is the source of a NetCon
+
+        :param con: A NEURON NetCon
+        :return: The segment, or None if the source is not a segment variable
+        """
+
+        # Available in newer versions of NEURON
+        try:
+            return con.preseg()
+
+        except (AttributeError, LookupError):
+            pass
+
+        pre_loc = con.preloc()
+
+        if pre_loc == -1.0:
+            return None
+
+        pre_seg = self.h.cas()(pre_loc)
+        self.h.pop_section()
+
+        return pre_seg
+
+    def get_segment_coords(self, segments):
+        """
+        Gets the 3d coordinates of many segments. With numpy, the 3d points of each section are read only once, and
+        the coordinates of all segments are interpolated in one batch. Same as calling :any:`get_coords_along_sec`
+        for each segment.
+
+        :param segments: A list of NEURON segments e.g. [soma(0.5), dend(0.1)]
+        :return: A list of [x,y,z] coordinates
+        """
+
+        if np is None:
+            return [list(self.get_coords_along_sec(seg.sec, seg.x)) for seg in segments]
+
+        if len(segments) == 0:
+            return []
+
+        # The 3d points of all sections, one after another
+        points = []
+        section_offsets = {}
+        offsets = []
+        counts = []
+        positions = []
+
+        for seg in segments:
+            section = seg.sec
+
+            if section not in section_offsets:
+                section_offsets[section] = (len(points), self.add_section_points(section, points))
+
+            offset, count = section_offsets[section]
+            offsets.append(offset)
+            counts.append(count)
+            positions.append(seg.x)
+
+        points = np.array(points)
+        offsets = np.array(offsets)
+        counts = np.array(counts)
+
+        # Positions along a section are interpolated between its 3d points by point index
+        along = np.array(positions) * (counts - 1)
+        first = np.minimum(along.astype(int), np.maximum(counts - 2, 0))
+        fraction = (along - first)[:, None]
+
+        start = points[offsets + first]
+        end = points[offsets + np.minimum(first + 1, counts - 1)]
+
+        return (start + (end - start) * fraction).tolist()
+
+    def add_section_points(self, section, points):
+        """
+        Appends the 3d points of a section to a list
+
+        :param section: A reference to a NEURON section
+        :param points: The list of (x,y,z) tuples to append to
+        :return: The number of points appended
+        """
+        count = self.get_coord_count(section)
 
-        self.connection_data["Synapses"]["cells"] = cons
+        for i in range(count):
+            points.append((self.h.x3d(i, sec=section), self.h.y3d(i, sec=section), self.h.z3d(i, sec=section)))
 
-        self.enqueue_method("create_cons", self.connection_data["Synapses"])
+        return count
 
     def get_coords_along_sec(self, section, along):
         """
@@ -1000,9 +3384,9 @@ class BlenderNEURON(object):
         d = group
         u = options
 
-        for k, v in u.iteritems():
-            if isinstance(v, collections.Mapping):
-                d[k] = update(d.get(k, {}), v)
+        for k, v in u.items():
+            if isinstance(v, dict):
+                d[k] = BlenderNEURON.update_group(d.get(k, {}), v)
 
             else:
                 d[k] = v
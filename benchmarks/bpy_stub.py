@@ -0,0 +1,465 @@
+"""
+A lightweight stand-in for the parts of the Blender API (bpy, bmesh, mathutils) used by the BlenderNEURON addon.
+
+It keeps just enough state (objects, curves, meshes, materials, keyframes) for the addon code to run outside of
+Blender, so the Python-side cost of the addon can be benchmarked. Call install() before importing the addon.
+"""
+
+import sys, types, colorsys, math
+
+
+class Anything(object):
+    """Accepts any attribute, index, or call. Used for the parts of the API that only need to exist."""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        value = Anything()
+        object.__setattr__(self, name, value)
+        return value
+
+    def __getitem__(self, key):
+        return self.__getattr__('item_' + str(key))
+
+    def __call__(self, *args, **kwargs):
+        return {'FINISHED'}
+
+    def __iter__(self):
+        return iter([])
+
+    def __contains__(self, item):
+        return False
+
+
+# mathutils
+
+class Vector(list):
+    def __init__(self, values=(0, 0, 0)):
+        super(Vector, self).__init__(float(v) for v in values)
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self, other))
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self, other))
+
+    def __mul__(self, scalar):
+        return Vector(a * scalar for a in self)
+
+    def __truediv__(self, scalar):
+        return Vector(a / scalar for a in self)
+
+    def __neg__(self):
+        return Vector(-a for a in self)
+
+    @property
+    def length(self):
+        return math.sqrt(sum(a * a for a in self))
+
+    def normalized(self):
+        return self / self.length
+
+    def to_track_quat(self, track, up):
+        return Anything()
+
+
+class Matrix(object):
+    def __init__(self, rows=None):
+        self.rows = rows or [[1.0 if r == c else 0.0 for c in range(4)] for r in range(4)]
+
+    @staticmethod
+    def Translation(vector):
+        m = Matrix()
+        for r in range(3):
+            m.rows[r][3] = vector[r]
+        return m
+
+    def __mul__(self, vector):
+        v = list(vector) + [1.0]
+        return Vector(sum(self.rows[r][c] * v[c] for c in range(4)) for r in range(3))
+
+    __matmul__ = __mul__
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+
+class Color(object):
+    def __init__(self, rgb=(0, 0, 0)):
+        self.r, self.g, self.b = rgb
+
+    @property
+    def hsv(self):
+        return colorsys.rgb_to_hsv(self.r, self.g, self.b)
+
+    @hsv.setter
+    def hsv(self, value):
+        self.r, self.g, self.b = colorsys.hsv_to_rgb(*value)
+
+
+# bpy.data collections
+
+class Collection(object):
+    def __init__(self, factory=None):
+        self.items = {}
+        self.factory = factory
+
+    def new(self, name, *args, **kwargs):
+        item = self.factory(name, *args, **kwargs)
+        self.add(item)
+        return item
+
+    def add(self, item):
+        # Blender makes names unique by adding a numeric suffix
+        name = item.name
+        suffix = 1
+
+        while name in self.items:
+            name = "%s.%03d" % (item.name, suffix)
+            suffix += 1
+
+        item.name = name
+        self.items[name] = item
+
+    def remove(self, item, *args, **kwargs):
+        self.items.pop(item.name, None)
+
+    def get(self, name, default=None):
+        return self.items.get(name, default)
+
+    def __getitem__(self, name):
+        return self.items[name]
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+    def keys(self):
+        return list(self.items.keys())
+
+    def foreach_get(self, attr, values):
+        values[:] = [getattr(item, attr) for item in self.items.values()]
+
+    def foreach_set(self, attr, values):
+        for item, value in zip(list(self.items.values()), values):
+            setattr(item, attr, float(value))
+
+
+class TextureSlot(Anything):
+    def keyframe_insert(self, data_path, index=-1, frame=0):
+        pass
+
+
+class TextureSlots(list):
+    def add(self):
+        slot = TextureSlot()
+        self.append(slot)
+        return slot
+
+
+class Material(object):
+    def __init__(self, name):
+        self.name = name
+        self.diffuse_color = (0.8, 0.8, 0.8)
+        self.emit = 0.0
+        self.raytrace_mirror = Anything()
+        self.texture_slots = TextureSlots()
+        self.animation_data = None
+        self.keyframes = {}
+
+    def keyframe_insert(self, data_path, frame):
+        self.keyframes.setdefault(data_path, {})[frame] = getattr(self, data_path)
+
+    def animation_data_clear(self):
+        self.keyframes = {}
+
+
+class PropertyCollection(list):
+    """A bpy_prop_collection of simple items, with add() and foreach_set()"""
+
+    def __init__(self, item_type, count=0):
+        super(PropertyCollection, self).__init__(item_type() for _ in range(count))
+        self.item_type = item_type
+
+    def add(self, count):
+        self.extend(self.item_type() for _ in range(int(count)))
+
+    def foreach_set(self, attr, values):
+        values = list(values)
+        size = len(values) // len(self) if len(self) > 0 else 0
+
+        if size * len(self) != len(values):
+            raise RuntimeError("internal error setting the array")
+
+        for i, item in enumerate(self):
+            setattr(item, attr, values[i] if size == 1 else values[i * size:(i + 1) * size])
+
+    def foreach_get(self, attr, values):
+        # Vector properties are flattened, like Blender does
+        flat = []
+
+        for item in self:
+            value = getattr(item, attr)
+            flat.extend(value if isinstance(value, (list, tuple)) else [value])
+
+        values[:] = flat
+
+
+class Image(object):
+    def __init__(self, name, width, height, alpha=False, float_buffer=False):
+        self.name = name
+        self.size = (width, height)
+        self.pixels = [0.0] * (width * height * 4)
+
+
+class Texture(Anything):
+    def __init__(self, name, type='IMAGE'):
+        self.name = name
+        self.type = type
+
+
+class Item(object):
+    material_index = 0
+    loop_total = 4
+    radius = 1.0
+    co = (0.0, 0.0, 0.0)
+    uv = (0.0, 0.0)
+
+
+class UVLayers(dict):
+    """Mesh UV or vertex color layers, with data for each loop"""
+
+    def new(self, name):
+        self[name] = UVLayer(self.mesh)
+        return self[name]
+
+
+class UVLayer(object):
+    def __init__(self, mesh):
+        self.data = ArrayData(sum(p.loop_total for p in mesh.polygons))
+
+
+class ArrayData(object):
+    """A bpy_prop_collection that keeps foreach_set values as arrays, for collections with many items (e.g. loops)"""
+
+    def __init__(self, count):
+        self.count = count
+        self.arrays = {}
+
+    def __len__(self):
+        return self.count
+
+    def foreach_set(self, attr, values):
+        values = list(values)
+
+        if self.count == 0 or len(values) % self.count != 0:
+            raise RuntimeError("internal error setting the array")
+
+        self.arrays[attr] = values
+
+    def foreach_get(self, attr, values):
+        values[:] = self.arrays[attr]
+
+
+class Spline(object):
+    def __init__(self):
+        self.bezier_points = PropertyCollection(Item, 1)
+        self.material_index = 0
+
+
+class Splines(PropertyCollection):
+    def __init__(self):
+        super(Splines, self).__init__(Spline)
+
+    def new(self, type):
+        spline = Spline()
+        self.append(spline)
+        return spline
+
+
+class Curve(object):
+    def __init__(self, name, type='CURVE'):
+        self.name = name
+        self.dimensions = '3D'
+        self.resolution_u = 1
+        self.fill_mode = 'FULL'
+        self.bevel_depth = 0.0
+        self.bevel_resolution = 0
+        self.splines = Splines()
+        self.materials = []
+
+    def copy(self):
+        curve = Curve(self.name)
+        curve.__dict__.update(dict((k, v) for k, v in self.__dict__.items() if k not in ('splines', 'materials')))
+        data.curves.add(curve)
+        return curve
+
+    def transform(self, matrix):
+        pass
+
+    def get_coords(self):
+        coords = []
+        for spline in self.splines:
+            for point in spline.bezier_points:
+                coords.append(point.co)
+        return coords
+
+
+class Mesh(object):
+    def __init__(self, name, poly_count=0, coords=None):
+        self.name = name
+        self.vertices = PropertyCollection(Item)
+        self.loops = PropertyCollection(Item)
+        self.polygons = PropertyCollection(Item, poly_count)
+        self.materials = []
+        self.coords = coords or []
+
+        # uv_textures.new() adds a layer to uv_layers
+        self.uv_layers = UVLayers()
+        self.uv_layers.mesh = self
+        self.uv_textures = self.uv_layers
+
+        # Vertex color layers have loop data, like UV layers
+        self.vertex_colors = UVLayers()
+        self.vertex_colors.mesh = self
+
+    def update(self, calc_edges=False):
+        pass
+
+    def transform(self, matrix):
+        pass
+
+    def get_coords(self):
+        if len(self.vertices) > 0:
+            return [v.co for v in self.vertices]
+
+        return self.coords
+
+
+class Object(object):
+    def __init__(self, name, object_data=None):
+        self.name = name
+        self.data = object_data
+        self.type = 'CURVE' if isinstance(object_data, Curve) else 'MESH' if isinstance(object_data, Mesh) else 'EMPTY'
+        self.select = False
+        self.location = Vector()
+        self.scale = Vector((1, 1, 1))
+        self.rotation_euler = Vector()
+        self.matrix_world = Matrix()
+        self.parent = None
+        self.constraints = Collection()
+
+    @property
+    def users_scene(self):
+        return tuple(scene for scene in data.scenes.values() if self in scene.objects)
+
+    @property
+    def matrix_basis(self):
+        # Location and scale, rotation is not modelled
+        return Matrix([[self.scale[r] if r == c else 0.0 for c in range(3)] + [self.location[r]] for r in range(3)] +
+                      [[0.0, 0.0, 0.0, 1.0]])
+
+    @property
+    def bound_box(self):
+        coords = self.data.get_coords() if self.data is not None else []
+
+        if len(coords) == 0:
+            return [(0, 0, 0)] * 8
+
+        mins = [min(c[d] for c in coords) for d in range(3)]
+        maxes = [max(c[d] for c in coords) for d in range(3)]
+
+        return [(x, y, z) for x in (mins[0], maxes[0]) for y in (mins[1], maxes[1]) for z in (mins[2], maxes[2])]
+
+    def to_mesh(self, scene, apply_modifiers, settings):
+        # Same polygon count as a bevelled bezier curve: each spline segment has resolution_u rings of faces
+        curve = self.data
+        faces_per_segment = curve.resolution_u * (curve.bevel_resolution * 2 + 4)
+        poly_count = sum((len(s.bezier_points) - 1) * faces_per_segment for s in curve.splines)
+
+        mesh = data.meshes.new(curve.name, poly_count, curve.get_coords())
+        mesh.materials = list(curve.materials)
+        return mesh
+
+
+class SceneObjects(list):
+    def link(self, obj):
+        self.append(obj)
+
+    def unlink(self, obj):
+        self.remove(obj)
+
+
+class Scene(Anything):
+    def __init__(self):
+        self.objects = SceneObjects()
+        self.frame_current = 0
+        self.frame_start = 1
+        self.frame_end = 250
+
+
+def reset():
+    """Empties the stub Blender data, leaving the default scene objects"""
+    global data
+
+    data = types.SimpleNamespace(
+        objects=Collection(Object),
+        curves=Collection(Curve),
+        meshes=Collection(Mesh),
+        materials=Collection(Material),
+        images=Collection(Image),
+        textures=Collection(Texture),
+        actions=Collection(),
+        lamps=Collection(),
+        cameras=Collection(),
+        worlds={"World": Anything()},
+        screens={"Default": types.SimpleNamespace(areas=[])},
+        scenes={"Scene": Scene()},
+    )
+
+    data.objects.new("Camera", None)
+    data.objects.new("Cube", None)
+    data.objects.new("Lamp", None)
+
+    bpy.data = data
+    bpy.context.scene = data.scenes["Scene"]
+
+
+bpy = types.ModuleType("bpy")
+bpy.context = Anything()
+bpy.ops = Anything()
+bpy.types = Anything()
+bpy.app = types.SimpleNamespace(
+    background=True,
+    binary_path="blender",
+    handlers=types.SimpleNamespace(frame_change_pre=[], frame_change_post=[], scene_update_post=[]),
+)
+
+data = None
+
+
+def install():
+    """Registers the stub modules, so that 'import bpy' etc. use them"""
+    mathutils = types.ModuleType("mathutils")
+    mathutils.Vector = Vector
+    mathutils.Matrix = Matrix
+    mathutils.Color = Color
+
+    sys.modules["bpy"] = bpy
+    sys.modules["bmesh"] = types.ModuleType("bmesh")
+    sys.modules["mathutils"] = mathutils
+
+    reset()
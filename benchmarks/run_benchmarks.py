@@ -0,0 +1,311 @@
+"""
+Times each stage of sending a model from NEURON to Blender, without NEURON or Blender installed.
+
+The model is a synthetic network (see synthetic.py). The BlenderNEURON addon server is compiled with pyximport
+(requires Cython and a C compiler) and runs against a stub of the Blender API (see bpy_stub.py), listening on a
+local port, so requests go through the same XML-RPC path as with a real Blender. Times of the stub are not times
+of real Blender, but they show the cost of the addon's own Python code, which is what regressions change.
+
+The model goes through the client's own gather_snapshot and send_snapshot, as in to_blender. Stages:
+
+    collect    - recording activity during the simulation (also reported per collection step)
+    gather     - gather_snapshot: reading 3D points, NetCon locations, and the collected activity
+    pack       - send_snapshot to a stub proxy: simplifying and packing payloads, without sending them
+    send       - send_snapshot to the addon server, until Blender has built the scene
+    transport  - the part of send spent in XML-RPC requests
+    visualize  - addon tasks creating the curves, meshes, and materials of cells and connections, and linking them
+    keyframe   - addon tasks animating the activity
+    clear      - the addon removing the scene's objects, materials, and animations
+
+Usage:
+
+    python benchmarks/run_benchmarks.py --cells 50 --depth 3 --repeat 3 --output results.json
+
+Use --send-pool and --send-workers to compare the packing pools, e.g. --send-workers 1 for serial packing.
+
+Results are printed as JSON, or saved to the --output file.
+"""
+
+import sys, os, time, json, argparse, threading, platform, contextlib
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "ForNEURON"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "ForBlender", "blender_neuron"))
+
+import synthetic, bpy_stub
+
+STAGES = ["collect", "gather", "pack", "send", "transport", "visualize", "keyframe", "clear"]
+
+# Addon tasks that animate activity, the others are counted as visualize
+KEYFRAME_TASKS = ["set_segment_activities", "set_spike_activities", "buffer_segment_activities",
+                  "buffer_spike_activities", "apply_activity_texture", "bake_activity_colors", "load_activity_archive"]
+
+
+class StageTimer(object):
+    """Accumulates the time spent in each stage of one benchmark run"""
+
+    def __init__(self):
+        self.seconds = dict((stage, 0.0) for stage in STAGES)
+
+    def time(self, stage, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        self.seconds[stage] += time.perf_counter() - start
+        return result
+
+
+def load_server():
+    """Compiles (on first use) and imports the addon server with the Blender API stub installed"""
+    bpy_stub.install()
+
+    import pyximport
+    pyximport.install(language_level=2)
+
+    import server
+    return server
+
+
+def start_server(server_module):
+    """Starts a NeuroServer listening on a free local port, returns the server and the port"""
+    bpy_stub.reset()
+
+    server = server_module.NeuroServer(global_name=None)
+    server.Port = 0
+
+    listener = threading.Thread(target=server.listenForExternal)
+    listener.daemon = True
+    listener.start()
+
+    while not hasattr(server, "server"):
+        time.sleep(0.01)
+
+    server.server.logRequests = False
+
+    return server, server.server.server_address[1]
+
+
+class PackingProxy(object):
+    """
+    Stands in for the addon's XML-RPC proxy, like the client's PackageRecorder, but only counts the requests and
+    their packed bytes. Sending a snapshot to it times the client's packing without transport.
+    """
+
+    def __init__(self):
+        self.tasks = 0
+        self.byte_count = 0
+
+    def enqueue_method(self, name, args, kwargs, timeout=None):
+        from blenderneuron.client import xmlrpclib
+
+        self.tasks += 1
+        self.byte_count += sum(len(arg.data) for arg in args if isinstance(arg, xmlrpclib.Binary))
+
+    def run_method(self, name, args, kwargs):
+        return self.enqueue_method(name, args, kwargs)
+
+    def cancel_all(self, session_id=None):
+        return 0
+
+    def cancel_tasks(self, task_ids):
+        return 0
+
+    def progress_start(self, session_id, totals):
+        return 0
+
+
+class QueuePump(object):
+    """Runs the addon's queued tasks as they arrive, as the addon's timer would, while the client is sending"""
+
+    def __init__(self, server):
+        self.server = server
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.server.service_queue()
+            time.sleep(0.001)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+        for task in self.server.tasks.values():
+            if task["status"] == "ERROR":
+                raise Exception("Addon task failed:\n" + str(task["error"]))
+
+
+def send_through_proxy(bn, proxy, snapshot):
+    """Sends the snapshot to the proxy instead of the addon, the way save_scene_package records it"""
+    bn.thread_clients.proxy = proxy
+
+    try:
+        bn.send_snapshot(snapshot)
+
+    finally:
+        del bn.thread_clients.proxy
+
+
+def run_once(args, server_module):
+    from blenderneuron.client import BlenderNEURON
+
+    timer = StageTimer()
+    server, port = start_server(server_module)
+
+    # The stub has no viewport to frame
+    server.show_full_scene = lambda: None
+
+    h = synthetic.create_model(args.cells, args.stems, args.depth, args.branching, args.n3d, args.nseg,
+                               args.connections, args.seed)
+    h.tstop = args.tstop
+
+    bn = BlenderNEURON(h, port=str(port), show_panel=False, show_tutorial=False)
+    bn.send_pool_type = args.send_pool
+    bn.send_workers = args.send_workers
+    bn.activity_backend = args.activity_backend
+
+    bn.setup_defaults_if_needed()
+
+    for group in bn.groups.values():
+        group['collection_period_ms'] = args.period
+        group['collector_stim'].interval = args.period
+
+        if args.level is not None:
+            group['3d_data']['color_level'] = args.level
+            group['3d_data']['interaction_level'] = 'Section' if args.level == 'Segment' else args.level
+
+    bn.connection_data["Synapses"]["aggregation_level"] = args.aggregation
+    bn.prepare_for_collection()
+
+    # Collect
+    h.finitialize()
+    steps = int(args.tstop / args.period) + 1
+
+    def collect():
+        for step in range(steps):
+            h.t = step * args.period
+
+            for name in bn.groups:
+                bn.collect_group(name)
+
+    timer.time("collect", collect)
+
+    # Gather
+    snapshot = timer.time("gather", bn.gather_snapshot)
+
+    # Pack, without sending
+    proxy = PackingProxy()
+    timer.time("pack", send_through_proxy, bn, proxy, snapshot)
+
+    # Send, with the addon building the scene as the requests arrive
+    bn.enable_metrics()
+    pump = QueuePump(server)
+
+    try:
+        timer.time("send", bn.send_snapshot, snapshot)
+
+    finally:
+        pump.stop()
+
+    metrics = bn.metrics(show=False)
+    timer.seconds["transport"] = metrics["client"]["stages"]["transport"]["seconds"]
+
+    for name, task in metrics["blender"]["tasks"].items():
+        timer.seconds["keyframe" if name in KEYFRAME_TASKS else "visualize"] += task["run_time"]
+
+    counts = {
+        "sections": len(h.sections),
+        "connections": len(snapshot["connections"]["starts"]) if snapshot["connections"] is not None else 0,
+        "collection_steps": steps,
+        "activity_parts": sum(len(parts) for times, parts, frames_per_ms in snapshot["activity"]),
+        "requests": proxy.tasks,
+        "payload_bytes": proxy.byte_count,
+        "objects": len(bpy_stub.data.objects),
+        "materials": len(bpy_stub.data.materials),
+        "keyframes": sum(len(keys) for mat in bpy_stub.data.materials for keys in mat.keyframes.values()),
+    }
+
+    timer.time("clear", server.clear)
+
+    for executor in bn.send_executors.values():
+        executor.shutdown()
+
+    server.stop()
+
+    return timer.seconds, counts
+
+
+def summarize(values):
+    ordered = sorted(values)
+
+    return {
+        "min": ordered[0],
+        "median": ordered[len(ordered) // 2],
+        "mean": sum(ordered) / len(ordered),
+        "runs": values,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the BlenderNEURON client and addon with a synthetic model")
+    parser.add_argument("--cells", type=int, default=10, help="Number of cells")
+    parser.add_argument("--stems", type=int, default=4, help="Number of dendrites starting at each soma")
+    parser.add_argument("--depth", type=int, default=3, help="Number of times each dendrite branches")
+    parser.add_argument("--branching", type=int, default=2, help="Number of child sections at each branch point")
+    parser.add_argument("--n3d", type=int, default=5, help="Number of 3D points per dendritic section")
+    parser.add_argument("--nseg", type=int, default=3, help="Number of segments per section")
+    parser.add_argument("--connections", type=int, default=None, help="Number of NetCons, two per cell by default")
+    parser.add_argument("--tstop", type=float, default=100.0, help="Simulation length in ms")
+    parser.add_argument("--period", type=float, default=1.0, help="Activity collection period in ms")
+    parser.add_argument("--level", choices=["Group", "Cell", "Section", "Segment"], default=None,
+                        help="Color level of the cells. Chosen from the cell count by default.")
+    parser.add_argument("--aggregation", choices=["Cell", "Voxel"], default=None,
+                        help="Bins connections into bundles by cell or voxel. Each NetCon is drawn by default.")
+    parser.add_argument("--activity-backend", choices=["keyframes", "texture", "baked"], default="keyframes",
+                        help="How the addon animates activity, see BlenderNEURON.activity_backend")
+    parser.add_argument("--send-pool", choices=["thread", "process"], default="thread",
+                        help="The pool that packs payloads, see BlenderNEURON.send_pool_type")
+    parser.add_argument("--send-workers", type=int, default=None,
+                        help="Number of packing workers, one per CPU core by default. 1 packs serially.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic model")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to run the benchmark")
+    parser.add_argument("--output", default=None, help="JSON file to save the results to. Printed if not set.")
+    args = parser.parse_args(argv)
+
+    server_module = load_server()
+
+    # The addon prints the progress of each task
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        runs = [run_once(args, server_module) for _ in range(args.repeat)]
+
+    stages = dict((stage, summarize([seconds[stage] for seconds, counts in runs])) for stage in STAGES)
+    stages["collect_step"] = summarize([seconds["collect"] / counts["collection_steps"] for seconds, counts in runs])
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "counts": runs[-1][1],
+        "seconds": stages,
+    }
+
+    if args.output is None:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+        for stage in STAGES + ["collect_step"]:
+            print("%-13s %10.4f s" % (stage, stages[stage]["min"]))
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
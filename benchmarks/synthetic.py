@@ -0,0 +1,342 @@
+"""
+Generates synthetic NEURON-like cell networks for benchmarking the BlenderNEURON client without NEURON.
+
+SyntheticH implements the subset of NEURON's "h" object used by the client (3D points, sections, segments,
+NetCons, NetStims, SectionList.allroots, FInitializeHandler etc.). Cells have a spherical soma and branching
+dendrites whose size is set by the number of stems, the branching depth and factor, n3d, and nseg.
+Segment voltages are a cheap analytic function of time and distance from the soma, so collected activity has
+realistic spikes that travel along the dendrites.
+"""
+
+import math, random
+
+
+class Ref(object):
+    """Stand-in for h.ref()"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __getitem__(self, index):
+        return self.value
+
+    def __setitem__(self, index, value):
+        self.value = value
+
+
+class Cell(object):
+    def __init__(self, name):
+        self.name = name
+        self.dend_count = 0
+
+    def hname(self):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+
+class Segment(object):
+    def __init__(self, sec, x):
+        self.sec = sec
+        self.x = x
+
+    @property
+    def v(self):
+        return self.sec.h.get_voltage(self.sec, self.x)
+
+
+class Section(object):
+    def __init__(self, h, name, cell, parent, points, nseg):
+        self.h = h
+        self._name = name
+        self._cell = cell
+        self._children = []
+        self.parentsec = parent
+        self.nseg = nseg
+
+        # Each point is (x, y, z, diam)
+        self.points = points
+        self.arc = [0.0]
+
+        for a, b in zip(points[:-1], points[1:]):
+            self.arc.append(self.arc[-1] + math.sqrt(sum((a[d] - b[d]) ** 2 for d in range(3))))
+
+        self.L = self.arc[-1]
+        self.diam = points[0][3]
+
+        # Path distance from the soma, used to delay the spikes
+        self.distance = parent.distance + parent.L if parent is not None else 0.0
+
+        if parent is not None:
+            parent._children.append(self)
+
+    def name(self):
+        return self._name
+
+    def hname(self):
+        return self._name
+
+    def cell(self):
+        return self._cell
+
+    def children(self):
+        return list(self._children)
+
+    def __call__(self, x):
+        # NEURON returns the segment that contains x
+        x = (int(min(x, 0.9999) * self.nseg) + 0.5) / self.nseg
+        return Segment(self, x)
+
+
+class PointProcess(object):
+    """A synapse at a segment"""
+
+    def __init__(self, seg):
+        self.seg = seg
+
+    def get_segment(self):
+        return self.seg
+
+
+class NetStim(object):
+    def __init__(self, x=0.5):
+        self.start = 0
+        self.interval = 10
+        self.number = 10
+        self.noise = 0
+
+
+class NetCon(object):
+    def __init__(self, h, source, target, source_seg=None):
+        self.h = h
+        self.source = source
+        self.target = target
+        self.source_seg = source_seg
+        self.weight = [0.0]
+        self.delay = 1.0
+        self.callback = None
+
+    def pre(self):
+        # Sources that are segment variables are not point processes
+        return self.source if self.source_seg is None else None
+
+    def syn(self):
+        return self.target
+
+    def preloc(self):
+        # Like NEURON, pushes the source section, which needs to be popped by the caller
+        if self.source_seg is None:
+            return -1.0
+
+        self.h.section_stack.append(self.source_seg.sec)
+        return self.source_seg.x
+
+    def record(self, callback):
+        self.callback = callback
+
+
+class NetConTemplate(object):
+    """h.NetCon creates NetCons, and iterating over it lists all existing NetCons"""
+
+    def __init__(self, h):
+        self.h = h
+        self.instances = []
+
+    def __call__(self, source, target, sec=None):
+        con = NetCon(self.h, source, target)
+        self.instances.append(con)
+        return con
+
+    def __iter__(self):
+        return iter(list(self.instances))
+
+    def __len__(self):
+        return len(self.instances)
+
+
+class SectionList(list):
+    def __init__(self, h):
+        super(SectionList, self).__init__()
+        self.h = h
+
+    def allroots(self):
+        self.extend(sec for sec in self.h.sections if sec.parentsec is None)
+
+
+class SyntheticH(object):
+    def __init__(self):
+        self.t = 0.0
+        self.dt = 0.025
+        self.tstop = 100.0
+        self.sections = []
+        self.section_stack = []
+        self.init_handlers = []
+        self.NetCon = NetConTemplate(self)
+
+    # Spike shape parameters
+    spike_interval = 25.0
+    spike_width = 1.0
+    conduction_velocity = 500.0 # um/ms
+
+    def get_voltage(self, sec, x):
+        delay = (sec.distance + sec.L * x) / self.conduction_velocity
+        phase = (self.t - delay) % self.spike_interval
+        return -65.0 + 95.0 * math.exp(-(phase / self.spike_width) ** 2)
+
+    # 3D point access
+    def n3d(self, sec):
+        return float(len(sec.points))
+
+    def x3d(self, i, sec):
+        return sec.points[int(i)][0]
+
+    def y3d(self, i, sec):
+        return sec.points[int(i)][1]
+
+    def z3d(self, i, sec):
+        return sec.points[int(i)][2]
+
+    def diam3d(self, i, sec):
+        return sec.points[int(i)][3]
+
+    def arc3d(self, i, sec):
+        return sec.arc[int(i)]
+
+    def define_shape(self, sec=None):
+        pass
+
+    def allsec(self):
+        return iter(self.sections)
+
+    def cas(self):
+        return self.section_stack[-1]
+
+    def pop_section(self):
+        self.section_stack.pop()
+
+    # Objects
+    def ref(self, value):
+        return Ref(value)
+
+    def SectionList(self):
+        return SectionList(self)
+
+    def NetStim(self, x=0.5):
+        return NetStim(x)
+
+    def FInitializeHandler(self, handler):
+        self.init_handlers.append(handler)
+        return handler
+
+    def finitialize(self):
+        self.t = 0.0
+
+        for handler in self.init_handlers:
+            handler()
+
+    def run(self):
+        """
+        Runs the "simulation": advances h.t in steps of dt, and calls the recorders of NetCons whose
+        source is a NetStim (e.g. BlenderNEURON activity collectors)
+        """
+        self.finitialize()
+
+        stims = [con for con in self.NetCon if con.callback is not None and isinstance(con.source, NetStim)]
+        next_events = [con.source.start for con in stims]
+
+        while self.t <= self.tstop:
+            for i, con in enumerate(stims):
+                if self.t >= next_events[i]:
+                    method, arg = con.callback
+                    method(arg)
+                    next_events[i] += con.source.interval
+
+            self.t += self.dt
+
+
+def create_model(cells=10, stems=4, depth=3, branching=2, n3d=5, nseg=3, connections=None, seed=0):
+    """
+    Creates a synthetic network
+
+    :param cells: The number of cells, laid out on a square grid
+    :param stems: The number of dendrites that start at the soma
+    :param depth: The number of times each stem branches
+    :param branching: The number of child sections at each branch point
+    :param n3d: The number of 3D points of each dendritic section
+    :param nseg: The number of segments of each section
+    :param connections: The number of NetCons between random cell segments. Two per cell if None.
+    :param seed: The random seed, the same parameters and seed create the same model
+    :return: A SyntheticH instance that contains the model
+    """
+    rng = random.Random(seed)
+    h = SyntheticH()
+
+    grid_size = int(math.ceil(math.sqrt(cells)))
+    spacing = 500.0
+
+    for ci in range(cells):
+        cell = Cell("SyntheticCell[%s]" % ci)
+        origin = ((ci % grid_size) * spacing, (ci // grid_size) * spacing, 0.0)
+
+        # Length = diameter, so the client spherizes it
+        soma_points = [(origin[0] - 10, origin[1], origin[2], 20.0), (origin[0] + 10, origin[1], origin[2], 20.0)]
+        soma = Section(h, cell.name + ".soma", cell, None, soma_points, 1)
+        h.sections.append(soma)
+
+        for stem in range(stems):
+            angle = 2 * math.pi * stem / stems
+            direction = (math.cos(angle), math.sin(angle), rng.uniform(-0.3, 0.3))
+            create_branch(h, rng, cell, soma, origin, direction, depth, branching, n3d, nseg, 3.0)
+
+    segments = [sec(0.5) for sec in h.sections]
+
+    if connections is None:
+        connections = cells * 2
+
+    for c in range(connections):
+        source = rng.choice(segments)
+        target_seg = rng.choice(segments)
+
+        # Connect different cells, unless there is only one
+        while cells > 1 and target_seg.sec.cell() is source.sec.cell():
+            target_seg = rng.choice(segments)
+
+        target = PointProcess(target_seg)
+
+        con = h.NetCon(None, target)
+        con.source_seg = source
+
+    return h
+
+
+def create_branch(h, rng, cell, parent, start, direction, depth, branching, n3d, nseg, diam):
+    length = rng.uniform(50, 150)
+
+    points = []
+
+    for p in range(n3d):
+        along = length * p / max(n3d - 1, 1)
+        wiggle = rng.uniform(-2, 2) if 0 < p < n3d - 1 else 0.0
+        points.append((
+            start[0] + direction[0] * along + wiggle,
+            start[1] + direction[1] * along + wiggle,
+            start[2] + direction[2] * along,
+            diam
+        ))
+
+    sec = Section(h, "%s.dend[%s]" % (cell.name, cell.dend_count), cell, parent, points, nseg)
+    cell.dend_count += 1
+    h.sections.append(sec)
+
+    if depth > 0:
+        end = points[-1][:3]
+
+        for b in range(branching):
+            spread = (b - (branching - 1) / 2.0) * 0.8
+            child_direction = (
+                direction[0] * math.cos(spread) - direction[1] * math.sin(spread),
+                direction[0] * math.sin(spread) + direction[1] * math.cos(spread),
+                direction[2] + rng.uniform(-0.2, 0.2)
+            )
+            create_branch(h, rng, cell, sec, end, child_direction, depth - 1, branching, n3d, nseg, diam * 0.7)
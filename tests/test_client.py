@@ -3,7 +3,7 @@
 
 import unittest
 
-import os, sys
+import os, sys, json, shutil
 from multiprocessing import Process, Queue
 from time import sleep
 from unittest import TestCase
@@ -88,6 +88,126 @@ class TestMorphologyExport(BlenderTestCase):
 
         self.in_separate_process(test)
 
+    def test_model_bounds_follow_transforms(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+                from neuron import h
+                soma = h.Section(name="Soma")
+                soma.L = soma.diam = 10
+
+                bn.to_blender()
+
+                bounds = bn.run_method("get_model_bounds")
+                self.assertAlmostEqual(bounds["ranges"][1], 10.0, places=3)
+
+                # Moved and scaled objects are framed where they are, not where they were created
+                bn.run_command("bpy.data.objects['Soma'].location.x += 100;"
+                               "bpy.data.objects['Soma'].scale.y = 2;")
+
+                moved = bn.run_method("get_model_bounds")
+                self.assertAlmostEqual(moved["mins"][0], bounds["mins"][0] + 100, places=3)
+                self.assertAlmostEqual(moved["ranges"][1], 20.0, places=3)
+
+        self.in_separate_process(test)
+
+    def test_object_origin(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+                from neuron import h
+                dend = h.Section(name="Dend")
+                h.pt3dadd(100, 0, 0, 2, sec=dend)
+                h.pt3dadd(110, 0, 0, 2, sec=dend)
+
+                bn.to_blender()
+
+                # The origin is at the center of the section, and the points stay where they are in NEURON
+                location = bn.run_command("return_value = tuple(bpy.data.objects['Dend'].location)")
+                points = bn.run_command("ob = bpy.data.objects['Dend']; "
+                                        "return_value = [tuple(ob.location + p.co) "
+                                        "for p in ob.data.splines[0].bezier_points]")
+
+                for actual, expected in zip(location, (105, 0, 0)):
+                    self.assertAlmostEqual(actual, expected, places=3)
+
+                for actual, expected in zip(points[0] + points[-1], (100, 0, 0, 110, 0, 0)):
+                    self.assertAlmostEqual(actual, expected, places=3)
+
+        self.in_separate_process(test)
+
+    def test_single_compartment_async(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender():
+                from neuron import h
+                soma = h.Section(name="Soma")
+                soma.L = soma.diam = 10
+
+                handle = bn.to_blender_async()
+                handle.result(timeout=60)
+
+                self.assertTrue(handle.done())
+                self.assertEqual(handle.cells_sent, 1)
+                self.assertTrue(bn.run_command("return_value = 'Soma' in bpy.data.objects"))
+
+                # A send that is not done by the timeout is not reported as successful
+                from blenderneuron.client import SendHandle
+                self.assertRaises(TimeoutError, SendHandle().result, 0.1)
+
+        self.in_separate_process(test)
+
+    def test_metrics(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender():
+                from neuron import h
+                soma = h.Section(name="Soma")
+                soma.L = soma.diam = 10
+
+                bn.enable_metrics()
+                bn.to_blender()
+
+                metrics = bn.metrics(show=False)
+                self.assertEqual(metrics['client']['stages']['gather_morphology']['calls'], 1)
+                self.assertEqual(metrics['blender']['tasks']['visualize_group']['count'], 1)
+                self.assertTrue(metrics['blender']['tasks']['visualize_group']['objects'] >= 1)
+                self.assertTrue(metrics['blender']['bytes_received'] > 0)
+
+        self.in_separate_process(test)
+
+    def test_send_pool(self):
+        def test():
+            from blenderneuron.quick import bn
+            from blenderneuron.client import pack_payload
+
+            with Blender():
+                from neuron import h
+                soma = h.Section(name="Soma")
+                soma.L = soma.diam = 10
+
+                bn.send_workers = 2
+                bn.send_pool_type = 'thread'
+
+                # Cells of a send that was cancelled before its group was built are not shown by the next send
+                stale = {"Stale": [{"name": "Stale", "coords": [0, 0, 0, 10, 0, 0], "radii": [1, 1]}]}
+                bn.enqueue_packed_method("add_group_cells", "all", pack_payload(stale))
+
+                bn.to_blender()
+                executor = bn.get_send_executor()
+                bn.to_blender()
+
+                # The pool is reused by all sends
+                self.assertIs(bn.get_send_executor(), executor)
+                self.assertTrue(bn.run_command("return_value = 'Soma' in bpy.data.objects"))
+                self.assertFalse(bn.run_command("return_value = 'Stale' in bpy.data.objects"))
+
+        self.in_separate_process(test)
+
     def test_multi_compartment(self):
         def test():
             from blenderneuron.quick import bn
@@ -168,6 +288,65 @@ class TestMorphologyExport(BlenderTestCase):
 
         self.in_separate_process(test)
 
+    def test_clear(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.prepare_for_collection()
+                h.run()
+                bn.to_blender()
+
+                bn.run_method("clear")
+
+                # The objects, their data, materials, and activity actions are all removed
+                for collection in ["objects", "curves", "meshes", "materials", "actions"]:
+                    self.assertEqual(bn.run_command("return_value = len([b for b in bpy.data.%s "
+                                                    "if b.name.startswith('TestCell')])" % collection), 0)
+
+                self.assertTrue(bn.run_command("return_value = 'Camera' in bpy.data.objects"))
+
+                # The names are free again, so a new send does not get numbered duplicates
+                bn.to_blender()
+                self.assertTrue(bn.run_command("return_value = 'TestCell[0].soma' in bpy.data.objects"))
+                self.assertTrue(bn.run_command("return_value = 'TestCell[0].soma.001' not in bpy.data.objects"))
+
+        self.in_separate_process(test)
+
+    def test_color_by_section_class(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender():
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc1 = h.TestCell()
+                tc2 = h.TestCell()
+
+                bn.prepare_for_collection()
+                bn.groups["all"]["3d_data"]["interaction_level"] = "Section"
+                bn.groups["all"]["3d_data"]["color_level"] = "Section"
+
+                bn.to_blender()
+
+                self.assertEqual(bn.groups["all"]["3d_data"]["section_classes"], ["TestCell.soma", "TestCell.dendrites"])
+
+                # Sections of the same class have the same color
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].soma'].diffuse_color == bpy.data.materials['TestCell[1].soma'].diffuse_color"))
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].dendrites[0]'].diffuse_color == bpy.data.materials['TestCell[1].dendrites[5]'].diffuse_color"))
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].soma'].diffuse_color != bpy.data.materials['TestCell[0].dendrites[0]'].diffuse_color"))
+
+        self.in_separate_process(test)
+
     def test_group_interaction_group_color_levels(self):
         def test():
             from blenderneuron.quick import bn
@@ -657,6 +836,143 @@ class TestConnectionExport(BlenderTestCase):
 
         self.in_separate_process(test)
 
+    def test_synapse_bundles(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+
+                s1 = h.Section(name="Soma1")
+                s2 = h.Section(name="Soma2")
+                s1.L = s1.diam = s2.L = s2.diam = 10
+
+                syns = [h.Exp2Syn(0.5, sec=s2) for i in range(3)]
+                ncs = [h.NetCon(s1(0.5)._ref_v, syn, sec=s1) for syn in syns]
+
+                bn.setup_defaults_if_needed()
+                bn.connection_data["Synapses"]["aggregation_level"] = "Cell"
+
+                # The three NetCons are drawn as one bundle
+                self.assertEqual(len(bn.gather_cons()["starts"]), 1)
+
+                bn.to_blender()
+
+                self.assertEqual(bn.run_command("return_value = len(bpy.data.objects['SynapsesGroup'].data.polygons)"), 16)
+
+        self.in_separate_process(test)
+
+class TestScenePackage(BlenderTestCase):
+    def test_batch_build(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            from neuron import h
+            h.load_file(test_hoc_file)
+            tc = h.TestCell()
+
+            ic = h.IClamp(0.5, sec=tc.soma)
+            ic.delay = 1
+            ic.dur = 3
+            ic.amp = 0.5
+
+            bn.prepare_for_collection()
+            h.run()
+
+            # No Blender instance is needed to save or build the package
+            bn.save_scene_package('tests/cell.bnpkg')
+            os.system("blender/blender --background --python ForBlender/blender_neuron/batch.py -- "
+                      "tests/cell.bnpkg tests/cell.blend")
+
+            # Read the objects and the activity keyframes back from the built scene
+            os.system("blender/blender --background tests/cell.blend --python-expr \"import bpy, json; "
+                      "json.dump({'objects': [ob.name for ob in bpy.data.objects], "
+                      "'keyframes': len(bpy.data.materials['TestCell[0].dendrites[9][0]']"
+                      ".animation_data.action.fcurves[0].keyframe_points)}, "
+                      "open('tests/cell.json', 'w'))\"")
+
+            try:
+                with open('tests/cell.json') as f:
+                    scene = json.load(f)
+
+                self.assertTrue(any(name.startswith('TestCell[0]') for name in scene['objects']))
+                self.assertGreater(scene['keyframes'], 1)
+
+            finally:
+                for file in ['tests/cell.bnpkg', 'tests/cell.blend', 'tests/cell.json']:
+                    if os.path.exists(file):
+                        os.remove(file)
+
+        self.in_separate_process(test)
+
+class TestRender(BlenderTestCase):
+    def test_render_animation_parallel(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                soma = h.Section(name="Soma")
+                soma.L = soma.diam = 10
+
+                bn.to_blender()
+                bn.run_command("bpy.data.scenes['Scene'].frame_start = 1;"
+                               "bpy.data.scenes['Scene'].frame_end = 4;"
+                               "bpy.data.scenes['Scene'].render.resolution_percentage = 1;")
+
+                progress = []
+
+                try:
+                    self.assertEqual(bn.render_animation_parallel('tests/frames', workers=2, chunk_frames=2,
+                                                                  progress_callback=progress.append,
+                                                                  poll_interval=0.1), 4)
+
+                    self.assertEqual(len(os.listdir('tests/frames')), 4)
+                    self.assertFalse(progress[-1]['running'])
+                    self.assertEqual(progress[-1]['done'], 4)
+                    self.assertEqual([c['status'] for c in progress[-1]['chunks']], ['DONE', 'DONE'])
+
+                    # Existing frames are not rendered again
+                    self.assertEqual(bn.render_animation_parallel('tests/frames'), 0)
+
+                finally:
+                    shutil.rmtree('tests/frames', ignore_errors=True)
+
+        self.in_separate_process(test)
+
+    def test_render_failure(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                soma = h.Section(name="Soma")
+                soma.L = soma.diam = 10
+
+                bn.to_blender()
+                bn.run_command("bpy.data.scenes['Scene'].frame_start = 1;"
+                               "bpy.data.scenes['Scene'].frame_end = 2;"
+                               "bpy.data.scenes['Scene'].render.resolution_percentage = 1;")
+
+                # A file where the frame directory should be makes every attempt fail
+                open('tests/blocked', 'w').close()
+
+                try:
+                    self.assertRaises(Exception, bn.render_animation_parallel, 'tests/blocked/frames',
+                                      max_attempts=2, poll_interval=0.1)
+
+                    progress = bn.get_render_progress()
+                    self.assertIsNotNone(progress['error'])
+                    self.assertEqual([c['status'] for c in progress['chunks']], ['FAILED'] * len(progress['chunks']))
+
+                finally:
+                    os.remove('tests/blocked')
+
+        self.in_separate_process(test)
+
 class TestActivityExport(BlenderTestCase):
 
     def test_activity_export(self):
@@ -687,5 +1003,574 @@ class TestActivityExport(BlenderTestCase):
 
         self.in_separate_process(test)
 
+    def test_live_stream(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.prepare_for_collection()
+                bn.start_live_stream(window_ms=2, max_pending_windows=1)
+                h.run()
+
+                self.assertEqual(bn.stop_live_stream(), 0)
+                self.assertIsNone(bn.live_stream)
+
+                bn.run_command("bpy.data.scenes['Scene'].frame_current = 7;")
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].dendrites[9][0]'].emit") == 2.0)
+
+        self.in_separate_process(test)
+
+    def test_live_stream_error(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                bn.prepare_for_collection()
+                bn.start_live_stream(window_ms=1, max_pending_windows=1)
+
+                # Sending fails as if the connection to Blender was lost
+                def fail(*args):
+                    raise IOError("Connection lost")
+
+                bn.enqueue_packed_method = fail
+
+                # The simulation is stopped by the error instead of waiting for the sender forever
+                try:
+                    h.run()
+                except Exception:
+                    pass
+
+                self.assertRaises(IOError, bn.stop_live_stream)
+                self.assertIsNone(bn.live_stream)
+
+        self.in_separate_process(test)
+
+    def test_activity_archive(self):
+        def test():
+            from blenderneuron.quick import bn
+            import json, tempfile
+            import numpy as np
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.prepare_for_collection()
+                h.run()
+
+                path = tempfile.mkdtemp()
+                bn.activity_archive_path = path
+                bn.to_blender()
+
+                # Chunks are frames x parts arrays of the resampled activity
+                with open(os.path.join(path, "index.json")) as f:
+                    group = json.load(f)["groups"][0]
+
+                chunk = np.load(os.path.join(path, group["chunks"][0]))
+                self.assertEqual(chunk.shape, (min(group["chunk_frames"], group["frame_count"]), len(group["parts"])))
+
+                # Blender shows the archived activity of the current frame
+                bn.run_command("bpy.data.scenes['Scene'].frame_set(1);")
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].dendrites[9][0]'].emit") == 0.0)
+
+                bn.run_command("bpy.data.scenes['Scene'].frame_set(7);")
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].dendrites[9][0]'].emit") > 1.0)
+
+        self.in_separate_process(test)
+
+    def test_activity_texture(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.activity_backend = 'texture'
+                bn.prepare_for_collection()
+                h.run()
+                bn.to_blender()
+
+                # Segment materials are replaced by one material that samples the activity image
+                self.assertTrue(bn.run_command("return_value = 'ActivityTexture' in bpy.data.images"))
+                self.assertFalse(bn.run_command("return_value = 'TestCell[0].dendrites[9][0]' in bpy.data.materials"))
+                self.assertTrue(bn.run_command("return_value = all(ob.data.materials[0].name == 'ActivityTexture' for ob in bpy.data.objects if ob.type == 'MESH' and ob.name.startswith('TestCell'))"))
+
+        self.in_separate_process(test)
+
+    def test_activity_texture_tiles(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                bn.to_blender()
+
+                # Activity longer and with more segments than fit in one small texture
+                bn.run_command("BN.buffered_activity = dict((m.name, ([0, 1000], [-65, 0])) "
+                               "for m in bpy.data.materials if m.name.startswith('TestCell'));"
+                               "BN.apply_activity_texture(max_size=64)")
+
+                sizes = bn.run_command("return_value = [tuple(i.size) for i in bpy.data.images "
+                                       "if i.name.startswith('ActivityTexture')]")
+                self.assertGreater(len(sizes), 1)
+                self.assertTrue(all(width <= 64 and height <= 64 for width, height in sizes))
+
+                # One texture slot per time tile
+                self.assertEqual(bn.run_command("return_value = len([s for s in bpy.data.materials['ActivityTexture']"
+                                                ".texture_slots if s is not None])"), 16)
+
+        self.in_separate_process(test)
+
+    def test_activity_baked_colors(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.activity_backend = 'baked'
+                bn.prepare_for_collection()
+                h.run()
+                bn.to_blender()
+
+                get_color = "return_value = list(next(ob for ob in bpy.data.objects if ob.type == 'MESH' and " \
+                            "'Activity' in ob.data.vertex_colors).data.vertex_colors['Activity'].data[0].color)"
+
+                bn.run_command("bpy.context.scene.frame_set(1)")
+                resting = bn.run_command(get_color)
+
+                bn.run_command("bpy.context.scene.frame_set(7)")
+                self.assertNotEqual(bn.run_command(get_color), resting)
+
+        self.in_separate_process(test)
+
+    def test_sessions(self):
+        def test():
+            from blenderneuron.quick import bn
+            from blenderneuron.client import BlenderNEURON
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                other = BlenderNEURON(h, show_panel=False, show_tutorial=False)
+
+                self.assertEqual(bn.open_session("first"), "S1")
+                self.assertEqual(other.open_session("second"), "S2")
+
+                bn.to_blender()
+                other.to_blender()
+
+                count_objects = "return_value = len([ob for ob in bpy.data.objects if ob.name.startswith('%s')])"
+                self.assertGreater(bn.run_command(count_objects % "S1:"), 0)
+                self.assertEqual(bn.run_command(count_objects % "S1:"), other.run_command(count_objects % "S2:"))
+
+                # Closing a session only removes its own objects
+                bn.close_session()
+                self.assertEqual(other.run_command(count_objects % "S1:"), 0)
+                self.assertGreater(other.run_command(count_objects % "S2:"), 0)
+
+                other.close_session()
+
+        self.in_separate_process(test)
+
+    def test_cancel_tasks(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                # Tasks past their deadline are skipped
+                expired = bn.enqueue_method("ping", timeout=0)
+                done = bn.enqueue_method("ping")
+                bn.run_method("ping")
+
+                self.assertEqual(bn.client.get_task_status(expired), "CANCELLED")
+                self.assertEqual(bn.client.get_task_status(done), "SUCCESS")
+
+                # Finished tasks can't be cancelled
+                self.assertFalse(bn.cancel_task(done))
+                self.assertEqual(bn.cancel_all(), 0)
+
+        self.in_separate_process(test)
+
+    def test_cancel_queued_task(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                soma = h.Section(name="Soma")
+                soma.L = soma.diam = 10
+
+                # Keeps the tasks after it queued
+                bn.enqueue_command("import time; time.sleep(3)")
+
+                queued = bn.enqueue_method("ping")
+                self.assertTrue(bn.cancel_task(queued))
+
+                # A send only replaces the tasks of the previous send, not other tasks of the client
+                user_task = bn.enqueue_method("ping")
+                first_send = bn.to_blender_async()
+
+                while len(first_send.task_ids) < 3:
+                    sleep(0.01)
+
+                bn.to_blender()
+                first_send.wait(10)
+
+                self.assertEqual(bn.client.get_task_status(queued), "CANCELLED")
+                self.assertEqual(bn.client.get_task_status(user_task), "SUCCESS")
+                self.assertIn("CANCELLED", [bn.client.get_task_status(task_id) for task_id in first_send.task_ids])
+                self.assertTrue(bn.run_command("return_value = 'Soma' in bpy.data.objects"))
+
+        self.in_separate_process(test)
+
+    def test_replace_send_in_flight(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                cells = [h.TestCell() for i in range(20)]
+
+                # Each section is sent in its own request, so the first send is still sending when the second starts
+                bn.send_chunk_size = 1
+                bn.prepare_for_collection()
+                h.run()
+
+                first_send = bn.to_blender_async()
+                self.assertFalse(first_send.done())
+
+                second_send = bn.to_blender_async()
+                second_send.result(60)
+
+                self.assertTrue(first_send.done())
+                self.assertIsNone(first_send.error)
+
+                # Nothing of the first send is created after the second send clears the scene
+                names = bn.run_command("return_value = [ob.name for ob in bpy.data.objects]")
+                self.assertEqual(len([name for name in names if name.startswith("TestCell")]), len(cells))
+                self.assertEqual([name for name in names if ".0" in name], [])
+
+        self.in_separate_process(test)
+
+    def test_send_pools_kept_while_sending(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                cells = [h.TestCell() for i in range(20)]
+
+                bn.send_chunk_size = 1
+                bn.send_workers = 2
+                bn.prepare_for_collection()
+                h.run()
+
+                # Async sends use a thread pool, which the process pool of the next send does not replace
+                first_send = bn.to_blender_async()
+                bn.send_pool_type = 'process'
+                bn.to_blender()
+
+                first_send.wait(60)
+                self.assertIsNone(first_send.error)
+                self.assertEqual(sorted(bn.send_executors), [('process', 2), ('thread', 2)])
+
+        self.in_separate_process(test)
+
+    def test_send_progress(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc1 = h.TestCell()
+                tc2 = h.TestCell()
+
+                bn.prepare_for_collection()
+                h.run()
+                bn.to_blender()
+
+                progress = bn.get_blender_progress()
+
+                self.assertEqual(progress['total']['cells'], 2)
+                self.assertEqual(progress['done']['cells'], 2)
+                self.assertEqual(progress['done']['activity'], progress['total']['activity'])
+                self.assertGreater(progress['rates']['keyframes'], 0)
+                self.assertEqual(progress['tasks'], 0)
+                self.assertTrue(bn.format_progress(progress).startswith('Blender Done'))
+
+        self.in_separate_process(test)
+
+    def test_busy_retry(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                # Any request while another one's task is pending is rejected as busy
+                bn.run_command("BN.max_pending_bytes = 1; BN.small_request_bytes = 0")
+
+                bn.enable_metrics()
+                bn.to_blender()
+
+                metrics = bn.metrics(show=False)
+                self.assertGreater(metrics['client']['counters']['busy_retries'], 0)
+                self.assertGreater(metrics['blender']['busy_responses'], 0)
+                self.assertTrue(bn.run_command("return_value = 'TestCell[0].soma' in bpy.data.objects"))
+
+        self.in_separate_process(test)
+
+    def test_group_coords_arrays(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                bn.to_blender()
+
+                # Group data stored in arrays can be read like the dictionaries
+                cells = bn.groups["all"]["3d_data"]["cells"]
+                self.assertEqual(list(cells.keys()), ["TestCell[0]"])
+                self.assertEqual(cells["TestCell[0]"][0]["name"], "TestCell[0].soma")
+                self.assertEqual(len(cells["TestCell[0]"][0]["coords"]), 3 * len(cells["TestCell[0]"][0]["radii"]))
+
+                bn.free_sent_coords = True
+                bn.to_blender()
+
+                self.assertEqual(len(bn.groups["all"]["3d_data"]["cells"]), 0)
+                self.assertTrue(bn.run_command("return_value = 'TestCell[0].soma' in bpy.data.objects"))
+
+        self.in_separate_process(test)
+
+    def test_sparse_activity(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.prepare_for_collection()
+                bn.groups["all"]["sparse_threshold"] = 1.0
+                h.run()
+
+                # Parts at rest are not stored at every collection
+                events = bn.groups["all"]["activity_events"]
+                self.assertLess(len(events), len(bn.groups["all"]["collection_times"]) * len(events.names))
+
+                bn.to_blender()
+
+                bn.run_command("bpy.data.scenes['Scene'].frame_current = 1;")
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].dendrites[9][0]'].emit") == 0.0)
+
+                bn.run_command("bpy.data.scenes['Scene'].frame_current = 7;")
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0].dendrites[9][0]'].emit") == 2.0)
+
+        self.in_separate_process(test)
+
+    def test_spike_activity(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.prepare_for_collection()
+                bn.groups["all"]["record_spikes"] = True
+                bn.prepare_for_collection()
+                h.run()
+
+                spike_times = bn.get_spike_snapshot()[0][1][0]
+                self.assertGreater(len(spike_times), 0)
+
+                bn.to_blender()
+
+                # Cells are colored at the Cell level, with a pulse at each spike
+                bn.run_command("bpy.data.scenes['Scene'].frame_current = 0;")
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0]'].emit") == 0.0)
+
+                bn.run_command("bpy.data.scenes['Scene'].frame_current = %s;" % (int(spike_times[0] * 2) + 1))
+                self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0]'].emit") > 0.0)
+
+        self.in_separate_process(test)
+
+    def test_spike_activity_with_archive_and_live_stream(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                ic = h.IClamp(0.5, sec=tc.soma)
+                ic.delay = 1
+                ic.dur = 3
+                ic.amp = 0.5
+
+                bn.prepare_for_collection()
+                bn.groups["all"]["record_spikes"] = True
+                bn.prepare_for_collection()
+
+                # Spikes are not collected in windows
+                self.assertRaises(Exception, bn.start_live_stream)
+
+                h.run()
+                spike_times = bn.get_spike_snapshot()[0][1][0]
+
+                # With an archive, the spikes are still shown
+                bn.activity_archive_path = 'tests/spike_archive'
+
+                try:
+                    bn.to_blender()
+
+                    bn.run_command("bpy.data.scenes['Scene'].frame_current = %s;" % (int(spike_times[0] * 2) + 1))
+                    self.assertTrue(bn.run_command("return_value = bpy.data.materials['TestCell[0]'].emit") > 0.0)
+
+                finally:
+                    shutil.rmtree('tests/spike_archive', ignore_errors=True)
+
+        self.in_separate_process(test)
+
+    def test_frame_aligned_collection(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            with Blender(keep=False):
+
+                from neuron import h
+                h.load_file(test_hoc_file)
+                tc = h.TestCell()
+
+                bn.prepare_for_collection()
+                group = bn.groups["all"]
+                group["collection_period_ms"] = "auto"
+                group["frame_samples"] = 4
+                group["frame_aggregation"] = "max"
+                bn.prepare_for_collection()
+                h.run()
+
+                # One value at the time of each frame
+                times = group["collection_times"]
+                self.assertEqual(len(times), int(h.tstop * group["frames_per_ms"]) + 1)
+                self.assertEqual([t * group["frames_per_ms"] for t in times], list(range(len(times))))
+
+        self.in_separate_process(test)
+
+    def test_collection_plan_pointers(self):
+        def test():
+            from blenderneuron.quick import bn
+
+            from neuron import h
+            h.load_file(test_hoc_file)
+            tc = h.TestCell()
+
+            bn.prepare_for_collection()
+            group = bn.groups["all"]
+            group["3d_data"]["color_level"] = "Segment"
+            bn.prepare_for_collection()
+            h.run()
+
+            plan = group["collection_plan"]
+            self.assertIsNotNone(plan["pointers"])
+
+            # The values gathered through the pointers are the segment voltages
+            bn.collect_group("all")
+            last_values = [group["collected_activity"][name][-1] for name in plan["names"]]
+            self.assertEqual(last_values, [seg.v for seg in plan["segments"]])
+
+            # Changing the segments rebuilds the plan at the next initialization, instead of reading stale pointers
+            tc.soma.nseg = 3
+            h.run()
+
+            self.assertIsNot(group["collection_plan"], plan)
+            bn.collect_group("all")
+            plan = group["collection_plan"]
+            last_values = [group["collected_activity"][name][-1] for name in plan["names"]]
+            self.assertEqual(last_values, [seg.v for seg in plan["segments"]])
+
+            # Without changes, the plan is reused
+            h.run()
+            self.assertIs(group["collection_plan"], plan)
+
+        self.in_separate_process(test)
+
 if __name__ == '__main__':
     unittest.main()